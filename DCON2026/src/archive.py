@@ -0,0 +1,244 @@
+"""
+アーカイブモジュール
+終わった日のデータを日別の列指向ファイル（Parquet または numpy .npz）に保存する
+
+ディレクトリ構成:
+    archive/
+        manifest.json                     パーティションの一覧
+        training_data/2026-01-08.parquet  1日分（ローカル時刻の0時〜24時）
+        pvt_results/2026-01-08.parquet
+
+pyarrowがあればParquet、なければ .npz で保存する（読み込みは両方に対応）。
+"""
+
+import json
+import os
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401（pandasのParquet入出力に必要）
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# .npz で文字列列の欠損を表すマスクの接頭辞
+NULL_MASK_PREFIX = "__null__"
+
+
+def day_bounds(day):
+    """日付のローカル時刻での範囲 [start, end) をUNIX時刻で返す"""
+    start = datetime(day.year, day.month, day.day)
+    end = start + timedelta(days=1)
+    return start.timestamp(), end.timestamp()
+
+
+def day_of(timestamp):
+    """UNIX時刻が属する日付（ローカル時刻）"""
+    return datetime.fromtimestamp(timestamp).date()
+
+
+class DailyArchive:
+    """
+    日別パーティションの保存・読み込み
+
+    パーティションの一覧は manifest.json に記録し、読み込み時は
+    ファイルを開かずに時間範囲で対象を絞り込む。
+    """
+
+    def __init__(self, archive_dir="archive", fmt=None):
+        """
+        Args:
+            archive_dir: アーカイブの保存先ディレクトリ
+            fmt: "parquet" / "npz"（Noneの場合はpyarrowがあればParquet）
+        """
+        self.archive_dir = archive_dir
+        self.fmt = fmt or ("parquet" if PARQUET_AVAILABLE else "npz")
+        if self.fmt == "parquet" and not PARQUET_AVAILABLE:
+            raise RuntimeError("Parquet形式にはpyarrowが必要です。pip install pyarrowを実行してください。")
+        os.makedirs(archive_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    # ==========================================================
+    #  マニフェスト
+    # ==========================================================
+
+    def _manifest_path(self):
+        return os.path.join(self.archive_dir, MANIFEST_NAME)
+
+    def _load_manifest(self):
+        path = self._manifest_path()
+        if not os.path.exists(path):
+            return {"version": MANIFEST_VERSION, "tables": {}}
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        """一時ファイルに書いてから置き換える（書き込み途中で壊れないように）"""
+        path = self._manifest_path()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def partitions(self, table, start=None, end=None):
+        """
+        時間範囲 [start, end) と重なるパーティションを日付順に返す
+
+        Returns:
+            [(日付文字列, パーティション情報), ...]
+        """
+        entries = self.manifest["tables"].get(table, {})
+        result = []
+        for key in sorted(entries):
+            entry = entries[key]
+            if start is not None and entry["max_ts"] < start:
+                continue
+            if end is not None and entry["min_ts"] >= end:
+                continue
+            result.append((key, entry))
+        return result
+
+    def drop_before(self, day):
+        """dayより前のパーティションを削除（保持期間の適用）。削除した数を返す"""
+        cutoff = day.isoformat()
+        dropped = 0
+        for table, entries in self.manifest["tables"].items():
+            for key in [k for k in entries if k < cutoff]:
+                path = os.path.join(self.archive_dir, entries.pop(key)["file"])
+                if os.path.exists(path):
+                    os.remove(path)
+                dropped += 1
+        if dropped:
+            self._save_manifest()
+        return dropped
+
+    # ==========================================================
+    #  書き込み・読み込み
+    # ==========================================================
+
+    def write_partition(self, table, day, df):
+        """
+        1日分の行をパーティションに保存（既存のパーティションがあれば統合する）
+
+        Args:
+            table: テーブル名
+            day: 日付（datetime.date）
+            df: id, timestamp列を含むDataFrame
+        """
+        key = day.isoformat()
+        entries = self.manifest["tables"].setdefault(table, {})
+        if key in entries:
+            existing = self.read_partition(table, key)
+            df = pd.concat([existing, df], ignore_index=True)
+            df = df.drop_duplicates(subset="id", keep="last")
+        df = df.sort_values("timestamp", kind="stable").reset_index(drop=True)
+
+        relative = os.path.join(table, f"{key}.{self.fmt}")
+        path = os.path.join(self.archive_dir, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        if self.fmt == "parquet":
+            df.to_parquet(tmp_path, index=False)
+        else:
+            self._write_npz(tmp_path, df)
+        os.replace(tmp_path, path)
+
+        # 以前と別形式で保存していた場合は古いファイルを消す
+        old = entries.get(key)
+        if old and old["file"] != relative:
+            old_path = os.path.join(self.archive_dir, old["file"])
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+        entries[key] = {
+            "file": relative,
+            "format": self.fmt,
+            "rows": int(len(df)),
+            "min_ts": float(df["timestamp"].min()),
+            "max_ts": float(df["timestamp"].max()),
+            "max_id": int(df["id"].max()),
+            "columns": list(df.columns),
+        }
+        self._save_manifest()
+
+    def read_partition(self, table, key, columns=None):
+        """
+        パーティションを読み込む（columnsを指定するとその列だけ読む）
+
+        後から追加された列など、パーティションにない列は欠損値で埋める。
+        """
+        entry = self.manifest["tables"][table][key]
+        path = os.path.join(self.archive_dir, entry["file"])
+        stored = columns
+        if columns is not None:
+            stored = [c for c in columns if c in entry["columns"]]
+        if entry["format"] == "parquet":
+            df = pd.read_parquet(path, columns=stored)
+        else:
+            df = self._read_npz(path, stored)
+        return df if columns is None else df.reindex(columns=columns)
+
+    def read_range(self, table, start=None, end=None, columns=None):
+        """時間範囲 [start, end) の行を時刻順に読み込む"""
+        frames = []
+        for key, _ in self.partitions(table, start, end):
+            read_columns = None if columns is None else list(dict.fromkeys(["timestamp"] + columns))
+            df = self.read_partition(table, key, read_columns)
+            mask = np.ones(len(df), dtype=bool)
+            if start is not None:
+                mask &= df["timestamp"].to_numpy() >= start
+            if end is not None:
+                mask &= df["timestamp"].to_numpy() < end
+            frames.append(df[mask])
+        if not frames:
+            return None
+        df = pd.concat(frames, ignore_index=True)
+        return df if columns is None else df[columns]
+
+    @staticmethod
+    def _write_npz(path, df):
+        """列ごとの配列として保存（文字列列は欠損マスクを別に持つ）"""
+        arrays = {}
+        for column in df.columns:
+            values = df[column]
+            if not (pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values)):
+                mask = values.isna().to_numpy()
+                arrays[column] = values.fillna("").to_numpy(dtype=str)
+                arrays[NULL_MASK_PREFIX + column] = mask
+            else:
+                arrays[column] = values.to_numpy()
+        # np.savezは拡張子がなければ付けるので、ファイルオブジェクトで渡す
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @staticmethod
+    def _read_npz(path, columns=None):
+        with np.load(path) as data:
+            names = [n for n in data.files if not n.startswith(NULL_MASK_PREFIX)]
+            if columns is not None:
+                names = [n for n in names if n in columns]
+            result = {}
+            for name in names:
+                values = data[name]
+                mask_name = NULL_MASK_PREFIX + name
+                if mask_name in data.files:
+                    values = values.astype(object)
+                    values[data[mask_name]] = None
+                result[name] = values
+        df = pd.DataFrame(result)
+        return df if columns is None else df[[c for c in columns if c in df.columns]]
+
+
+def closed_days(first_timestamp, today=None):
+    """first_timestampの日から昨日までの日付（今日はまだ終わっていないので含めない）"""
+    today = today or date.today()
+    day = day_of(first_timestamp)
+    while day < today:
+        yield day
+        day += timedelta(days=1)
@@ -5,13 +5,18 @@ M5Stack ENV III Unitから温度・湿度・気圧を取得
 
 import serial
 import json
+import threading
 import time
+from collections import deque
+from sensor_protocol import FrameDecoder, MODE_REQUEST, MODE_ACK
+from event_bus import EnvEvent
 
 
 class EnvironmentCollector:
     """環境データ（温度・湿度・気圧）を収集"""
 
-    def __init__(self, port=None, baudrate=115200):
+    def __init__(self, port=None, baudrate=115200, window_sec=60, max_samples=1024,
+                 protocol="auto", bus=None):
         """
         M5Stack ENV III Unitとのシリアル通信を初期化
 
@@ -19,10 +24,18 @@ class EnvironmentCollector:
             port: シリアルポート
                   - macOS: "/dev/tty.usbserial-xxxxx" or "/dev/cu.usbserial-xxxxx"
                   - Windows: "COM3", "COM4", etc.
+                  - pyserialのURL（"loop://" など、テスト用）
                   - None の場合は自動検出を試みる
             baudrate: ボーレート（デフォルト: 115200）
+            window_sec: 最小・平均・最大を計算する時間幅（秒）
+            max_samples: 保持するサンプル数の上限
+            protocol: 通信形式 "auto"（バイナリを要求し、応答がなければJSON）/ "json" / "binary"
+            bus: 受信したサンプル（EnvEvent）を発行するEventBus
         """
         self.port = port
+        self.protocol = protocol
+        self.mode = "json"  # 実際に使用中の通信形式
+        self.decoder = FrameDecoder()
         self.baudrate = baudrate
         self.serial = None
         self.last_data = {
@@ -31,6 +44,17 @@ class EnvironmentCollector:
             "pressure": 1013.25
         }
 
+        # 受信サンプル (timestamp, temperature, humidity, pressure)
+        self.window_sec = window_sec
+        self.samples = deque(maxlen=max_samples)
+        self.parse_errors = 0
+        self.lock = threading.Lock()
+        self.bus = bus
+
+        # バックグラウンド受信スレッド
+        self.stop_event = threading.Event()
+        self.reader_thread = None
+
         # M5Stackに接続を試みる
         if port:
             self.connect(port, baudrate)
@@ -38,8 +62,12 @@ class EnvironmentCollector:
     def connect(self, port, baudrate=115200):
         """M5Stackに接続"""
         try:
-            self.serial = serial.Serial(port, baudrate, timeout=1)
+            # serial_for_url は通常のポート名に加えて loop:// などのURLも扱える
+            self.serial = serial.serial_for_url(port, baudrate, timeout=1)
             print(f"✓ M5Stack ENV III Unit接続成功: {port}")
+            self.mode = self.negotiate_protocol()
+            print(f"  通信形式: {self.mode}")
+            self.start_reader()
             return True
         except serial.SerialException as e:
             print(f"⚠ M5Stack接続エラー: {e}")
@@ -70,8 +98,144 @@ class EnvironmentCollector:
 
         return False
 
+    def negotiate_protocol(self, timeout=1.0):
+        """
+        バイナリフレーム形式を要求し、使用する通信形式を決める
+
+        デバイスが時間内に MODE_ACK を返せば "binary"、返さなければ "json"。
+        待っている間に届いたJSON行は通常どおりサンプルとして取り込む。
+        """
+        if self.protocol == "json":
+            return "json"
+
+        self.serial.write(MODE_REQUEST)
+        self.serial.flush()
+        deadline = time.monotonic() + timeout
+        original_timeout = self.serial.timeout
+        self.serial.timeout = 0.1
+        try:
+            while time.monotonic() < deadline:
+                line = self.serial.readline()
+                if not line:
+                    continue
+                if line.strip() == MODE_ACK:
+                    return "binary"
+                self.parse_line(line)
+        finally:
+            self.serial.timeout = original_timeout
+
+        if self.protocol == "binary":
+            print("⚠ バイナリ形式の応答がありません。JSON形式で通信します")
+        return "json"
+
+    def parse_line(self, line, received_time=None):
+        """1行分のJSONを解析してサンプルとして保持（成功したらTrue）"""
+        try:
+            data = json.loads(line.decode('utf-8').strip())
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            # 不完全な行など。readlineが改行で区切るので次の行から再同期される
+            self.parse_errors += 1
+            return False
+        if not isinstance(data, dict):
+            self.parse_errors += 1
+            return False
+
+        self.store_sample(data, received_time)
+        return True
+
+    def store_sample(self, data, received_time=None):
+        """受信したサンプル（JSON・バイナリ共通の辞書）を保持"""
+        received_time = time.time() if received_time is None else received_time
+        with self.lock:
+            self.last_data = {
+                "temperature": data.get("temp", self.last_data["temperature"]),
+                "humidity": data.get("humidity", self.last_data["humidity"]),
+                "pressure": data.get("pressure", self.last_data["pressure"]),
+                "timestamp": received_time
+            }
+            if "noise" in data:
+                self.last_data["noise_level"] = data["noise"]
+            sample = (received_time,
+                      self.last_data["temperature"],
+                      self.last_data["humidity"],
+                      self.last_data["pressure"])
+            self.samples.append(sample)
+        if self.bus is not None:
+            self.bus.publish(EnvEvent(*sample))
+
+    def _reader_loop(self):
+        """シリアルポートを常に読み続けるバックグラウンドループ"""
+        while not self.stop_event.is_set():
+            try:
+                if self.mode == "binary":
+                    data = self.serial.read(self.serial.in_waiting or 1)
+                else:
+                    data = self.serial.readline()
+            except Exception as e:
+                print(f"⚠ センサーデータ受信エラー: {e}")
+                break
+            if not data:
+                continue
+            if self.mode == "binary":
+                received_time = time.time()
+                for sample in self.decoder.feed(data):
+                    self.store_sample(sample, received_time)
+            else:
+                self.parse_line(data)
+        self.reader_thread = None
+
+    def start_reader(self):
+        """バックグラウンドでの受信を開始"""
+        if self.serial and self.reader_thread is None:
+            self.stop_event.clear()
+            self.reader_thread = threading.Thread(target=self._reader_loop, daemon=True)
+            self.reader_thread.start()
+
+    def stop_reader(self):
+        """バックグラウンドでの受信を停止"""
+        thread = self.reader_thread
+        if thread:
+            self.stop_event.set()
+            thread.join(timeout=2)
+            self.reader_thread = None
+
+    def get_window_stats(self, now=None):
+        """直近window_sec秒のサンプルから最新値と最小・平均・最大を計算（I/Oなし）"""
+        now = time.time() if now is None else now
+        with self.lock:
+            recent = [s for s in self.samples if now - s[0] <= self.window_sec]
+            latest = dict(self.last_data)
+
+        stats = {
+            "temperature": latest["temperature"],
+            "humidity": latest["humidity"],
+            "pressure": latest["pressure"],
+            "timestamp": now,
+            "sample_count": len(recent),
+            "protocol": self.mode,
+            "parse_errors": self.parse_errors,
+            "resync_count": self.decoder.resyncs
+        }
+        if "noise_level" in latest:
+            stats["noise_level"] = latest["noise_level"]
+        if recent:
+            stats["sample_age_sec"] = now - recent[-1][0]
+            for i, key in enumerate(("temperature", "humidity", "pressure"), start=1):
+                values = [s[i] for s in recent]
+                stats[f"{key}_min"] = min(values)
+                stats[f"{key}_mean"] = sum(values) / len(values)
+                stats[f"{key}_max"] = max(values)
+        else:
+            # ウィンドウ内に受信がなければモックデータ扱い
+            stats["mock"] = True
+        return stats
+
     def read_sensor_data(self):
         """センサーデータを読み取り"""
+        if self.reader_thread is not None:
+            # 受信スレッドが動いている場合は保持しているサンプルを返すだけ
+            return self.get_window_stats()
+
         if self.serial and self.serial.in_waiting > 0:
             try:
                 line = self.serial.readline().decode('utf-8').strip()
@@ -108,6 +272,7 @@ class EnvironmentCollector:
 
     def close(self):
         """シリアル接続を閉じる"""
+        self.stop_reader()
         if self.serial:
             self.serial.close()
             print("M5Stack接続を閉じました")
@@ -0,0 +1,268 @@
+"""
+イベントバスモジュール
+収集モジュールが生イベントを型付きのタプルで発行し、購読者ごとの上限付きキューに配る
+
+発行側（OSフックのコールバックなど）はキューに入れるだけで、処理は待たない。
+キューが満杯の場合は新しいイベントを捨てて購読者ごとに数える（発行側を止めない）。
+購読者はそれぞれ自分のスレッドでキューを読む。
+
+プライバシー保護: キーの内容・ウィンドウタイトルはイベントに含めない。
+"""
+
+import json
+import queue
+import threading
+import time
+from typing import NamedTuple
+
+
+# ==========================================================
+#  イベント型
+# ==========================================================
+
+class KeyEvent(NamedTuple):
+    """キー押下・解放（flagsは keystroke_collector の FLAG_*）"""
+    timestamp: float
+    flags: int
+    interval_ms: float  # 押下: 前回の押下からの間隔（なければnan）
+    duration_ms: float  # 解放: 押下していた時間（押下時はnan）
+
+
+class MoveEvent(NamedTuple):
+    """マウス移動"""
+    timestamp: float
+    x: float
+    y: float
+
+
+class ClickEvent(NamedTuple):
+    """マウスクリック"""
+    timestamp: float
+    x: float
+    y: float
+    button: str
+    pressed: bool
+
+
+class FocusEvent(NamedTuple):
+    """フォーカス中のウィンドウの切り替え"""
+    timestamp: float
+    window_hash: str
+    work_category: str
+
+
+class EnvEvent(NamedTuple):
+    """環境センサーのサンプル"""
+    timestamp: float
+    temperature: float
+    humidity: float
+    pressure: float
+
+
+class PvtEvent(NamedTuple):
+    """PVTテストの1試行の反応"""
+    timestamp: float
+    reaction_time_ms: float
+    input_latency_ms: float  # 測れない場合（Tkのキーバインド）はnan
+
+
+EVENT_TYPES = (KeyEvent, MoveEvent, ClickEvent, FocusEvent, EnvEvent, PvtEvent)
+
+# 購読者スレッドの終了の合図
+_STOP = object()
+
+
+class Subscription:
+    """購読者1つ分の上限付きキューと統計"""
+
+    def __init__(self, name, event_types, maxsize=1024):
+        self.name = name
+        self.event_types = tuple(event_types)
+        self.queue = queue.Queue(maxsize)
+        # 発行側は複数のスレッドなので、統計と closed はロックで守る（put_nowaitは待たない）
+        self.lock = threading.Lock()
+        self.delivered = 0
+        self.dropped = 0
+        self.closed = False
+        self.thread = None
+
+    def offer(self, event):
+        """キューに入れる（満杯なら捨てて数える。待たない）"""
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.queue.put_nowait(event)
+                self.delivered += 1
+            except queue.Full:
+                self.dropped += 1
+
+    def get(self, timeout=None):
+        """次のイベント（timeoutまでになければNone）"""
+        try:
+            event = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return None if event is _STOP else event
+
+    def _run(self, handler):
+        while True:
+            event = self.queue.get()
+            if event is _STOP:
+                break
+            try:
+                handler(event)
+            except Exception as e:
+                print(f"⚠ イベント処理エラー ({self.name}): {e}")
+
+    def start(self, handler):
+        """専用スレッドで handler(event) を呼び続ける"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, args=(handler,), daemon=True)
+            self.thread.start()
+
+    def close(self):
+        """
+        受け取りをやめて、スレッドがあれば残りを処理し終わるまで待つ
+
+        戻った後はハンドラが呼ばれないので、ハンドラが使う資源を解放してよい。
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        thread = self.thread
+        if thread:
+            # 以降は offer されないので、スレッドが取り出せば必ず入る
+            self.queue.put(_STOP)
+            thread.join()
+            self.thread = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "pending": self.queue.qsize(),
+            }
+
+
+class EventBus:
+    """プロセス内のpublish/subscribe"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # イベント型 -> 購読者のタプル（発行側はロックを取らずに読むので、変更時は置き換える）
+        self.routes = {}
+        self.subscriptions = []
+
+    def subscribe(self, name, event_types=EVENT_TYPES, handler=None, maxsize=1024):
+        """
+        購読を追加
+
+        Args:
+            name: 購読者名（統計の表示用）
+            event_types: 受け取るイベント型
+            handler: 指定すると専用スレッドで handler(event) を呼ぶ
+                     （Noneの場合は呼び出し側が Subscription.get() で読む）
+            maxsize: キューの上限（満杯の間のイベントは捨てて dropped に数える）
+
+        Returns:
+            Subscription
+        """
+        subscription = Subscription(name, event_types, maxsize)
+        with self.lock:
+            self.subscriptions.append(subscription)
+            self._rebuild_routes()
+        if handler is not None:
+            subscription.start(handler)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """購読を削除"""
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+            self._rebuild_routes()
+        subscription.close()
+
+    def _rebuild_routes(self):
+        routes = {}
+        for subscription in self.subscriptions:
+            for event_type in subscription.event_types:
+                routes[event_type] = routes.get(event_type, ()) + (subscription,)
+        self.routes = routes
+
+    def publish(self, event):
+        """イベントを発行（どのスレッドからでも呼べる。購読者がいなければ何もしない）"""
+        for subscription in self.routes.get(type(event), ()):
+            subscription.offer(event)
+
+    def stats(self):
+        """購読者ごとの統計"""
+        with self.lock:
+            return {s.name: s.stats() for s in self.subscriptions}
+
+    def print_stats(self):
+        """購読者ごとの統計を表示"""
+        stats = self.stats()
+        if not stats:
+            return
+        print("\n【イベントバス】")
+        for name, s in stats.items():
+            print(f"  {name}: 配信 {s['delivered']}件 / 破棄 {s['dropped']}件 / 未処理 {s['pending']}件")
+
+    def close(self):
+        """すべての購読を終了"""
+        with self.lock:
+            subscriptions, self.subscriptions = self.subscriptions, []
+            self.routes = {}
+        for subscription in subscriptions:
+            subscription.close()
+
+
+class RawEventLogger:
+    """
+    生イベントをJSON Lines形式でファイルに追記する購読者
+
+    1行に1イベント {"type": "KeyEvent", "timestamp": ..., ...}。
+    書き込みはバスの購読者スレッドで行い、flush_interval_sec ごとにディスクに書き出す。
+    """
+
+    def __init__(self, bus, path, event_types=EVENT_TYPES, maxsize=65536, flush_interval_sec=5.0):
+        """
+        Args:
+            bus: EventBus
+            path: 出力先ファイル（追記）
+            event_types: 記録するイベント型
+            maxsize: キューの上限
+            flush_interval_sec: ディスクに書き出す間隔（秒）
+        """
+        self.bus = bus
+        self.path = path
+        self.flush_interval_sec = flush_interval_sec
+        self.file = open(path, "a", encoding="utf-8")
+        self.last_flush = time.monotonic()
+        self.written = 0
+        self.subscription = bus.subscribe("raw_logger", event_types, handler=self._write,
+                                          maxsize=maxsize)
+        print(f"✓ 生イベントの記録先: {path}")
+
+    def _write(self, event):
+        record = {"type": type(event).__name__}
+        record.update(event._asdict())
+        # nanはJSONにないのでnullにする
+        for key, value in record.items():
+            if isinstance(value, float) and value != value:
+                record[key] = None
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.written += 1
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval_sec:
+            self.file.flush()
+            self.last_flush = now
+
+    def close(self):
+        """購読をやめて残りを書き出す（書き込みスレッドの終了を待ってからファイルを閉じる）"""
+        self.bus.unsubscribe(self.subscription)
+        self.file.close()
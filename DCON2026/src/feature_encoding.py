@@ -0,0 +1,137 @@
+"""
+特徴量エンコーディングモジュール
+UNIX時刻の列から時刻・曜日・セッション経過時間の特徴量をまとめて計算する
+"""
+
+import time
+import numpy as np
+import pandas as pd
+
+
+# 時刻エンコーディングで出力する列
+TIME_FEATURE_COLUMNS = ["hour_sin", "hour_cos", "dow_sin", "dow_cos", "session_elapsed_sec"]
+
+# これ以上記録が空いたら別セッションとみなす（秒）
+DEFAULT_SESSION_GAP_SEC = 1800
+
+SECONDS_PER_DAY = 86400
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+# UNIX時刻0（1970-01-01）は木曜日（月曜始まりで3日目）
+EPOCH_WEEKDAY_OFFSET_SEC = 3 * SECONDS_PER_DAY
+
+
+def _utc_offsets_at(timestamps, tz=None):
+    """各時刻のUTCオフセット（秒）を1つずつタイムゾーン変換して求める"""
+    if tz is None:
+        return np.array([time.localtime(t).tm_gmtoff for t in timestamps], dtype=np.float64)
+    local = pd.to_datetime(timestamps, unit="s", utc=True).tz_convert(tz)
+    return np.array([t.utcoffset().total_seconds() for t in local], dtype=np.float64)
+
+
+def local_utc_offsets(timestamps, tz=None):
+    """
+    各時刻のUTCオフセット（秒）を返す
+
+    時刻をUTCの1時間単位に丸めたユニーク値ごとに、その1時間の始めと終わりの
+    オフセットを求めて配列全体に展開する。始めと終わりでオフセットが違う1時間
+    （夏時間の切り替えなど。30分・45分ずれたタイムゾーンでは正時以外で切り替わる）
+    に入る行だけは、1行ずつ変換し直す。
+
+    Args:
+        timestamps: UNIX時刻の配列
+        tz: タイムゾーン名（"Asia/Tokyo"など）。Noneの場合はOSのローカルタイム
+    """
+    ts = np.asarray(timestamps, dtype=np.float64)
+    hours, inverse = np.unique(np.floor_divide(ts, 3600), return_inverse=True)
+    edges = _utc_offsets_at(np.concatenate((hours, hours + 1)) * 3600, tz)
+    start, end = edges[:len(hours)], edges[len(hours):]
+    offsets = start[inverse]
+    changed = (start != end)[inverse]
+    if changed.any():
+        offsets[changed] = _utc_offsets_at(ts[changed], tz)
+    return offsets
+
+
+class TimeEncoder:
+    """
+    時刻特徴量のエンコーダ
+
+    - hour_sin / hour_cos: ローカル時刻の時刻（分単位）の周期エンコーディング
+    - dow_sin / dow_cos: 曜日（月曜始まり）の周期エンコーディング
+    - session_elapsed_sec: セッション開始からの経過時間
+
+    セッションの状態を保持するので、時刻順のチャンクを順に渡せば
+    チャンクの境界をまたいでも全件を一度に処理した場合と同じ結果になる。
+    """
+
+    def __init__(self, tz=None, session_gap_sec=DEFAULT_SESSION_GAP_SEC):
+        self.tz = tz
+        self.session_gap_sec = session_gap_sec
+        self.last_timestamp = None
+        self.session_start = None
+
+    def encode(self, timestamps):
+        """
+        時刻の配列（時刻順）をエンコード
+
+        Returns:
+            TIME_FEATURE_COLUMNS を列に持つDataFrame
+        """
+        ts = np.asarray(timestamps, dtype=np.float64)
+        if len(ts) == 0:
+            return pd.DataFrame(columns=TIME_FEATURE_COLUMNS, dtype=np.float64)
+
+        hour_sin, hour_cos, dow_sin, dow_cos = self.encode_cyclical(ts)
+        return pd.DataFrame({
+            "hour_sin": hour_sin,
+            "hour_cos": hour_cos,
+            "dow_sin": dow_sin,
+            "dow_cos": dow_cos,
+            "session_elapsed_sec": self._session_elapsed(ts),
+        })
+
+    def encode_cyclical(self, timestamps):
+        """
+        時刻・曜日の周期エンコーディングだけを計算（セッションの状態は変えない）
+
+        1秒ごとの特徴量（feature_sampler）もこれを使い、エクスポートと同じ値にする。
+
+        Returns:
+            (hour_sin, hour_cos, dow_sin, dow_cos) の配列
+        """
+        ts = np.asarray(timestamps, dtype=np.float64)
+        local = ts + local_utc_offsets(ts, self.tz)
+
+        # 1日のうちの位置（分単位）
+        minute_of_day = np.floor(np.mod(local, SECONDS_PER_DAY) / 60)
+        day_angle = 2 * np.pi * minute_of_day / 1440
+
+        # 曜日（0=月曜）
+        weekday = np.floor(np.mod(local + EPOCH_WEEKDAY_OFFSET_SEC, SECONDS_PER_WEEK) / SECONDS_PER_DAY)
+        week_angle = 2 * np.pi * weekday / 7
+
+        return np.sin(day_angle), np.cos(day_angle), np.sin(week_angle), np.cos(week_angle)
+
+    def _session_elapsed(self, ts):
+        """セッション開始からの経過時間（前回のチャンクから状態を引き継ぐ）"""
+        prev = np.empty_like(ts)
+        prev[1:] = ts[:-1]
+        prev[0] = ts[0] if self.last_timestamp is None else self.last_timestamp
+        new_session = (ts - prev) > self.session_gap_sec
+        if self.last_timestamp is None:
+            new_session[0] = True
+
+        # 各行について、直近のセッション開始行のインデックス
+        index = np.where(new_session, np.arange(len(ts)), -1)
+        start_index = np.maximum.accumulate(index)
+        carried = np.nan if self.session_start is None else self.session_start
+        starts = np.where(start_index >= 0, ts[np.maximum(start_index, 0)], carried)
+
+        self.last_timestamp = float(ts[-1])
+        self.session_start = float(starts[-1])
+        return ts - starts
+
+    def reset(self):
+        """セッションの状態をリセット"""
+        self.last_timestamp = None
+        self.session_start = None
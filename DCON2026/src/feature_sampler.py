@@ -0,0 +1,209 @@
+"""
+特徴量サンプリングモジュール
+1秒ごとに18次元の特徴量ベクトルを作り、LSTM入力用の循環バッファ（600×18 float32）に書き込む
+"""
+
+import threading
+import time
+import numpy as np
+
+from feature_encoding import TimeEncoder
+
+
+# LSTM入力の特徴量（並び順はモデル入力の列順）
+FEATURE_NAMES = (
+    # キーストローク（直近5秒のウィンドウ）
+    "avg_key_interval_ms",
+    "std_key_interval_ms",
+    "max_key_interval_ms",
+    "min_key_interval_ms",
+    "typing_speed_kpm",
+    "mistype_frequency",
+    # マウス（直近1秒。1秒フレームでは移動距離=平均速度なので距離のみ）
+    "movement_distance_px",
+    "click_count",
+    # ウィンドウ
+    "window_switch_count",
+    # 作業カテゴリ（One-Hot、"other"は全て0）
+    "category_development",
+    "category_communication",
+    "category_browsing",
+    "category_document",
+    # 環境（正規化済み）
+    "temperature",
+    "humidity",
+    "pressure",
+    # 時刻（Cyclical Encoding）
+    "hour_sin",
+    "hour_cos",
+)
+N_FEATURES = len(FEATURE_NAMES)
+
+ONE_HOT_CATEGORIES = ("development", "communication", "browsing", "document")
+CATEGORY_OFFSET = FEATURE_NAMES.index("category_development")
+
+# 環境データの正規化（基準値, スケール）
+ENV_NORMALIZATION = {
+    "temperature": (25.0, 10.0),
+    "humidity": (50.0, 50.0),
+    "pressure": (1013.25, 50.0),
+}
+
+
+class FeatureFrameRing:
+    """
+    1秒ごとの特徴量フレームを保持する循環バッファ
+
+    同じ行を2箇所（i と i + timesteps）に書き込むことで、
+    常に「古い順に並んだ連続領域」をコピーなしのビューとして返せる。
+    """
+
+    def __init__(self, timesteps=600, n_features=N_FEATURES):
+        self.timesteps = timesteps
+        self.n_features = n_features
+        self.buffer = np.zeros((2 * timesteps, n_features), dtype=np.float32)
+        self.pos = 0     # 次に書き込む位置
+        self.count = 0   # 書き込み済みフレーム数（最大timesteps）
+        self.last_timestamp = None
+        self.lock = threading.Lock()
+
+    def push(self, row, timestamp=None):
+        """1フレームを追加（過去のフレームは再計算しない）"""
+        with self.lock:
+            self.buffer[self.pos] = row
+            self.buffer[self.pos + self.timesteps] = row
+            self.pos = (self.pos + 1) % self.timesteps
+            self.count = min(self.count + 1, self.timesteps)
+            self.last_timestamp = timestamp
+
+    def view(self):
+        """
+        古い順に並んだ (timesteps, n_features) のビューを返す（コピーなし）
+
+        ビューは次のpushで内容が進むため、推論は次のフレームまでに済ませること。
+        バッファが埋まるまでの先頭行は0で埋められている。
+        """
+        with self.lock:
+            frames = self.buffer[self.pos:self.pos + self.timesteps]
+        frames.flags.writeable = False
+        return frames
+
+    @property
+    def is_full(self):
+        return self.count >= self.timesteps
+
+
+class FeatureSampler:
+    """各収集モジュールから1秒ごとに特徴量ベクトルを作成"""
+
+    def __init__(self, aggregator, interval_sec=1.0, timesteps=600, sink=None, tz=None):
+        """
+        Args:
+            aggregator: DataAggregator（各収集モジュールを参照する）
+            interval_sec: サンプリング間隔（秒）
+            timesteps: 保持するフレーム数（10分 = 600）
+            sink: 全フレームの保存先（append(row, timestamp) を持つもの。例: SessionWriter）
+            tz: 時刻特徴量のタイムゾーン名（Noneの場合はOSのローカルタイム。エクスポートと揃える）
+        """
+        self.aggregator = aggregator
+        self.interval_sec = interval_sec
+        self.frames = FeatureFrameRing(timesteps=timesteps)
+        self.sink = sink
+        self.row = np.zeros(N_FEATURES, dtype=np.float32)  # 作業用（毎秒確保しない）
+        self.time_encoder = TimeEncoder(tz=tz)
+        self.last_clicks = aggregator.mouse_collector.total_clicks
+        self.last_switches = aggregator.window_collector.total_switches
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.scheduler = None
+
+    def sample(self, now=None):
+        """現在の1秒分の特徴量を作成してバッファに書き込む"""
+        now = time.time() if now is None else now
+        row = self.row
+        agg = self.aggregator
+
+        # キーストローク（逐次集計済みの5秒ウィンドウを参照）
+        ks = agg.keystroke_collector.calculate_window_stats(5)
+        row[0] = ks["avg_key_interval_ms"]
+        row[1] = ks["std_key_interval_ms"]
+        row[2] = ks["max_key_interval_ms"]
+        row[3] = ks["min_key_interval_ms"]
+        row[4] = ks["typing_speed_kpm"]
+        row[5] = ks["mistype_frequency"]
+
+        # マウス（1秒解像度の運動学 + クリック数の差分）
+        mouse = agg.mouse_collector
+        row[6] = mouse.get_kinematics(1)["distance_px"]
+        clicks = mouse.total_clicks
+        row[7] = clicks - self.last_clicks
+        self.last_clicks = clicks
+
+        # ウィンドウ
+        window = agg.window_collector
+        switches = window.total_switches
+        row[8] = switches - self.last_switches
+        self.last_switches = switches
+        row[CATEGORY_OFFSET:CATEGORY_OFFSET + len(ONE_HOT_CATEGORIES)] = 0
+        if window.current_category in ONE_HOT_CATEGORIES:
+            row[CATEGORY_OFFSET + ONE_HOT_CATEGORIES.index(window.current_category)] = 1
+
+        # 環境（シリアル通信は行わず、最後に受信した値を使う）
+        env = agg.env_collector.last_data
+        for i, key in enumerate(("temperature", "humidity", "pressure"), start=13):
+            center, scale = ENV_NORMALIZATION[key]
+            row[i] = (env[key] - center) / scale
+
+        # 時刻（エクスポートと同じエンコーディング）
+        hour_sin, hour_cos, _, _ = self.time_encoder.encode_cyclical((now,))
+        row[16] = hour_sin[0]
+        row[17] = hour_cos[0]
+
+        self.frames.push(row, now)
+        if self.sink is not None:
+            self.sink.append(row, now)
+        return row
+
+    def get_model_input(self):
+        """LSTM入力 (600, 18) をコピーなしで取得"""
+        return self.frames.view()
+
+    def _run(self):
+        """サンプリングループ（処理時間に関係なく1秒刻みを維持）"""
+        next_time = time.monotonic() + self.interval_sec
+        while not self.stop_event.wait(max(0.0, next_time - time.monotonic())):
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"⚠ 特徴量サンプリングエラー: {e}")
+            next_time += self.interval_sec
+            # 大きく遅れた場合は追いつこうとせず次の刻みから再開
+            if next_time < time.monotonic():
+                next_time = time.monotonic() + self.interval_sec
+
+    def start(self, scheduler=None):
+        """
+        1秒ごとのサンプリングを開始
+
+        Args:
+            scheduler: DeadlineScheduler（指定するとその周期ジョブとして実行し、専用スレッドは作らない）
+        """
+        if self.thread is None and self.scheduler is None:
+            if scheduler is not None:
+                self.scheduler = scheduler
+                scheduler.add("feature_sampling", self.interval_sec, self.sample)
+            else:
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            print("✓ 特徴量サンプリング（1秒ごと）を開始しました")
+
+    def stop(self):
+        """サンプリングを停止"""
+        if self.scheduler is not None:
+            self.scheduler.remove("feature_sampling")
+            self.scheduler = None
+        if self.thread:
+            self.stop_event.set()
+            self.thread.join(timeout=2)
+            self.thread = None
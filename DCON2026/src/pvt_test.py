@@ -1,13 +1,17 @@
 import tkinter as tk
 import time
 import random
-import sqlite3
 import sys
 import csv
 import os
 import statistics
+import threading
 from datetime import datetime
 from ctypes import windll
+from data_storage import DataStorage
+from event_bus import PvtEvent
+from pvt_timing import ReactionTimer, now_ns
+from tk_dispatch import TkDispatcher
 
 class PVTTest:
     """
@@ -17,7 +21,16 @@ class PVTTest:
     - データベースの形式を厳守
     """
 
-    def __init__(self, db_path="zone_key_data.db", root=None):
+    def __init__(self, db_path="zone_key_data.db", root=None, storage=None,
+                 external_schedule=False, bus=None):
+        """
+        Args:
+            db_path: storageを渡さない場合に使うデータベースのパス
+            root: 共有するTkインスタンス（Noneの場合は自前で作成）
+            storage: 共有するDataStorage（書き込みは必ずこれを経由する）
+            external_schedule: 実行間隔を呼び出し側（DeadlineScheduler）が管理する場合はTrue
+            bus: 各試行の反応（PvtEvent）を発行するEventBus
+        """
         try:
             windll.shcore.SetProcessDpiAwareness(1)
         except Exception:
@@ -35,9 +48,10 @@ class PVTTest:
 
         self.db_path = db_path
         self.csv_path = "pvt_backup.csv"      # 元のバックアップ用
-        self.dataset_path = "final_dataset.csv" # 学習用
+        self.dataset_path = "final_dataset.csv" # 学習用（1回のPVTごとに1行）
+        self.export_path = "dataset_pvt.csv"    # ラベル付きの学習データセット（差分で書き出す）
 
-        self.setup_database()
+        self.setup_database(storage)
         self.init_csv()
 
         if root is None:
@@ -50,32 +64,26 @@ class PVTTest:
         self.canvas = None
         self.current_trial = 0
         self.reaction_times = []
-        self.stimulus_start_time = 0
+        self.timer = ReactionTimer()
+        self.bus = bus
         self.is_waiting_for_response = False
         self.countdown_job = None
         self.timer_label = None
+        self.external_schedule = external_schedule
 
-    def setup_database(self):
-        """元のデータベース形式に合わせてテーブル作成"""
+        # 学習用データセットの書き出し（GUIを止めないようにバックグラウンドで実行）
+        self.export_lock = threading.Lock()
+        self.export_thread = None
+        self.export_pending = False
+
+    def setup_database(self, storage=None):
+        """書き込み先を設定（テーブルはDataStorageが元の形式で作成する）"""
+        self.owns_storage = storage is None
         try:
-            self.conn = sqlite3.connect(self.db_path)
-            self.cursor = self.conn.cursor()
-            # あなたの元のコードの形式に合わせました
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS pvt_results (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp REAL NOT NULL,
-                    stimulus_time REAL NOT NULL,
-                    reaction_time_ms REAL,
-                    focus_score REAL,
-                    alertness_level TEXT,
-                    is_lapse BOOLEAN,
-                    false_start BOOLEAN
-                )
-            """)
-            self.conn.commit()
+            self.storage = storage if storage is not None else DataStorage(self.db_path)
         except Exception as e:
             print(f"⚠ DB接続エラー: {e}")
+            self.storage = None
 
     def init_csv(self):
         """CSVファイルの準備"""
@@ -98,7 +106,36 @@ class PVTTest:
         print(f"✅ PVT監視を開始 (間隔: {self.check_interval_min}分)")
         self.schedule_next_session()
 
+    def show_test(self):
+        """すぐにテストを開始（カウントダウンから）"""
+        if self.window is not None:
+            # 前回のテストがまだ終わっていない
+            return
+        self.show_countdown_dialog()
+
+    def run_once(self, poll_ms=200):
+        """
+        テストを1回だけ実行し、終わるまでmainloopを回す（--test-pvt 用）
+
+        終わった後は次回を予約せず、学習データセットの書き出しが終わるのを待ってから戻る。
+        """
+        self.external_schedule = True
+        self.show_test()
+        self.root.after(poll_ms, self._quit_when_finished, poll_ms)
+        TkDispatcher(self.root).run()
+        thread = self.export_thread
+        if thread is not None:
+            thread.join()
+
+    def _quit_when_finished(self, poll_ms):
+        if self.window is None:
+            self.root.quit()
+        else:
+            self.root.after(poll_ms, self._quit_when_finished, poll_ms)
+
     def schedule_next_session(self):
+        # 外部のスケジューラが管理している場合は自分では予約しない（二重実行の防止）
+        if self.external_schedule: return
         interval_ms = int(self.check_interval_min * 60 * 1000)
         print(f"⏳ 待機中... ({self.check_interval_min}分)")
         self.root.after(interval_ms, self.show_countdown_dialog)
@@ -164,6 +201,7 @@ class PVTTest:
 
         self.current_trial = 0
         self.reaction_times = []
+        self.timer.reset()
         self.run_next_trial()
 
     def run_next_trial(self):
@@ -188,14 +226,20 @@ class PVTTest:
         cy = self.root.winfo_screenheight() // 2
         r = self.circle_radius
         self.canvas.create_oval(cx-r, cy-r, cx+r, cy+r, fill='red', outline='red')
-        self.stimulus_start_time = time.time()
+        # 描画を反映させてから刺激の時刻を取る
+        self.timer.mark_stimulus(self.canvas)
         self.is_waiting_for_response = True
 
     def on_user_reaction(self, event):
+        # 入力の時刻はキーバインドのコールバックの先頭で取る。
+        # Tkのキーバインドはメインスレッドで直接呼ばれ、フックと記録の間に受け渡しがないので
+        # 入力遅延は測れない（測定するのはpynputのフックを使うDCON2026moto版のみ）
+        input_ns = now_ns()
         if not self.is_waiting_for_response: return 
-        rt_sec = time.time() - self.stimulus_start_time
-        rt_ms = rt_sec * 1000
+        rt_ms, _ = self.timer.record(input_ns)
         self.reaction_times.append(rt_ms)
+        if self.bus is not None:
+            self.bus.publish(PvtEvent(time.time(), rt_ms, float("nan")))
         self.is_waiting_for_response = False
         self.canvas.delete("all")
         self.canvas.create_text(self.root.winfo_screenwidth()//2, self.root.winfo_screenheight()//2, 
@@ -232,14 +276,9 @@ class PVTTest:
         # stimulus_time は平均なので計測時刻と同じにします
         # false_start は UI側で制御しているので False で固定
         try:
-            self.cursor.execute("""
-                INSERT INTO pvt_results (
-                    timestamp, stimulus_time, reaction_time_ms,
-                    focus_score, alertness_level, is_lapse, false_start
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (ts, ts, rt, score, level, lapse, False))
-            self.conn.commit()
-            print("   -> DB保存完了")
+            # input_latency_ms はこの版では測れないので保存しない（NULL）
+            self.storage.save_pvt_result(ts, ts, rt, score, level, lapse, False)
+            print("   -> DB保存完了（書き込みキューに追加）")
         except Exception as e:
             print(f"⚠ DB保存失敗: {e}")
 
@@ -260,6 +299,37 @@ class PVTTest:
         except Exception as e:
             pass
 
+        # 4. ラベル付きの学習データセット（dataset_pvt.csv）
+        # 新しいPVT結果でラベルが変わる行と未出力の行だけを差分で書き出す
+        # （初回は全件になるので、メインスレッドでは実行しない）
+        if self.storage is not None:
+            self.export_dataset_async()
+
+    def export_dataset_async(self):
+        """データセットの書き出しをバックグラウンドで開始（実行中なら終わった後にもう一度）"""
+        with self.export_lock:
+            if self.export_thread is not None:
+                self.export_pending = True
+                return
+            self.export_thread = threading.Thread(target=self._export_dataset_loop, daemon=True)
+            self.export_thread.start()
+
+    def _export_dataset_loop(self):
+        try:
+            while True:
+                try:
+                    self.storage.export_pvt_dataset(self.export_path, verbose=False)
+                except Exception as e:
+                    print(f"⚠ データセット書き出し失敗: {e}")
+                with self.export_lock:
+                    if not self.export_pending:
+                        self.export_thread = None
+                        return
+                    self.export_pending = False
+        finally:
+            # 使い捨てのスレッドなので読み取り接続を残さない
+            self.storage.release_read_connection()
+
     def calculate_focus_score(self, rt_ms):
         if rt_ms < 150: return 0.5 
         if rt_ms <= 300: return 1.0 
@@ -273,12 +343,18 @@ class PVTTest:
         if rt_ms < 1000: return "Drowsy"
         return "Sleepy"
 
-    def force_stop(self):
-        if self.window: self.window.destroy()
+    def close_db(self):
+        # 共有しているstorageは持ち主（main）が閉じる
+        if not self.owns_storage or self.storage is None:
+            return
         try:
-            self.conn.close()
+            self.storage.close()
         except:
             pass
+
+    def force_stop(self):
+        if self.window: self.window.destroy()
+        self.close_db()
         sys.exit()
 
 if __name__ == "__main__":
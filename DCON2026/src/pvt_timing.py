@@ -0,0 +1,86 @@
+"""
+PVT計時モジュール
+反応時間を time.perf_counter_ns() で計る（time.time() はWindowsで分解能が粗く、時計の変更でずれる）
+
+    刺激の時刻: 描画の待ち（update_idletasks）を済ませた直後
+    入力の時刻: キーフック（またはTkのキーバインド）のコールバックの先頭
+    反応時間  = 入力の時刻 - 刺激の時刻
+    入力遅延  = 記録した時刻 - 入力の時刻（スレッド間の受け渡し・キュー待ちの時間）
+
+入力遅延は反応時間に含めず、別に記録・表示する。
+入力遅延に意味があるのは、フックが別スレッド（pynput）で時刻を取り、メインスレッドで
+記録する場合だけ。Tkのキーバインドで受ける場合は記録と同じ場所で時刻を取るので常にほぼ0になり、
+pvt_results.input_latency_ms には保存しない（NULL）。
+"""
+
+import statistics
+import time
+
+
+NS_PER_MS = 1_000_000
+
+
+def now_ns():
+    """現在の時刻（perf_counter、ナノ秒）"""
+    return time.perf_counter_ns()
+
+
+class ReactionTimer:
+    """1セッション分の刺激・入力の時刻と入力遅延"""
+
+    def __init__(self):
+        self.stimulus_ns = None
+        self.latencies_ms = []
+
+    def reset(self):
+        """セッション開始時に呼ぶ"""
+        self.stimulus_ns = None
+        self.latencies_ms = []
+
+    def mark_stimulus(self, widget):
+        """
+        刺激を表示した時刻を記録
+
+        itemconfigなどの描画は保留されているので、update_idletasks()で
+        画面に反映させてから時刻を取る。
+
+        Args:
+            widget: 刺激を描画したTkのウィジェット
+        """
+        widget.update_idletasks()
+        self.stimulus_ns = now_ns()
+        return self.stimulus_ns
+
+    def reaction_ms(self, input_ns):
+        """刺激から入力までの時間（ミリ秒）。刺激がなければNone"""
+        if self.stimulus_ns is None:
+            return None
+        return (input_ns - self.stimulus_ns) / NS_PER_MS
+
+    def record(self, input_ns):
+        """
+        入力を記録（記録する側のスレッドで呼ぶ）
+
+        Args:
+            input_ns: フックのコールバックで取った入力の時刻（now_ns()）
+
+        Returns:
+            (反応時間ms, 入力遅延ms)
+        """
+        rt_ms = self.reaction_ms(input_ns)
+        latency_ms = (now_ns() - input_ns) / NS_PER_MS
+        self.latencies_ms.append(latency_ms)
+        self.stimulus_ns = None
+        return rt_ms, latency_ms
+
+    def mean_latency_ms(self):
+        """このセッションの平均入力遅延（ミリ秒）。記録がなければNone"""
+        if not self.latencies_ms:
+            return None
+        return statistics.mean(self.latencies_ms)
+
+    def max_latency_ms(self):
+        """このセッションの最大入力遅延（ミリ秒）。記録がなければNone"""
+        if not self.latencies_ms:
+            return None
+        return max(self.latencies_ms)
@@ -0,0 +1,195 @@
+"""
+データ保持モジュール
+古い生データをロールアップだけ残して削除し、保持期間を過ぎたデータを消して
+空いたページを少しずつOSに返す（長期間動かし続けてもDBが大きくならないように）
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+DAY_SEC = 86400
+
+
+class RetentionPolicy:
+    """データの保持期間（日数）"""
+
+    def __init__(self, retention_days=365, raw_days=30, hourly_days=90):
+        """
+        Args:
+            retention_days: これより古いデータはすべて削除（ロールアップ・アーカイブを含む）
+            raw_days: これより古い生データ（training_data）は時間・日ごとのロールアップのみ残す
+            hourly_days: これより古い時間ごとのロールアップは日ごとのロールアップのみ残す
+        """
+        self.retention_days = retention_days
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+
+    def cutoffs(self, now):
+        """テーブル -> これより前の行を削除するUNIX時刻"""
+        def before(days):
+            return now - min(days, self.retention_days) * DAY_SEC
+        return {
+            "training_data": before(self.raw_days),
+            "pvt_results": before(self.retention_days),
+            "rollup_hourly": before(self.hourly_days),
+            "rollup_daily": before(self.retention_days),
+        }
+
+
+# Web要件定義書のデータ保持期間の選択肢
+RETENTION_PRESETS = {
+    "30d": RetentionPolicy(retention_days=30, raw_days=7, hourly_days=30),
+    "90d": RetentionPolicy(retention_days=90, raw_days=14, hourly_days=90),
+    "1y": RetentionPolicy(retention_days=365, raw_days=30, hourly_days=90),
+}
+
+# テーブル -> 時刻の列
+TIME_COLUMNS = {
+    "training_data": "timestamp",
+    "pvt_results": "timestamp",
+    "rollup_hourly": "bucket_start",
+    "rollup_daily": "bucket_start",
+}
+
+
+class CompactionJob:
+    """
+    保持期間の適用とインクリメンタルVACUUM
+
+    1回の削除は batch_rows 行、1回のVACUUMは vacuum_pages ページまでにして
+    書き込みキュー経由で少しずつ実行する（収集中の書き込みを長く止めない）。
+    """
+
+    def __init__(self, storage, policy=RETENTION_PRESETS["1y"], batch_rows=500,
+                 vacuum_pages=256, pause_sec=0.05):
+        """
+        Args:
+            storage: DataStorage
+            policy: RetentionPolicy
+            batch_rows: 1回に削除する最大行数
+            vacuum_pages: 1回のincremental_vacuumで返す最大ページ数
+            pause_sec: 1ステップごとに空ける時間（秒）
+        """
+        self.storage = storage
+        self.policy = policy
+        self.batch_rows = batch_rows
+        self.vacuum_pages = vacuum_pages
+        self.pause_sec = pause_sec
+        self.deleted_rows = 0
+        self.vacuumed_pages = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.scheduler = None
+
+    def _delete_step(self, table, cutoff):
+        """cutoffより古い行を最大batch_rows行削除。残りがあるかを返す"""
+        column = TIME_COLUMNS[table]
+        conn = self.storage.read_connection()
+        count = conn.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {column} < ? LIMIT ?)",
+            (cutoff, self.batch_rows)).fetchone()[0]
+        if count == 0:
+            return False
+        self.storage.submit(f"""
+            DELETE FROM {table} WHERE rowid IN (
+                SELECT rowid FROM {table} WHERE {column} < ? ORDER BY {column} LIMIT ?
+            )
+        """, (cutoff, self.batch_rows))
+        self.storage.flush()
+        self.deleted_rows += count
+        return count == self.batch_rows
+
+    def _vacuum_step(self):
+        """空きページを最大vacuum_pagesページ返す。残りがあるかを返す"""
+        conn = self.storage.read_connection()
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free_pages == 0:
+            return False
+        self.storage.submit(f"PRAGMA incremental_vacuum({self.vacuum_pages})", None)
+        self.storage.flush()
+        self.vacuumed_pages += min(free_pages, self.vacuum_pages)
+        return free_pages > self.vacuum_pages
+
+    def run(self, now=None):
+        """
+        保持期間を適用する（削除とVACUUMをすべて終えるか、停止要求まで）
+
+        Returns:
+            {"deleted_rows": 削除した行数, "vacuumed_pages": 返したページ数, "archive_partitions": 削除したアーカイブ数}
+        """
+        now = time.time() if now is None else now
+        deleted_before, vacuumed_before = self.deleted_rows, self.vacuumed_pages
+
+        for table, cutoff in self.policy.cutoffs(now).items():
+            while self._delete_step(table, cutoff):
+                if self.stop_event.wait(self.pause_sec):
+                    break
+
+        # アーカイブも保持期間を過ぎた日は削除
+        dropped = 0
+        archive = self.storage.archive
+        if archive is not None:
+            oldest_day = (datetime.fromtimestamp(now) - timedelta(days=self.policy.retention_days)).date()
+            dropped = archive.drop_before(oldest_day)
+
+        # 既存のDBは初回だけ全体をVACUUMして切り替える（切り替えられなければページは返せない）
+        if self.storage.enable_incremental_vacuum():
+            while self._vacuum_step():
+                if self.stop_event.wait(self.pause_sec):
+                    break
+
+        result = {
+            "deleted_rows": self.deleted_rows - deleted_before,
+            "vacuumed_pages": self.vacuumed_pages - vacuumed_before,
+            "archive_partitions": dropped,
+        }
+        if any(result.values()):
+            print(f"✓ データ保持: {result['deleted_rows']}行を削除、"
+                  f"{result['vacuumed_pages']}ページを解放、アーカイブ{dropped}日分を削除")
+        return result
+
+    def _loop(self, interval_sec):
+        while not self.stop_event.is_set():
+            self._run_safely()
+            if self.stop_event.wait(interval_sec):
+                break
+
+    def _run_safely(self):
+        try:
+            self.run()
+        except Exception as e:
+            print(f"⚠ データ保持エラー: {e}")
+        finally:
+            # スケジューラは実行ごとに新しいスレッドを使うので、スレッドの接続を残さない
+            self.storage.release_read_connection()
+
+    def start(self, interval_sec=3600, scheduler=None):
+        """
+        interval_secごとに保持期間の適用を開始
+
+        Args:
+            interval_sec: 実行間隔（秒）
+            scheduler: DeadlineScheduler（指定するとその周期ジョブとして別スレッドで実行する）
+        """
+        if self.thread is None and self.scheduler is None:
+            self.stop_event.clear()
+            if scheduler is not None:
+                self.scheduler = scheduler
+                scheduler.add("compaction", interval_sec, self._run_safely,
+                              first_delay_sec=0, run_in_thread=True)
+            else:
+                self.thread = threading.Thread(target=self._loop, args=(interval_sec,), daemon=True)
+                self.thread.start()
+            print(f"✓ データ保持ジョブを開始しました（保持期間 {self.policy.retention_days}日）")
+
+    def stop(self):
+        """停止"""
+        self.stop_event.set()
+        if self.scheduler is not None:
+            self.scheduler.remove("compaction")
+            self.scheduler = None
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
@@ -0,0 +1,232 @@
+"""
+時系列ストアモジュール
+1秒ごとの特徴量ベクトルをユーザー・セッションごとのfloat32ファイルに追記し、
+LSTM学習用のスライディングウィンドウをメモリマップのビューとして取り出す
+
+ディレクトリ構成:
+    sequences/
+        <user_id>/
+            <session_id>.f32   特徴量 (行数, 特徴量数) のfloat32（ヘッダなし）
+            <session_id>.ts    各行のUNIX時刻（float64）
+            <session_id>.json  特徴量名などのメタデータ
+
+600ステップのウィンドウを1つずつ配列として作ると数十GBになるが、
+ここではファイルをメモリマップし、ウィンドウは先頭位置のインデックスだけを持つ。
+"""
+
+import json
+import os
+import time
+import numpy as np
+
+from feature_sampler import FEATURE_NAMES
+
+
+DATA_SUFFIX = ".f32"
+TIMESTAMP_SUFFIX = ".ts"
+META_SUFFIX = ".json"
+
+
+class SessionWriter:
+    """
+    1セッション分の特徴量を追記するライター
+
+    flush_rows行ごとにまとめてファイルに追記する（毎秒ディスクに書かない）。
+    FeatureSamplerのsinkとして使える。
+    """
+
+    def __init__(self, path, feature_names=FEATURE_NAMES, flush_rows=60):
+        """
+        Args:
+            path: 拡張子を除いたファイルパス（<root>/<user_id>/<session_id>）
+            feature_names: 特徴量名（列の並び）
+            flush_rows: まとめて書き込む行数
+        """
+        self.path = path
+        self.n_features = len(feature_names)
+        self.buffer = np.zeros((flush_rows, self.n_features), dtype=np.float32)
+        self.timestamps = np.zeros(flush_rows, dtype=np.float64)
+        self.pending = 0
+        self.rows = 0
+        self.closed = False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + META_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump({
+                "feature_names": list(feature_names),
+                "dtype": "float32",
+                "created_at": time.time(),
+            }, f, ensure_ascii=False, indent=2)
+
+    def append(self, row, timestamp):
+        """1行を追加"""
+        if self.closed:
+            return
+        self.buffer[self.pending] = row
+        self.timestamps[self.pending] = timestamp
+        self.pending += 1
+        if self.pending == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """バッファの行をファイルに追記"""
+        if self.pending == 0:
+            return
+        with open(self.path + DATA_SUFFIX, "ab") as f:
+            f.write(self.buffer[:self.pending].tobytes())
+        with open(self.path + TIMESTAMP_SUFFIX, "ab") as f:
+            f.write(self.timestamps[:self.pending].tobytes())
+        self.rows += self.pending
+        self.pending = 0
+
+    def close(self):
+        """残りを書き込んで閉じる"""
+        self.flush()
+        self.closed = True
+
+
+class SequenceStore:
+    """ユーザー・セッションごとの特徴量ファイルの管理"""
+
+    def __init__(self, root_dir="sequences"):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, user_id, session_id):
+        return os.path.join(self.root_dir, str(user_id), str(session_id))
+
+    def open_writer(self, user_id, session_id=None, flush_rows=60):
+        """
+        新しいセッションのライターを作成
+
+        Args:
+            user_id: ユーザーID
+            session_id: セッションID（Noneの場合は開始時刻から作る）
+            flush_rows: まとめて書き込む行数
+        """
+        session_id = session_id or time.strftime("%Y%m%d-%H%M%S")
+        return SessionWriter(self._path(user_id, session_id), flush_rows=flush_rows)
+
+    def users(self):
+        """保存されているユーザーID"""
+        return sorted(name for name in os.listdir(self.root_dir)
+                      if os.path.isdir(os.path.join(self.root_dir, name)))
+
+    def sessions(self, user_id):
+        """ユーザーのセッションID（作成順）"""
+        user_dir = os.path.join(self.root_dir, str(user_id))
+        if not os.path.isdir(user_dir):
+            return []
+        return sorted(name[:-len(META_SUFFIX)] for name in os.listdir(user_dir)
+                      if name.endswith(META_SUFFIX))
+
+    def open_session(self, user_id, session_id):
+        """
+        セッションをメモリマップで開く（読み取り専用）
+
+        Returns:
+            (特徴量 (行数, 特徴量数) のmemmap, 時刻 (行数,) のmemmap)。行がなければ (None, None)
+        """
+        path = self._path(user_id, session_id)
+        with open(path + META_SUFFIX, encoding="utf-8") as f:
+            meta = json.load(f)
+        n_features = len(meta["feature_names"])
+        data_path = path + DATA_SUFFIX
+        if not os.path.exists(data_path):
+            return None, None
+        # 書き込み途中の行は含めない（ファイルサイズと時刻の行数の小さい方）
+        rows = os.path.getsize(data_path) // (4 * n_features)
+        rows = min(rows, os.path.getsize(path + TIMESTAMP_SUFFIX) // 8)
+        if rows == 0:
+            return None, None
+        data = np.memmap(data_path, dtype=np.float32, mode="r", shape=(rows, n_features))
+        timestamps = np.memmap(path + TIMESTAMP_SUFFIX, dtype=np.float64, mode="r", shape=(rows,))
+        return data, timestamps
+
+
+class SlidingWindowDataset:
+    """
+    LSTM学習用のスライディングウィンドウ
+
+    各ウィンドウはメモリマップの行スライス（コピーなしのビュー）として返す。
+    保持するのは (セッション番号, 先頭行) のインデックス配列だけなので、
+    シャッフルもインデックスの並べ替えで済む。
+    """
+
+    def __init__(self, store, timesteps=600, stride=1, user_ids=None, shuffle=True, seed=None):
+        """
+        Args:
+            store: SequenceStore
+            timesteps: ウィンドウの長さ（ステップ数）
+            stride: ウィンドウの先頭をずらす間隔（ステップ数）
+            user_ids: 対象ユーザー（Noneの場合は全員）
+            shuffle: イテレーションのたびに順序をシャッフルする
+            seed: シャッフルの乱数シード
+        """
+        self.timesteps = timesteps
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+
+        self.data = []
+        self.timestamps = []
+        self.session_keys = []
+        session_index = []
+        starts = []
+        for user_id in (user_ids if user_ids is not None else store.users()):
+            for session_id in store.sessions(user_id):
+                data, timestamps = store.open_session(user_id, session_id)
+                if data is None or len(data) < timesteps:
+                    continue
+                n_windows = (len(data) - timesteps) // stride + 1
+                session_index.append(np.full(n_windows, len(self.data), dtype=np.int32))
+                starts.append(np.arange(n_windows, dtype=np.int64) * stride)
+                self.data.append(data)
+                self.timestamps.append(timestamps)
+                self.session_keys.append((user_id, session_id))
+
+        self.session_index = np.concatenate(session_index) if session_index else np.zeros(0, dtype=np.int32)
+        self.starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+        self.n_features = self.data[0].shape[1] if self.data else len(FEATURE_NAMES)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        """i番目のウィンドウ (timesteps, 特徴量数) をビューとして返す"""
+        start = self.starts[i]
+        return self.data[self.session_index[i]][start:start + self.timesteps]
+
+    def end_timestamp(self, i):
+        """i番目のウィンドウの最後の行の時刻（ラベル付け用）"""
+        return float(self.timestamps[self.session_index[i]][self.starts[i] + self.timesteps - 1])
+
+    def order(self):
+        """1エポック分のインデックスの並び"""
+        if self.shuffle:
+            return self.rng.permutation(len(self))
+        return np.arange(len(self))
+
+    def __iter__(self):
+        for i in self.order():
+            yield self[i]
+
+    def batches(self, batch_size=32, out=None, drop_last=False):
+        """
+        ミニバッチを作る
+
+        バッチ用の配列は1つだけ確保し、毎回そこにウィンドウを書き込んで返す
+        （次のバッチで上書きされるので、保持する場合は呼び出し側でコピーすること）。
+
+        Yields:
+            (バッチ (n, timesteps, 特徴量数), ウィンドウのインデックス (n,))
+        """
+        if out is None:
+            out = np.empty((batch_size, self.timesteps, self.n_features), dtype=np.float32)
+        order = self.order()
+        for begin in range(0, len(order), batch_size):
+            indices = order[begin:begin + batch_size]
+            if drop_last and len(indices) < batch_size:
+                break
+            for j, i in enumerate(indices):
+                out[j] = self[i]
+            yield out[:len(indices)], indices
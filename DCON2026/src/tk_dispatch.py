@@ -0,0 +1,107 @@
+"""
+Tkディスパッチモジュール
+バックグラウンドスレッドからメインスレッド（Tkのmainloop）に処理を渡す
+"""
+
+import queue
+import signal
+import threading
+import tkinter as tk
+
+
+DISPATCH_EVENT = "<<Dispatch>>"
+
+
+class TkDispatcher:
+    """
+    スレッドセーフな処理キュー
+
+    post() でキューに積み、仮想イベントでmainloopを起こして取り出す。
+    ポーリングしないので、イベントがない間はメインスレッドは眠ったまま。
+    ほかのスレッドからの event_generate はメインスレッドが処理するまで戻らないので、
+    post() 自体は積むだけにして、起こすのは専用のスレッドが行う（キーフックなど
+    post() を呼ぶ側を待たせない）。起こすのはキューが空から積まれたときだけ。
+    ハートビート（既定1秒）はCtrl+Cを受け付けるためと、mainloop開始前に
+    積まれた処理を拾うためだけに使う。
+    """
+
+    def __init__(self, root, heartbeat_ms=1000):
+        """
+        Args:
+            root: Tkのルートウィンドウ
+            heartbeat_ms: ハートビートの間隔（ミリ秒）
+        """
+        self.root = root
+        self.heartbeat_ms = heartbeat_ms
+        self.queue = queue.SimpleQueue()
+        self.interrupted = False
+        self.root.bind(DISPATCH_EVENT, self._drain)
+
+        # メインスレッドを起こす専用スレッド
+        self.wake_lock = threading.Lock()
+        self.wake_pending = False
+        self.wake_event = threading.Event()
+        self.closed = False
+        self.waker = threading.Thread(target=self._wake_loop, daemon=True)
+        self.waker.start()
+
+    def post(self, func, *args):
+        """funcをメインスレッドで実行する（どのスレッドからでも呼べ、待たずに戻る）"""
+        self.queue.put((func, args))
+        with self.wake_lock:
+            if self.wake_pending:
+                # まだ取り出されていない分と一緒に処理される
+                return
+            self.wake_pending = True
+        self.wake_event.set()
+
+    def _wake_loop(self):
+        while True:
+            self.wake_event.wait()
+            self.wake_event.clear()
+            if self.closed:
+                return
+            try:
+                self.root.event_generate(DISPATCH_EVENT, when="tail")
+            except (RuntimeError, tk.TclError):
+                # mainloop開始前・終了後はハートビートで処理する
+                pass
+
+    def _drain(self, event=None):
+        """キューに溜まった処理をすべて実行"""
+        # 先に解除しておき、取り出し中に積まれた分でもう一度起こせるようにする
+        with self.wake_lock:
+            self.wake_pending = False
+        while True:
+            try:
+                func, args = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"⚠ メインスレッド処理エラー: {e}")
+
+    def _heartbeat(self):
+        self._drain()
+        self.root.after(self.heartbeat_ms, self._heartbeat)
+
+    def _on_interrupt(self, signum, frame):
+        """Ctrl+C: mainloopを抜ける（Tkのコールバック内では例外が握りつぶされるため）"""
+        self.interrupted = True
+        self.root.quit()
+
+    def run(self):
+        """mainloopでメインスレッドを占有する（quit() またはCtrl+Cで戻る）"""
+        previous = signal.signal(signal.SIGINT, self._on_interrupt)
+        try:
+            self.root.after(self.heartbeat_ms, self._heartbeat)
+            self.root.mainloop()
+        finally:
+            signal.signal(signal.SIGINT, previous)
+            self.closed = True
+            self.wake_event.set()
+
+    def quit(self):
+        """mainloopを終了する（どのスレッドからでも呼べる）"""
+        self.post(self.root.quit)
@@ -0,0 +1,79 @@
+"""
+時刻特徴量（feature_encoding）のテスト
+"""
+
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from feature_encoding import TimeEncoder, _utc_offsets_at, local_utc_offsets  # noqa: E402
+from feature_sampler import FeatureSampler  # noqa: E402
+
+
+def minutes_around(utc_start, hours=2):
+    t0 = pd.Timestamp(utc_start, tz="UTC").timestamp()
+    return t0 + np.arange(0, hours * 3600, 60.0)
+
+
+@pytest.mark.parametrize("tz, utc_start", [
+    # 夏時間の開始（+10:30 → +11:00）が UTC 15:30 で、正時をまたがない
+    ("Australia/Lord_Howe", "2025-10-04 14:00"),
+    # +5:30 → +5:45 の切り替えが UTC 18:30
+    ("Asia/Kathmandu", "1985-12-31 17:00"),
+])
+def test_offsets_change_inside_the_hour(tz, utc_start):
+    ts = minutes_around(utc_start)
+    expected = _utc_offsets_at(ts, tz)
+    assert len(set(expected)) == 2
+    np.testing.assert_array_equal(local_utc_offsets(ts, tz), expected)
+
+
+def test_os_local_time_matches_per_row():
+    """tz=None（OSのローカルタイム）でも正時以外の切り替えを取りこぼさない"""
+    if not hasattr(time, "tzset"):
+        pytest.skip("time.tzset がない環境")
+    saved = os.environ.get("TZ")
+    os.environ["TZ"] = "Australia/Lord_Howe"
+    time.tzset()
+    try:
+        ts = minutes_around("2025-10-04 14:00")
+        np.testing.assert_array_equal(local_utc_offsets(ts), _utc_offsets_at(ts))
+    finally:
+        if saved is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = saved
+        time.tzset()
+
+
+def test_sampler_uses_the_export_encoding():
+    """1秒ごとの特徴量とエクスポートで hour_sin / hour_cos が一致する"""
+    tz = "Australia/Lord_Howe"
+    aggregator = SimpleNamespace(
+        keystroke_collector=SimpleNamespace(calculate_window_stats=lambda sec: {
+            "avg_key_interval_ms": 0.0, "std_key_interval_ms": 0.0,
+            "max_key_interval_ms": 0.0, "min_key_interval_ms": 0.0,
+            "typing_speed_kpm": 0.0, "mistype_frequency": 0.0,
+        }),
+        mouse_collector=SimpleNamespace(
+            total_clicks=0, get_kinematics=lambda sec: {"distance_px": 0.0}),
+        window_collector=SimpleNamespace(total_switches=0, current_category="other"),
+        env_collector=SimpleNamespace(
+            last_data={"temperature": 24.0, "humidity": 50.0, "pressure": 1013.0}),
+    )
+    sampler = FeatureSampler(aggregator, timesteps=4, tz=tz)
+    ts = pd.Timestamp("2025-10-04 15:29:30", tz="UTC").timestamp() + np.arange(4) * 20.0
+    for t in ts:
+        sampler.sample(now=t)
+
+    exported = TimeEncoder(tz=tz).encode(ts)
+    frames = sampler.frames.view()
+    np.testing.assert_allclose(frames[:, 16], exported["hour_sin"], atol=1e-6)
+    np.testing.assert_allclose(frames[:, 17], exported["hour_cos"], atol=1e-6)
@@ -8,30 +8,43 @@ from keystroke_collector import KeystrokeCollector
 from mouse_collector import MouseCollector
 from window_collector import WindowCollector
 from environment_collector import EnvironmentCollector
+from feature_sampler import FeatureSampler
 
 
 class DataAggregator:
     """すべてのデータを集約"""
 
-    def __init__(self, m5stack_port=None):
+    def __init__(self, m5stack_port=None, mouse_batch_mode=False, category_rules_path=None,
+                 sequence_sink=None, scheduler=None, bus=None):
         """
         データ集約の初期化
 
         Args:
             m5stack_port: M5Stackのシリアルポート（Noneの場合はモックデータ）
+            mouse_batch_mode: マウス移動をバッチ集計する（1000Hzマウスなど高ポーリングレート向け）
+            category_rules_path: 追加の作業カテゴリルール(JSON)のパス
+            sequence_sink: 1秒ごとの特徴量フレームの保存先（sequence_store.SessionWriter）
+            scheduler: 周期処理（特徴量サンプリング・ウィンドウ追跡）を登録するDeadlineScheduler
+            bus: 各収集モジュールが生イベントを発行するEventBus
         """
         print("=" * 60)
         print("データ収集モジュールを初期化しています...")
         print("=" * 60 + "\n")
 
-        self.keystroke_collector = KeystrokeCollector()
-        self.mouse_collector = MouseCollector()
-        self.window_collector = WindowCollector()
-        self.env_collector = EnvironmentCollector(port=m5stack_port)
+        self.keystroke_collector = KeystrokeCollector(bus=bus)
+        self.mouse_collector = MouseCollector(batch_mode=mouse_batch_mode, bus=bus)
+        self.window_collector = WindowCollector(category_rules_path=category_rules_path, bus=bus)
+        self.env_collector = EnvironmentCollector(port=m5stack_port, bus=bus)
 
         # バックグラウンド収集を開始
         self.keystroke_collector.start()
         self.mouse_collector.start()
+        self.window_collector.start_tracking(scheduler)
+
+        # 1秒ごとの特徴量フレーム（LSTM入力用）
+        self.sequence_sink = sequence_sink
+        self.feature_sampler = FeatureSampler(self, sink=sequence_sink)
+        self.feature_sampler.start(scheduler)
 
         print("\n✓ すべてのモジュールを初期化しました\n")
 
@@ -39,7 +52,8 @@ class DataAggregator:
         """1分ごとにすべてのデータを集約"""
         try:
             # 各モジュールから統計を取得
-            keystroke_stats = self.keystroke_collector.calculate_1min_stats()
+            keystroke_windows = self.keystroke_collector.calculate_multi_window_stats()
+            keystroke_stats = keystroke_windows[60]
             mouse_stats = self.mouse_collector.calculate_1min_stats()
             window_stats = self.window_collector.get_1min_stats()
             env_data = self.env_collector.get_latest_data()
@@ -51,6 +65,9 @@ class DataAggregator:
                 # キーストロークデータ
                 "keystroke": keystroke_stats,
 
+                # キーストロークデータ（5秒・10分など全ウィンドウ）
+                "keystroke_windows": keystroke_windows,
+
                 # マウスデータ
                 "mouse": mouse_stats,
 
@@ -69,16 +86,25 @@ class DataAggregator:
             return {
                 "system_time": time.time(),
                 "keystroke": {},
+                "keystroke_windows": {},
                 "mouse": {},
                 "window": {},
                 "environment": {}
             }
 
+    def get_model_input(self):
+        """LSTM入力用の直近10分間の特徴量 (600, 18) を取得（コピーなし）"""
+        return self.feature_sampler.get_model_input()
+
     def stop(self):
         """すべての収集を停止"""
         print("\n収集モジュールを停止しています...")
+        self.feature_sampler.stop()
+        if self.sequence_sink is not None:
+            self.sequence_sink.close()
         self.keystroke_collector.stop()
         self.mouse_collector.stop()
+        self.window_collector.stop_tracking()
         self.env_collector.close()
         print("✓ すべてのモジュールを停止しました")
 
@@ -3,20 +3,272 @@
 SQLiteデータベースにデータを保存
 """
 
+import atexit
+import json
+import math
+import os
+import queue
 import sqlite3
+import threading
+import time
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from dataset_builder import (
+    DATASET_COLUMNS, DEFAULT_CHUNK_SIZE, FEATURE_COLUMNS, PVT_COLUMNS,
+    DatasetSummary, DatasetWriter, add_time_features, encode_chunk, label_with_pvt
+)
+from feature_encoding import DEFAULT_SESSION_GAP_SEC, TimeEncoder
+from archive import DailyArchive, closed_days, day_bounds, day_of
+
+
+# マウスの速度・加速度の統計（v5で追加した列。MouseCollector.calculate_1min_stats のキー）
+MOUSE_KINEMATICS_COLUMNS = (
+    "speed_mean_px_per_sec", "speed_std_px_per_sec", "speed_max_px_per_sec",
+    "acceleration_mean_px_per_sec2", "acceleration_std_px_per_sec2",
+)
+
+TRAINING_COLUMNS = (
+    "timestamp",
+    "typing_speed_kpm", "avg_key_interval_ms", "std_key_interval_ms",
+    "max_key_interval_ms", "min_key_interval_ms", "mistype_frequency",
+    "avg_key_press_duration_ms",
+    "movement_distance_px", "movement_speed_px_per_sec",
+    "click_frequency", "left_click_count",
+    "right_click_count", "still_time_ratio",
+    "window_hash", "work_category", "window_switch_count",
+    "temperature", "humidity", "pressure",
+) + MOUSE_KINEMATICS_COLUMNS
+
+TRAINING_INSERT_SQL = f"""
+    INSERT INTO training_data ({", ".join(TRAINING_COLUMNS)})
+    VALUES ({", ".join("?" * len(TRAINING_COLUMNS))})
+"""
+
+PVT_RESULT_COLUMNS = (
+    "timestamp", "stimulus_time", "reaction_time_ms",
+    "focus_score", "alertness_level", "is_lapse", "false_start", "input_latency_ms",
+)
+
+PVT_INSERT_SQL = f"""
+    INSERT INTO pvt_results ({", ".join(PVT_RESULT_COLUMNS)})
+    VALUES ({", ".join("?" * len(PVT_RESULT_COLUMNS))})
+"""
+
+# ロールアップ（時間・日ごとの集計）の対象: テーブル -> 数値の列
+# 指標名は "<テーブル>.<列>"。"<テーブル>.rows" は行数
+ROLLUP_METRICS = {
+    "training_data": [c for c in TRAINING_COLUMNS
+                      if c not in ("timestamp", "window_hash", "work_category")],
+    "pvt_results": ["reaction_time_ms", "focus_score", "is_lapse", "false_start"],
+}
+ROLLUP_TABLES = ("rollup_hourly", "rollup_daily")
+
+# INSERT文 -> (テーブル, [(指標名, パラメータの位置), ...])
+ROLLUP_SOURCES = {
+    TRAINING_INSERT_SQL: ("training_data", [
+        (f"training_data.{c}", TRAINING_COLUMNS.index(c)) for c in ROLLUP_METRICS["training_data"]]),
+    PVT_INSERT_SQL: ("pvt_results", [
+        (f"pvt_results.{c}", PVT_RESULT_COLUMNS.index(c)) for c in ROLLUP_METRICS["pvt_results"]]),
+}
+
+# SQLでの集計区間の先頭（時間: UNIX時刻の正時、日: ローカル時刻の0時）
+ROLLUP_BUCKET_SQL = {
+    "rollup_hourly": "CAST(timestamp / 3600 AS INTEGER) * 3600",
+    "rollup_daily": "CAST(strftime('%s', date(timestamp, 'unixepoch', 'localtime'), 'utc') AS INTEGER)",
+}
+
+
+def rollup_upsert_sql(table):
+    """ロールアップの加算（既存の区間があれば足し込む）"""
+    return f"""
+        INSERT INTO {table} (bucket_start, metric, n, sum, sumsq, min, max)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(bucket_start, metric) DO UPDATE SET
+            n = n + excluded.n,
+            sum = sum + excluded.sum,
+            sumsq = sumsq + excluded.sumsq,
+            min = MIN(min, excluded.min),
+            max = MAX(max, excluded.max)
+    """
+
+
+def rollup_backfill_sql(metrics=ROLLUP_METRICS):
+    """
+    既存の行からロールアップを作るSQL（マイグレーション用）
+
+    Args:
+        metrics: テーブル -> 対象の列（その時点のスキーマにある列だけを渡すこと）
+    """
+    statements = []
+    for rollup, bucket in ROLLUP_BUCKET_SQL.items():
+        for table, columns in metrics.items():
+            statements.append(f"""
+                INSERT INTO {rollup} (bucket_start, metric, n, sum, sumsq, min, max)
+                SELECT {bucket} AS bucket, '{table}.rows', COUNT(*), COUNT(*), COUNT(*), 1, 1
+                FROM {table} GROUP BY bucket
+            """)
+            for c in columns:
+                statements.append(f"""
+                    INSERT INTO {rollup} (bucket_start, metric, n, sum, sumsq, min, max)
+                    SELECT {bucket} AS bucket, '{table}.{c}',
+                           COUNT({c}), SUM({c}), SUM({c} * {c}), MIN({c}), MAX({c})
+                    FROM {table} WHERE {c} IS NOT NULL GROUP BY bucket
+                """)
+    return statements
+
+
+USER_PROFILE_COLUMNS = ("age", "occupation", "typing_skill",
+                        "baseline_rt_median", "baseline_rt_std")
+
+# スキーマのマイグレーション（PRAGMA user_version の値 = 適用済みの数）
+# 既存の zone_key_data.db もその場で順に移行される。追加は末尾にのみ行うこと。
+SCHEMA_MIGRATIONS = [
+    # v1: 時刻での範囲検索・結合用インデックス
+    [
+        "CREATE INDEX IF NOT EXISTS idx_training_data_timestamp ON training_data(timestamp)",
+        # PVTラベル付けに使う列を含めたカバリングインデックス（テーブル本体を読まずに済む）
+        """CREATE INDEX IF NOT EXISTS idx_pvt_results_timestamp ON pvt_results(
+               timestamp, reaction_time_ms, focus_score, alertness_level, is_lapse)""",
+    ],
+    # v2: 学習データセットの差分エクスポート用の状態
+    [
+        """CREATE TABLE IF NOT EXISTS export_state (
+               output_path TEXT PRIMARY KEY,
+               params TEXT,
+               high_water_ts REAL,
+               last_pvt_ts REAL,
+               file_size INTEGER,
+               total_rows INTEGER,
+               updated_at REAL
+           )""",
+        # チャンクの開始位置: timestamp > after_ts の行はbyte_offsetから書かれている
+        """CREATE TABLE IF NOT EXISTS export_checkpoints (
+               output_path TEXT NOT NULL,
+               after_ts REAL NOT NULL,
+               byte_offset INTEGER NOT NULL,
+               rows_before INTEGER NOT NULL,
+               session_last_ts REAL,
+               session_start REAL,
+               PRIMARY KEY (output_path, after_ts)
+           )""",
+    ],
+    # v3: 時間・日ごとのロールアップ（書き込みのたびに加算し、既存の行から初期値を作る）
+    [
+        f"""CREATE TABLE IF NOT EXISTS {rollup} (
+               bucket_start REAL NOT NULL,
+               metric TEXT NOT NULL,
+               n INTEGER NOT NULL,
+               sum REAL NOT NULL,
+               sumsq REAL NOT NULL,
+               min REAL,
+               max REAL,
+               PRIMARY KEY (bucket_start, metric)
+           )"""
+        for rollup in ROLLUP_TABLES
+    ] + rollup_backfill_sql({
+        # v5で追加した列はこの時点ではまだない（追加前の行は値がないので集計も不要）
+        table: [c for c in columns if c not in MOUSE_KINEMATICS_COLUMNS]
+        for table, columns in ROLLUP_METRICS.items()
+    }),
+    # v4: PVTの入力遅延（キーフックから記録までの時間。反応時間には含めない）
+    [
+        "ALTER TABLE pvt_results ADD COLUMN input_latency_ms REAL",
+    ],
+    # v5: マウスの速度・加速度の統計
+    [
+        f"ALTER TABLE training_data ADD COLUMN {column} REAL"
+        for column in MOUSE_KINEMATICS_COLUMNS
+    ],
+    # v6: 差分エクスポートの再開位置を (timestamp, id) で持つ
+    # （同じ時刻の行がチャンクの境目をまたいでも取りこぼさない）。
+    # idのない古い再開位置は使えないので捨て、次回は全件を作り直す
+    [
+        "DROP TABLE IF EXISTS export_checkpoints",
+        """CREATE TABLE export_checkpoints (
+               output_path TEXT NOT NULL,
+               after_ts REAL NOT NULL,
+               after_id INTEGER NOT NULL,
+               byte_offset INTEGER NOT NULL,
+               rows_before INTEGER NOT NULL,
+               session_last_ts REAL,
+               session_start REAL,
+               PRIMARY KEY (output_path, after_ts, after_id)
+           )""",
+        "ALTER TABLE export_state ADD COLUMN high_water_id INTEGER",
+        "DELETE FROM export_state",
+    ],
+]
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
+# PRAGMA auto_vacuum の INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+# query_rangeで扱えるテーブル
+QUERYABLE_TABLES = ("training_data", "pvt_results")
 
 
 class DataStorage:
-    """データベース保存"""
+    """
+    データベース保存
+
+    書き込みはすべてこのクラスのライタースレッド（唯一の書き込み接続）を経由する。
+    PVTテストなど他のモジュールも自前で接続を開かず、このインスタンスを共有すること。
+    読み取りはスレッドごとの読み取り専用接続で行う。
+
+    archive_dirを指定すると、終わった日のデータを日別ファイルに移した後も
+    query_range・エクスポートはアーカイブとデータベースを区別せずに読む。
+    """
 
-    def __init__(self, db_path="zone_key_data.db"):
+    def __init__(self, db_path="zone_key_data.db", batch_size=64, flush_interval_sec=5.0,
+                 archive_dir=None):
+        """
+        Args:
+            db_path: SQLiteデータベースのパス
+            batch_size: まとめてコミットする行数
+            flush_interval_sec: 行数に満たなくてもコミットするまでの最大待ち時間（秒）
+            archive_dir: 日別アーカイブの保存先（Noneの場合はアーカイブしない）
+        """
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.archive = DailyArchive(archive_dir) if archive_dir else None
+
+        # スキーマ作成用の接続（初期化後は閉じる）
+        self.conn = sqlite3.connect(db_path)
         self.cursor = self.conn.cursor()
+
+        # 削除で空いたページを少しずつ返せるようにする（retention.CompactionJob が使う）。
+        # 新しいDBはテーブルを作る前なら設定だけで切り替わる。既存のDBはVACUUMが必要なので、
+        # データ保持ジョブを使う場合にだけ enable_incremental_vacuum() で切り替える
+        if self.conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+            self.conn.execute(f"PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}")
+
+        # WALモード: 書き込み中も読み取りをブロックせず、コミットごとのfsyncを減らす
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
         self.create_tables()
+        self.conn.close()
+        self.conn = None
+        self.cursor = None
+
+        # スレッドごとの読み取り専用接続
+        self.local = threading.local()
+        self.read_connections = []
+        self.read_lock = threading.Lock()
+
+        # 書き込みキュー（ライタースレッドがまとめてコミットする）
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self.write_queue = queue.Queue()
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.commit_count = 0
+        # close() 後の書き込みを受け付けない（停止要求より後ろに積まれた書き込みは失われるため）
+        self.submit_lock = threading.Lock()
+        self.closed = False
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+        atexit.register(self.close)
+
         print(f"✓ データベース接続: {db_path}")
 
     def create_tables(self):
@@ -88,29 +340,255 @@ class DataStorage:
         """)
 
         self.conn.commit()
+        self.migrate()
         print("✓ データベーステーブルを作成しました")
 
+    def migrate(self):
+        """スキーマを最新バージョンに移行"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for v in range(version, SCHEMA_VERSION):
+            with self.conn:
+                for sql in SCHEMA_MIGRATIONS[v]:
+                    self.conn.execute(sql)
+                self.conn.execute(f"PRAGMA user_version = {v + 1}")
+            print(f"✓ データベーススキーマを v{v + 1} に移行しました")
+
+        # 列名の一覧（query_rangeの検証用）
+        self.table_columns = {
+            table: [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            for table in QUERYABLE_TABLES
+        }
+
+    # ==========================================================
+    #  書き込みキュー（write-behind）
+    # ==========================================================
+
+    def _writer_loop(self):
+        """キューに溜まった書き込みを件数・時間のしきい値でまとめてコミット"""
+        writer_conn = sqlite3.connect(self.db_path)
+        writer_conn.execute("PRAGMA synchronous=NORMAL")
+        pending = []
+        deadline = None
+
+        while True:
+            timeout = None if not pending else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.write_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = "timeout"
+
+            if isinstance(item, tuple):
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval_sec
+                pending.append(item)
+                if len(pending) < self.batch_size:
+                    continue
+
+            # しきい値到達・flush要求・停止要求のいずれかでコミット
+            if pending:
+                self._commit_batch(writer_conn, pending)
+                pending = []
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                break
+
+        writer_conn.close()
+
+    def _commit_batch(self, writer_conn, batch):
+        """
+        同じSQLの連続をexecutemanyにまとめ、1トランザクションでコミット
+
+        パラメータがNoneの項目（PRAGMA incremental_vacuum などの保守用SQL）は
+        トランザクションの外で、コミットの後に実行する。
+        一時的でないエラー（制約違反・型の誤りなど）の場合は1行ずつコミットし直し、
+        書き込めない行だけを捨てる。
+        """
+        maintenance = [sql for sql, params in batch if params is None]
+        if maintenance:
+            batch = [item for item in batch if item[1] is not None]
+        committed = False
+        all_written = True
+        for attempt in range(3):
+            try:
+                with writer_conn:
+                    start = 0
+                    while start < len(batch):
+                        sql = batch[start][0]
+                        end = start
+                        while end < len(batch) and batch[end][0] == sql:
+                            end += 1
+                        writer_conn.executemany(sql, [params for _, params in batch[start:end]])
+                        start = end
+                    # 同じトランザクションでロールアップを更新
+                    self._update_rollups(writer_conn, batch)
+                self.rows_written += len(batch)
+                self.commit_count += 1
+                committed = True
+                break
+            except sqlite3.OperationalError as e:
+                # database is locked など一時的なエラーは少し待って再試行
+                print(f"⚠ データ書き込み再試行 ({attempt + 1}/3): {e}")
+                time.sleep(0.5 * (attempt + 1))
+            except Exception as e:
+                print(f"⚠ データ書き込みエラー: {e}（1行ずつ書き込み直します）")
+                all_written = self._commit_rows(writer_conn, batch)
+                committed = True
+                break
+        if not committed:
+            print(f"⚠ {len(batch)}件のデータを書き込めませんでした")
+            return False
+
+        # 保守用SQLはコミット済みのバッチとは別に実行する（失敗してもバッチを再実行しない）
+        for sql in maintenance:
+            try:
+                # incremental_vacuumはexecuteだと1ページずつしか進まないので最後まで実行させる
+                writer_conn.executescript(sql)
+            except sqlite3.Error as e:
+                print(f"⚠ 保守処理エラー: {e}")
+        return all_written
+
+    def _commit_rows(self, writer_conn, batch):
+        """
+        バッチを1行ずつコミットする（書き込めない行はSQLと値を表示して捨てる）
+
+        Returns:
+            すべての行を書き込めた場合はTrue
+        """
+        dropped = 0
+        for sql, params in batch:
+            try:
+                with writer_conn:
+                    writer_conn.execute(sql, params)
+                    self._update_rollups(writer_conn, [(sql, params)])
+                self.rows_written += 1
+            except Exception as e:
+                dropped += 1
+                print(f"⚠ 書き込めない行を捨てました: {e}")
+                print(f"    SQL: {' '.join(sql.split())}")
+                print(f"    値: {params!r}")
+        self.rows_dropped += dropped
+        self.commit_count += 1
+        if dropped:
+            print(f"⚠ {len(batch)}件中{dropped}件を捨てました")
+        return dropped == 0
+
+    def _update_rollups(self, writer_conn, batch):
+        """バッチ内の学習データ・PVT結果を時間・日ごとに集計して加算"""
+        totals = ({}, {})  # (rollup_hourly, rollup_daily): {(区間, 指標): [n, sum, sumsq, min, max]}
+        day_starts = {}
+        for sql, params in batch:
+            source = ROLLUP_SOURCES.get(sql)
+            if source is None or params[0] is None:
+                continue
+            table, metrics = source
+            ts = float(params[0])
+            hour = math.floor(ts / 3600) * 3600.0
+            day = day_of(ts)
+            if day not in day_starts:
+                day_starts[day] = day_bounds(day)[0]
+            for bucket, acc in zip((hour, day_starts[day]), totals):
+                values = [(f"{table}.rows", 1.0)]
+                values += [(metric, params[i]) for metric, i in metrics if params[i] is not None]
+                for metric, value in values:
+                    value = float(value)
+                    entry = acc.get((bucket, metric))
+                    if entry is None:
+                        acc[(bucket, metric)] = [1, value, value * value, value, value]
+                    else:
+                        entry[0] += 1
+                        entry[1] += value
+                        entry[2] += value * value
+                        entry[3] = min(entry[3], value)
+                        entry[4] = max(entry[4], value)
+        for rollup, acc in zip(ROLLUP_TABLES, totals):
+            if acc:
+                writer_conn.executemany(rollup_upsert_sql(rollup),
+                                        [(b, m, *v) for (b, m), v in acc.items()])
+
+    def submit(self, sql, params):
+        """書き込みをキューに追加（ディスクI/Oを待たずに戻る。paramsがNoneなら保守用SQL）"""
+        with self.submit_lock:
+            if self.closed:
+                raise RuntimeError(f"データベース接続は閉じています（書き込めません）: {self.db_path}")
+            self.write_queue.put((sql, params))
+
+    def enable_incremental_vacuum(self):
+        """
+        既存のデータベースの auto_vacuum を INCREMENTAL に切り替える（切り替え済みなら何もしない）
+
+        データベース全体をVACUUMして作り直すので、大きさに応じて時間がかかり、
+        一時的にデータベースと同じくらいの空き容量が必要になる。VACUUMはライタースレッドで
+        実行し、終わるまでの書き込みはキューで待たされる。
+
+        Returns:
+            INCREMENTAL になっていればTrue
+        """
+        if self._auto_vacuum_mode() == AUTO_VACUUM_INCREMENTAL:
+            return True
+        conn = self.read_connection()
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        print(f"⚠ インクリメンタルVACUUMを有効にするため、データベース全体をVACUUMします"
+              f"（{page_count * page_size / 1024 / 1024:.1f}MB。完了まで時間がかかります）")
+        self.submit(f"PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}; VACUUM", None)
+        self.flush(timeout=None)
+        enabled = self._auto_vacuum_mode() == AUTO_VACUUM_INCREMENTAL
+        if enabled:
+            print("✓ インクリメンタルVACUUMを有効にしました")
+        return enabled
+
+    def _auto_vacuum_mode(self):
+        """現在の auto_vacuum（開いている接続は開いた時点の値を返すので、新しい接続で確認する）"""
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        finally:
+            conn.close()
+
+    def flush(self, timeout=10.0):
+        """キューに溜まっている書き込みをすべてコミットするまで待つ"""
+        if self.closed or not self.writer_thread.is_alive():
+            return False
+        done = threading.Event()
+        self.write_queue.put(done)
+        return done.wait(timeout)
+
+    def read_connection(self):
+        """呼び出し元スレッド用の読み取り専用接続を返す"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True,
+                                   check_same_thread=False)
+            self.local.conn = conn
+            with self.read_lock:
+                self.read_connections.append(conn)
+        return conn
+
+    def release_read_connection(self):
+        """呼び出し元スレッドの読み取り接続を閉じる（使い捨てのスレッドは終了前に呼ぶこと）"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            return
+        self.local.conn = None
+        with self.read_lock:
+            if conn in self.read_connections:
+                self.read_connections.remove(conn)
+        conn.close()
+
+    # ==========================================================
+    #  保存
+    # ==========================================================
+
     def save_data(self, data):
-        """集約データを保存"""
+        """集約データを保存（キューに追加するだけで、コミットはライタースレッドが行う）"""
         try:
             keystroke = data.get("keystroke", {})
             mouse = data.get("mouse", {})
             window = data.get("window", {})
             environment = data.get("environment", {})
 
-            self.cursor.execute("""
-                INSERT INTO training_data (
-                    timestamp,
-                    typing_speed_kpm, avg_key_interval_ms, std_key_interval_ms,
-                    max_key_interval_ms, min_key_interval_ms, mistype_frequency,
-                    avg_key_press_duration_ms,
-                    movement_distance_px, movement_speed_px_per_sec,
-                    click_frequency, left_click_count,
-                    right_click_count, still_time_ratio,
-                    window_hash, work_category, window_switch_count,
-                    temperature, humidity, pressure
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+            self.submit(TRAINING_INSERT_SQL, (
                 data.get("system_time"),
                 keystroke.get("typing_speed_kpm"),
                 keystroke.get("avg_key_interval_ms"),
@@ -130,123 +608,446 @@ class DataStorage:
                 window.get("window_switch_count"),
                 environment.get("temperature"),
                 environment.get("humidity"),
-                environment.get("pressure")
+                environment.get("pressure"),
+                *(mouse.get(column) for column in MOUSE_KINEMATICS_COLUMNS)
             ))
-            self.conn.commit()
             return True
 
         except Exception as e:
             print(f"⚠ データ保存エラー: {e}")
             return False
 
-    def export_to_csv(self, output_path="training_data.csv"):
-        """学習用にCSV形式でエクスポート"""
+    def save_pvt_result(self, timestamp, stimulus_time, reaction_time_ms,
+                        focus_score, alertness_level, is_lapse, false_start=False,
+                        input_latency_ms=None):
+        """PVTテスト結果を保存（input_latency_ms: 入力から記録までの平均遅延）"""
+        self.submit(PVT_INSERT_SQL, (timestamp, stimulus_time, reaction_time_ms,
+                                     focus_score, alertness_level, is_lapse, false_start,
+                                     input_latency_ms))
+
+    def update_user_profile(self, user_id, **fields):
+        """ユーザープロファイルを作成・更新（指定した項目のみ上書き）"""
+        columns = [c for c in USER_PROFILE_COLUMNS if c in fields]
+        values = [fields[c] for c in columns]
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns) or "user_id = user_id"
+        sql = f"""
+            INSERT INTO user_profile (user_id, created_at{''.join(', ' + c for c in columns)})
+            VALUES (?, ?{', ?' * len(columns)})
+            ON CONFLICT(user_id) DO UPDATE SET {updates}
+        """
+        self.submit(sql, (user_id, time.time(), *values))
+
+    def export_to_csv(self, output_path="training_data.csv", chunk_size=DEFAULT_CHUNK_SIZE):
+        """学習用にCSV形式でエクスポート（chunk_size行ずつ読み込んで追記する）"""
+        writer = None
         try:
-            df = pd.read_sql_query("SELECT * FROM training_data", self.conn)
-            df.to_csv(output_path, index=False)
+            writer = DatasetWriter(output_path, fmt="csv")
+            for chunk in self.iter_table_chunks("training_data", chunk_size=chunk_size):
+                writer.write(chunk)
+            writer.write_header(self.table_columns["training_data"])
             print(f"✓ データをエクスポート: {output_path}")
-            print(f"  総レコード数: {len(df)}")
+            print(f"  総レコード数: {writer.rows}")
             return True
         except Exception as e:
             print(f"⚠ CSVエクスポートエラー: {e}")
             return False
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def export_pvt_dataset(self, output_path="dataset_pvt.csv", tolerance_sec=900,
+                           direction="nearest", decay_tau_sec=300,
+                           chunk_size=DEFAULT_CHUNK_SIZE, tz=None,
+                           session_gap_sec=DEFAULT_SESSION_GAP_SEC,
+                           incremental=True, verbose=True):
+        """
+        PVTデータを含む学習用データセットをエクスポート
 
-    def export_pvt_dataset(self, output_path="dataset_pvt.csv"):
-        """PVTデータを含む学習用データセットをエクスポート"""
+        各行には時間的に最も近いPVT結果（tolerance_sec以内）をラベルとして付ける。
+        センサーデータはchunk_size行ずつ読み込み、ラベル付け・エンコードして
+        そのまま追記するので、DBの大きさによらずメモリ使用量は一定。
+        PVT結果は件数が少ないので全件を読み込んでおく。
+
+        CSVの場合は前回の出力位置（export_state / export_checkpoints）を記録しておき、
+        2回目以降は新しい行だけを追記する。前回以降に新しいPVT結果が届いた場合は、
+        ラベルが変わりうる行（そのPVTの tolerance_sec 前以降）を含むチャンクから書き直す。
+        ファイルが前回の出力と一致しない場合や設定を変えた場合は全件を作り直す。
+
+        Args:
+            output_path: 出力パス（.parquet ならParquet、それ以外はCSV）
+            tolerance_sec: ラベルに使うPVTとの最大時間差（秒）
+            direction: "nearest" / "backward" / "forward"
+            decay_tau_sec: 時間差によるラベル信頼度 label_weight の減衰時定数（秒）
+            chunk_size: 1回に読み込む行数
+            tz: 時刻特徴量のタイムゾーン名（Noneの場合はOSのローカルタイム）
+            session_gap_sec: これ以上記録が空いたら別セッションとみなす（秒）
+            incremental: Falseの場合は常に全件を作り直す（Parquetは常に全件）
+            verbose: Falseの場合は結果を表示しない
+        """
+        writer = None
         try:
-            query = """
-                SELECT
-                    t.timestamp,
-                    t.typing_speed_kpm,
-                    t.avg_key_interval_ms,
-                    t.std_key_interval_ms,
-                    t.mistype_frequency,
-                    t.movement_distance_px,
-                    t.click_frequency,
-                    t.work_category,
-                    t.window_switch_count,
-                    t.temperature,
-                    t.humidity,
-                    t.pressure,
-                    p.reaction_time_ms AS pvt_rt,
-                    p.focus_score AS pvt_focus_score,
-                    p.alertness_level,
-                    p.is_lapse AS pvt_lapse,
-                    p.focus_score AS target_focus_score,
-                    CASE
-                        WHEN p.focus_score > 0.7 THEN 'Deep Focus'
-                        WHEN p.focus_score >= 0.3 THEN 'Open'
-                        ELSE 'Overheat'
-                    END AS target_state
-                FROM training_data t
-                LEFT JOIN (
-                    SELECT
-                        *,
-                        ROW_NUMBER() OVER (
-                            PARTITION BY CAST(timestamp / 3600 AS INTEGER)
-                            ORDER BY timestamp DESC
-                        ) as rn
-                    FROM pvt_results
-                    WHERE reaction_time_ms IS NOT NULL
-                ) p ON p.rn = 1
-                WHERE p.reaction_time_ms IS NOT NULL
-                ORDER BY t.timestamp
-            """
+            pvt_chunks = list(self.iter_table_chunks("pvt_results", list(PVT_COLUMNS)))
+            if pvt_chunks:
+                pvt = pd.concat(pvt_chunks, ignore_index=True)
+            else:
+                # PVTテストがまだない（新しいデータベース）: ラベルなしで書き出す
+                pvt = pd.DataFrame({c: pd.Series(dtype="float64") for c in PVT_COLUMNS})
+            pvt = pvt[pvt["reaction_time_ms"].notna()].reset_index(drop=True)
+            params = json.dumps({
+                "tolerance_sec": tolerance_sec, "direction": direction,
+                "decay_tau_sec": decay_tau_sec, "tz": tz,
+                "session_gap_sec": session_gap_sec, "columns": DATASET_COLUMNS
+            }, sort_keys=True)
 
-            df = pd.read_sql_query(query, self.conn)
+            # 再開位置（Noneなら全件を作り直す）
+            checkpoint = None
+            if incremental and not output_path.endswith(".parquet"):
+                checkpoint = self._find_export_checkpoint(output_path, params, pvt, tolerance_sec)
 
-            # 作業カテゴリのOne-Hot Encoding
-            df = pd.get_dummies(df, columns=['work_category'])
+            time_encoder = TimeEncoder(tz=tz, session_gap_sec=session_gap_sec)
+            if checkpoint is None:
+                after_ts, after_id, offset, rows_before = -1.0, -1, 0, 0
+            else:
+                after_ts, after_id, offset, rows_before, time_encoder.last_timestamp, \
+                    time_encoder.session_start = checkpoint
+            writer = DatasetWriter(output_path, resume_offset=offset)
+            summary = DatasetSummary()
+            checkpoints = []
 
-            # 時刻のCyclical Encoding
-            df['hour_sin'] = np.sin(2 * np.pi * df['timestamp'].apply(
-                lambda x: datetime.fromtimestamp(x).hour) / 24)
-            df['hour_cos'] = np.cos(2 * np.pi * df['timestamp'].apply(
-                lambda x: datetime.fromtimestamp(x).hour) / 24)
+            # セッションの判定は全行で行う（ラベルのない行もセッションの一部）
+            for features in self.iter_table_chunks("training_data", FEATURE_COLUMNS + ["id"],
+                                                   after_ts=after_ts, after_id=after_id,
+                                                   chunk_size=chunk_size):
+                if len(features) == 0:
+                    continue
+                checkpoints.append((after_ts, after_id, writer.tell(), rows_before + writer.rows,
+                                    time_encoder.last_timestamp, time_encoder.session_start))
+                after_ts = float(features["timestamp"].iloc[-1])
+                after_id = int(features["id"].iloc[-1])
+                features = add_time_features(features.drop(columns=["id"]), time_encoder)
+                df = label_with_pvt(features, pvt, tolerance_sec=tolerance_sec,
+                                    direction=direction, decay_tau_sec=decay_tau_sec)
+                if len(df) == 0:
+                    continue
+                df = encode_chunk(df)
+                writer.write(df)
+                summary.update(df)
+            writer.write_header(DATASET_COLUMNS)
+            writer.close()
 
-            # CSV出力
-            df.to_csv(output_path, index=False)
+            # 次回の再開位置（最後の行の後ろ）
+            total_rows = rows_before + writer.rows
+            checkpoints.append((after_ts, after_id, writer.tell(), total_rows,
+                                time_encoder.last_timestamp, time_encoder.session_start))
+            if writer.fmt == "csv":
+                self._save_export_state(output_path, params, pvt, checkpoints, total_rows,
+                                        full=checkpoint is None)
 
-            print(f"✓ PVTデータセット生成完了: {output_path}")
-            print(f"  総サンプル数: {len(df)}")
-            print(f"  特徴量数: {len(df.columns) - 2}")  # ターゲット変数を除く
+            if verbose:
+                if checkpoint is None:
+                    print(f"✓ PVTデータセット生成完了: {output_path}")
+                else:
+                    print(f"✓ PVTデータセット更新完了: {output_path}（追加・更新 {writer.rows}件）")
+                print(f"  総サンプル数: {total_rows}")
+                print(f"  特徴量数: {len(DATASET_COLUMNS) - 4}")  # ターゲット変数・ラベル情報を除く
 
-            # データ分布の確認
-            if len(df) > 0:
-                print("\n【集中度スコアの分布】")
-                print(df['target_focus_score'].describe())
-                print("\n【状態ラベルの分布】")
-                print(df['target_state'].value_counts())
+                # データ分布の確認（今回書き込んだ行）
+                if writer.rows > 0:
+                    summary.print_summary()
 
             return True
 
         except Exception as e:
             print(f"⚠ PVTデータセットエクスポートエラー: {e}")
             return False
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def _find_export_checkpoint(self, output_path, params, pvt, tolerance_sec):
+        """
+        差分エクスポートの再開位置を探す
+
+        Returns:
+            (after_ts, after_id, byte_offset, rows_before, session_last_ts, session_start)
+            または None（全件を作り直す）
+        """
+        conn = self.read_connection()
+        state = conn.execute("""
+            SELECT params, high_water_ts, high_water_id, last_pvt_ts, file_size
+            FROM export_state WHERE output_path = ?
+        """, (os.path.abspath(output_path),)).fetchone()
+        if state is None:
+            return None
+        saved_params, high_water_ts, high_water_id, last_pvt_ts, file_size = state
+        if saved_params != params or not os.path.exists(output_path) \
+                or os.path.getsize(output_path) != file_size:
+            return None
+
+        # 新しいPVT結果の tolerance_sec 前以降はラベルが変わりうる
+        sql = """
+            SELECT after_ts, after_id, byte_offset, rows_before, session_last_ts, session_start
+            FROM export_checkpoints
+            WHERE output_path = ? AND (after_ts, after_id) <= (?, ?)
+        """
+        args = [os.path.abspath(output_path), high_water_ts, high_water_id]
+        new_pvt = pvt["timestamp"][pvt["timestamp"] > last_pvt_ts] if last_pvt_ts is not None \
+            else pvt["timestamp"]
+        if len(new_pvt) > 0:
+            sql += " AND after_ts < ?"
+            args.append(float(new_pvt.min()) - tolerance_sec)
+        sql += " ORDER BY after_ts DESC, after_id DESC LIMIT 1"
+        return conn.execute(sql, args).fetchone()
+
+    def _save_export_state(self, output_path, params, pvt, checkpoints, total_rows, full):
+        """差分エクスポートの状態を書き込みキュー経由で保存"""
+        output_path = os.path.abspath(output_path)
+        first_after = (-1.0, -1) if full else checkpoints[0][:2]
+        self.submit("DELETE FROM export_checkpoints WHERE output_path = ? AND (after_ts, after_id) >= (?, ?)",
+                    (output_path, *first_after))
+        for checkpoint in checkpoints:
+            self.submit("""
+                INSERT OR REPLACE INTO export_checkpoints (
+                    output_path, after_ts, after_id, byte_offset, rows_before,
+                    session_last_ts, session_start
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (output_path, *checkpoint))
+        last_pvt_ts = float(pvt["timestamp"].max()) if len(pvt) > 0 else None
+        after_ts, after_id, file_size = checkpoints[-1][:3]
+        self.submit("""
+            INSERT OR REPLACE INTO export_state (
+                output_path, params, high_water_ts, high_water_id, last_pvt_ts,
+                file_size, total_rows, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (output_path, params, after_ts, after_id, last_pvt_ts, file_size, total_rows,
+              time.time()))
+        self.flush()
+
+    # ==========================================================
+    #  アーカイブ
+    # ==========================================================
+
+    def archive_closed_days(self, today=None):
+        """
+        昨日までのデータを日別アーカイブに移す
+
+        1日分ずつアーカイブファイルとマニフェストを書いてから、
+        書き込みキュー経由でデータベースの行を削除する。
+
+        Returns:
+            アーカイブした行数
+        """
+        if self.archive is None:
+            return 0
+        archived = 0
+        self.flush()
+        conn = self.read_connection()
+        for table in QUERYABLE_TABLES:
+            first = conn.execute(f"SELECT MIN(timestamp) FROM {table}").fetchone()[0]
+            if first is None:
+                continue
+            for day in closed_days(first, today):
+                start, end = day_bounds(day)
+                df = pd.read_sql_query(
+                    f"SELECT * FROM {table} WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+                    conn, params=(start, end))
+                if len(df) == 0:
+                    continue
+                self.archive.write_partition(table, day, df)
+                # 読み込んだ後に届いた行は消さない（次回のアーカイブで統合される）
+                self.submit(f"DELETE FROM {table} WHERE timestamp >= ? AND timestamp < ? AND id <= ?",
+                            (start, end, int(df["id"].max())))
+                archived += len(df)
+                print(f"✓ アーカイブ: {table} {day.isoformat()} ({len(df)}件)")
+        self.flush()
+        return archived
+
+    def iter_table_chunks(self, table, columns=None, after_ts=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                          after_id=None):
+        """
+        アーカイブとデータベースの行を (timestamp, id) の順にchunk_size行ずつ返す
+
+        Args:
+            table: "training_data" または "pvt_results"
+            columns: 取得する列（Noneの場合は全列）
+            after_ts: これより後（timestamp > after_ts）の行のみ
+            chunk_size: 1チャンクの行数
+            after_id: 指定すると after_ts と同じ時刻の行のうち id > after_id のものも返す
+                      （(timestamp, id) > (after_ts, after_id)。チャンクの続きから読む場合に使う）
+        """
+        if table not in QUERYABLE_TABLES:
+            raise ValueError(f"未対応のテーブルです: {table}")
+        # アーカイブ（1日分ずつ読み、chunk_size行に分けて返す）
+        if self.archive is not None:
+            # 列を追加する前のパーティションも現在の列の並びに揃える
+            archive_columns = columns if columns is not None else self.table_columns[table]
+            read_columns = list(dict.fromkeys(archive_columns + ["timestamp", "id"]))
+            for key, _ in self.archive.partitions(table, start=after_ts):
+                df = self.archive.read_partition(table, key, read_columns)
+                df = df.sort_values(["timestamp", "id"], kind="stable")
+                if after_ts is not None:
+                    ts = df["timestamp"].to_numpy()
+                    mask = ts > after_ts
+                    if after_id is not None:
+                        mask |= (ts == after_ts) & (df["id"].to_numpy() > after_id)
+                    df = df[mask]
+                df = df[archive_columns]
+                for start in range(0, len(df), chunk_size):
+                    yield df.iloc[start:start + chunk_size].reset_index(drop=True)
+
+        # データベース
+        self.flush()
+        select = "*" if columns is None else ", ".join(columns)
+        sql = f"SELECT {select} FROM {table}"
+        params = ()
+        if after_ts is not None and after_id is not None:
+            sql += " WHERE (timestamp, id) > (?, ?)"
+            params = (after_ts, after_id)
+        elif after_ts is not None:
+            sql += " WHERE timestamp > ?"
+            params = (after_ts,)
+        sql += " ORDER BY timestamp, id"
+        for chunk in pd.read_sql_query(sql, self.read_connection(), params=params,
+                                       chunksize=chunk_size):
+            if len(chunk) > 0:
+                yield chunk
+
+    # ==========================================================
+    #  読み取り
+    # ==========================================================
+
+    def query_range(self, start, end, columns=None, resolution=None,
+                    table="training_data", as_frame=True):
+        """
+        時間範囲のデータを取得（timestampインデックスを使う）
+
+        Args:
+            start, end: 範囲 [start, end) のUNIX時刻またはdatetime
+            columns: 取得する列（Noneの場合は全列）
+            resolution: 集約する時間幅（秒）。指定すると各区間の平均値を返す
+            table: "training_data" または "pvt_results"
+            as_frame: TrueならDataFrame、Falseなら {列名: numpy配列}
+
+        Returns:
+            timestamp列を先頭に時刻順に並んだデータ
+        """
+        if table not in QUERYABLE_TABLES:
+            raise ValueError(f"未対応のテーブルです: {table}")
+        start = start.timestamp() if isinstance(start, datetime) else float(start)
+        end = end.timestamp() if isinstance(end, datetime) else float(end)
+
+        known = self.table_columns[table]
+        if columns is None:
+            columns = [c for c in known if c not in ("id", "timestamp")]
+        unknown = [c for c in columns if c not in known]
+        if unknown:
+            raise ValueError(f"存在しない列です: {unknown}")
+        columns = [c for c in columns if c != "timestamp"]
+
+        if resolution:
+            text_columns = {"window_hash", "work_category", "alertness_level", "state_label"}
+            if text_columns & set(columns):
+                raise ValueError("文字列の列は集約できません（resolutionを外してください）")
+            resolution = float(resolution)
+            select = ", ".join([f"CAST(timestamp / {resolution} AS INTEGER) * {resolution} AS timestamp"]
+                               + [f"AVG({c}) AS {c}" for c in columns])
+            sql = f"""
+                SELECT {select} FROM {table}
+                WHERE timestamp >= ? AND timestamp < ?
+                GROUP BY CAST(timestamp / {resolution} AS INTEGER)
+                ORDER BY timestamp
+            """
+        else:
+            sql = f"""
+                SELECT {", ".join(["timestamp"] + columns)} FROM {table}
+                WHERE timestamp >= ? AND timestamp < ?
+                ORDER BY timestamp
+            """
+
+        self.flush()
+        archived = self.archive.read_range(table, start, end, ["timestamp"] + columns) \
+            if self.archive is not None else None
+        if archived is None:
+            df = pd.read_sql_query(sql, self.read_connection(), params=(start, end))
+        else:
+            # アーカイブと重なる場合は生データを結合してから集約する
+            hot = pd.read_sql_query(f"""
+                SELECT {", ".join(["timestamp"] + columns)} FROM {table}
+                WHERE timestamp >= ? AND timestamp < ?
+                ORDER BY timestamp
+            """, self.read_connection(), params=(start, end))
+            frames = [frame for frame in (archived, hot) if len(frame) > 0] or [archived]
+            df = pd.concat(frames, ignore_index=True).infer_objects()
+            df = df.sort_values("timestamp", kind="stable").reset_index(drop=True)
+            if resolution:
+                bucket = (df["timestamp"] // resolution) * resolution
+                df = df[columns].groupby(bucket.rename("timestamp")).mean().reset_index()
+        if as_frame:
+            return df
+        return {c: df[c].to_numpy() for c in df.columns}
+
+    def get_rollup(self, start=None, end=None, metrics=None, resolution="daily"):
+        """
+        時間・日ごとの集計を取得（生データは読まない）
+
+        Args:
+            start, end: 区間の先頭が [start, end) に入るものを返す（UNIX時刻またはdatetime）
+            metrics: 指標名のリスト（"training_data.typing_speed_kpm" など。Noneの場合は全指標）
+            resolution: "hourly" または "daily"
+
+        Returns:
+            bucket_start, metric, n, mean, std, min, max 列のDataFrame
+        """
+        if resolution not in ("hourly", "daily"):
+            raise ValueError(f"未対応の集計単位です: {resolution}")
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("bucket_start >= ?")
+            params.append(start.timestamp() if isinstance(start, datetime) else float(start))
+        if end is not None:
+            conditions.append("bucket_start < ?")
+            params.append(end.timestamp() if isinstance(end, datetime) else float(end))
+        if metrics:
+            conditions.append(f"metric IN ({', '.join('?' * len(metrics))})")
+            params.extend(metrics)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        self.flush()
+        df = pd.read_sql_query(f"""
+            SELECT bucket_start, metric, n, sum, sumsq, min, max
+            FROM rollup_{resolution} {where}
+            ORDER BY bucket_start, metric
+        """, self.read_connection(), params=params)
+        n = df["n"].to_numpy(dtype=float)
+        mean = df["sum"].to_numpy(dtype=float) / n
+        variance = np.maximum(df["sumsq"].to_numpy(dtype=float) / n - mean * mean, 0.0)
+        df["mean"] = mean
+        df["std"] = np.sqrt(variance)
+        return df[["bucket_start", "metric", "n", "mean", "std", "min", "max"]]
 
     def get_statistics(self):
-        """データベースの統計情報を取得"""
+        """データベースの統計情報を取得（日ごとのロールアップから集計する）"""
         try:
-            # training_dataのレコード数
-            self.cursor.execute("SELECT COUNT(*) FROM training_data")
-            training_count = self.cursor.fetchone()[0]
-
-            # pvt_resultsのレコード数
-            self.cursor.execute("SELECT COUNT(*) FROM pvt_results")
-            pvt_count = self.cursor.fetchone()[0]
-
-            # PVTの平均反応時間
-            self.cursor.execute("""
-                SELECT AVG(reaction_time_ms)
-                FROM pvt_results
-                WHERE reaction_time_ms IS NOT NULL
+            self.flush()
+            cursor = self.read_connection().cursor()
+            cursor.execute("""
+                SELECT metric, SUM(n), SUM(sum)
+                FROM rollup_daily
+                WHERE metric IN ('training_data.rows', 'pvt_results.rows',
+                                 'pvt_results.reaction_time_ms')
+                GROUP BY metric
             """)
-            avg_rt = self.cursor.fetchone()[0]
+            totals = {metric: (n, total) for metric, n, total in cursor.fetchall()}
+
+            training_count = totals.get("training_data.rows", (0, 0))[0]
+            pvt_count = totals.get("pvt_results.rows", (0, 0))[0]
+            rt_n, rt_sum = totals.get("pvt_results.reaction_time_ms", (0, 0))
+            avg_rt = rt_sum / rt_n if rt_n else 0
 
             return {
                 "training_data_count": training_count,
                 "pvt_test_count": pvt_count,
-                "avg_reaction_time_ms": avg_rt if avg_rt else 0
+                "avg_reaction_time_ms": avg_rt
             }
 
         except Exception as e:
@@ -254,8 +1055,17 @@ class DataStorage:
             return None
 
     def close(self):
-        """データベース接続を閉じる"""
-        self.conn.close()
+        """キューを書き切ってからデータベース接続を閉じる"""
+        with self.submit_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.write_queue.put(None)
+        self.writer_thread.join()
+        with self.read_lock:
+            for conn in self.read_connections:
+                conn.close()
+            self.read_connections = []
         print("✓ データベース接続を閉じました")
 
 
@@ -0,0 +1,245 @@
+"""
+データセット生成モジュール
+センサーデータ（training_data）にPVT結果をas-of結合でラベル付けし、
+チャンク単位でエンコードしてCSV/Parquetに逐次書き出す
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+from feature_encoding import TIME_FEATURE_COLUMNS, TimeEncoder
+from streaming_stats import RunningStats
+
+
+# One-Hot化する作業カテゴリ（window_collector.CATEGORY_RULES と同じ並び）
+# チャンクに現れるカテゴリによらず列構成を固定するため、ここで列挙しておく。
+# ルールファイルで追加された未知のカテゴリは "other" として扱う。
+WORK_CATEGORIES = ("development", "communication", "browsing", "document", "other")
+
+# エクスポート時に1回に読み込む行数
+DEFAULT_CHUNK_SIZE = 10000
+
+
+# 学習データセットに含める特徴量の列
+FEATURE_COLUMNS = [
+    "timestamp",
+    "typing_speed_kpm",
+    "avg_key_interval_ms",
+    "std_key_interval_ms",
+    "mistype_frequency",
+    "movement_distance_px",
+    "click_frequency",
+    "speed_mean_px_per_sec",
+    "speed_max_px_per_sec",
+    "acceleration_mean_px_per_sec2",
+    "work_category",
+    "window_switch_count",
+    "temperature",
+    "humidity",
+    "pressure",
+]
+
+# PVT結果の列 -> データセットでの列名
+PVT_COLUMNS = {
+    "timestamp": "pvt_timestamp",
+    "reaction_time_ms": "pvt_rt",
+    "focus_score": "pvt_focus_score",
+    "alertness_level": "alertness_level",
+    "is_lapse": "pvt_lapse",
+}
+
+# チャンクの出力列（エンコード後）の並び
+LABEL_COLUMNS = ["pvt_rt", "pvt_focus_score", "alertness_level", "pvt_lapse",
+                 "pvt_time_delta_sec", "label_weight", "target_focus_score", "target_state"]
+DATASET_COLUMNS = (
+    [c for c in FEATURE_COLUMNS if c != "work_category"]
+    + LABEL_COLUMNS
+    + [f"work_category_{c}" for c in WORK_CATEGORIES]
+    + TIME_FEATURE_COLUMNS
+)
+
+# 出力列の型（チャンクごとの型推論に任せると、同じ列が 0 と 0.0 のように
+# チャンクによって違う表記で書き出されるので、書き出す前にこの型に揃える）
+# 欠損がありうる整数列は pandas の nullable 整数（Int64）にする
+DATASET_DTYPES = {c: "float64" for c in DATASET_COLUMNS}
+DATASET_DTYPES.update({
+    "click_frequency": "Int64",
+    "window_switch_count": "Int64",
+    "alertness_level": "string",
+    "pvt_lapse": "Int64",
+    "target_state": "string",
+})
+DATASET_DTYPES.update({f"work_category_{c}": "bool" for c in WORK_CATEGORIES})
+
+
+def label_with_pvt(features, pvt, tolerance_sec=900, direction="nearest", decay_tau_sec=300):
+    """
+    各センサー行に時間的に最も近いPVT結果をラベルとして付ける（as-of結合）
+
+    両方を時刻順に並べてからソート済みマージ（pd.merge_asof）で結合するため、
+    計算量は O(行数 + PVT数) で済む。
+
+    Args:
+        features: timestamp列を含むセンサーデータ（時刻順）
+        pvt: pvt_resultsの行（時刻順）
+        tolerance_sec: これより離れたPVTはラベルに使わない（その行は除外）
+        direction: "nearest" / "backward"（直前のPVTのみ）/ "forward"（直後のPVTのみ）
+        decay_tau_sec: ラベルの信頼度 label_weight = exp(-|Δt| / tau)（Noneなら常に1.0）
+
+    Returns:
+        ラベル付きのDataFrame（pvt_time_delta_sec, label_weight, target_* 列を含む）
+    """
+    pvt = pvt.rename(columns=PVT_COLUMNS)
+    features = features.astype({"timestamp": "float64"})
+    pvt = pvt.astype({"pvt_timestamp": "float64"})
+
+    df = pd.merge_asof(
+        features, pvt,
+        left_on="timestamp", right_on="pvt_timestamp",
+        direction=direction, tolerance=float(tolerance_sec)
+    )
+    df = df[df["pvt_rt"].notna()].reset_index(drop=True)
+
+    # ラベルとの時間差と信頼度
+    delta = df["timestamp"] - df["pvt_timestamp"]
+    df["pvt_time_delta_sec"] = delta
+    if decay_tau_sec:
+        df["label_weight"] = np.exp(-np.abs(delta.to_numpy()) / decay_tau_sec)
+    else:
+        df["label_weight"] = 1.0
+    df = df.drop(columns=["pvt_timestamp"])
+
+    # ターゲット
+    df["target_focus_score"] = df["pvt_focus_score"]
+    df["target_state"] = np.select(
+        [df["pvt_focus_score"] > 0.7, df["pvt_focus_score"] >= 0.3],
+        ["Deep Focus", "Open"],
+        default="Overheat"
+    )
+    return df
+
+
+def add_time_features(df, time_encoder):
+    """
+    時刻の特徴量（TIME_FEATURE_COLUMNS）を列として追加する
+
+    セッション経過時間はラベルのない行も含めて判定する必要があるので、
+    ラベル付けの前にセンサーデータ全行に対して呼ぶこと。チャンクを順に処理する場合は
+    同じtime_encoderを渡す（セッションの状態がチャンク間で引き継がれる）。
+    """
+    time_features = time_encoder.encode(df["timestamp"].to_numpy()).set_index(df.index)
+    return pd.concat([df, time_features], axis=1)
+
+
+def encode_chunk(df):
+    """
+    作業カテゴリのOne-Hot Encodingを行い、列をDATASET_COLUMNSの並び・DATASET_DTYPESの型に揃える
+
+    カテゴリは WORK_CATEGORIES 固定のCategoricalとして展開するので、
+    どのチャンクでも同じ列が同じ順・同じ型で出力される。
+    """
+    category = df["work_category"].where(df["work_category"].isin(WORK_CATEGORIES), "other")
+    category = pd.Categorical(category, categories=WORK_CATEGORIES)
+    dummies = pd.get_dummies(category, prefix="work_category").set_index(df.index)
+    df = pd.concat([df.drop(columns=["work_category"]), dummies], axis=1)
+    return df.reindex(columns=DATASET_COLUMNS).astype(DATASET_DTYPES)
+
+
+class DatasetWriter:
+    """
+    データセットをチャンクごとに追記するライター
+
+    拡張子が .parquet ならParquet（pyarrowが必要）、それ以外はCSVで書き出す。
+    メモリに保持するのは書き込み中の1チャンクのみ。
+    """
+
+    def __init__(self, output_path, fmt=None, resume_offset=None):
+        """
+        Args:
+            output_path: 出力パス
+            fmt: "csv" / "parquet"（Noneの場合は拡張子で判定）
+            resume_offset: CSVの続きから書く場合のバイト位置（それ以降は切り捨てる）
+        """
+        self.output_path = output_path
+        self.fmt = fmt or ("parquet" if output_path.endswith(".parquet") else "csv")
+        if self.fmt == "parquet" and not PARQUET_AVAILABLE:
+            raise RuntimeError("Parquet出力にはpyarrowが必要です。pip install pyarrowを実行してください。")
+        self.rows = 0
+        self._parquet = None
+        self._header_written = False
+        if self.fmt == "csv":
+            if resume_offset:
+                with open(output_path, "r+b") as f:
+                    f.truncate(resume_offset)
+                self._header_written = True
+            elif os.path.exists(output_path):
+                os.remove(output_path)
+
+    def tell(self):
+        """CSVの現在のサイズ（次に書き込むバイト位置）"""
+        return os.path.getsize(self.output_path) if os.path.exists(self.output_path) else 0
+
+    def write(self, df):
+        """1チャンク分を追記"""
+        if self.fmt == "parquet":
+            if self._parquet is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self._parquet = pq.ParquetWriter(self.output_path, table.schema)
+            else:
+                table = pa.Table.from_pandas(df, schema=self._parquet.schema,
+                                             preserve_index=False, safe=False)
+            self._parquet.write_table(table)
+        else:
+            df.to_csv(self.output_path, mode="a", header=not self._header_written, index=False)
+            self._header_written = True
+        self.rows += len(df)
+
+    def write_header(self, columns):
+        """1行も書かれなかった場合でも列ヘッダだけは出力する"""
+        if self.fmt == "csv" and not self._header_written:
+            pd.DataFrame(columns=columns).to_csv(self.output_path, index=False)
+            self._header_written = True
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+
+
+class DatasetSummary:
+    """書き出したデータセットの集中度スコア・状態ラベルの分布をチャンクごとに集計"""
+
+    def __init__(self):
+        self.score = RunningStats()
+        self.score_min = None
+        self.score_max = None
+        self.state_counts = {}
+
+    def update(self, df):
+        scores = df["target_focus_score"].dropna().to_numpy(dtype=float)
+        if len(scores) > 0:
+            self.score.add_batch(scores)
+            low, high = float(scores.min()), float(scores.max())
+            self.score_min = low if self.score_min is None else min(self.score_min, low)
+            self.score_max = high if self.score_max is None else max(self.score_max, high)
+        for state, count in df["target_state"].value_counts().items():
+            self.state_counts[state] = self.state_counts.get(state, 0) + int(count)
+
+    def print_summary(self):
+        print("\n【集中度スコアの分布】")
+        print(f"  count: {self.score.n}")
+        print(f"  mean:  {self.score.mean:.6f}")
+        print(f"  std:   {self.score.std:.6f}")
+        print(f"  min:   {self.score_min:.6f}")
+        print(f"  max:   {self.score_max:.6f}")
+        print("\n【状態ラベルの分布】")
+        for state, count in sorted(self.state_counts.items(), key=lambda kv: -kv[1]):
+            print(f"  {state}: {count}")
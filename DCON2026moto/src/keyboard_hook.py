@@ -0,0 +1,105 @@
+"""
+キーボードフックモジュール
+プロセスで1つだけOSのキーボードフック（pynput.keyboard.Listener）を張り、
+キーストローク収集・PVTテストなど複数の購読者にイベントを配る
+
+フックの設置には数十ミリ秒かかり、設置直後のキー入力を取りこぼすことがあるため、
+フックは常に張ったままにして、購読者の側で受け取りを有効・無効に切り替える。
+"""
+
+import threading
+from pynput import keyboard
+
+from pvt_timing import now_ns
+
+
+class KeySubscription:
+    """
+    フックの購読者
+
+    コールバックは (key, input_ns) で呼ばれる。input_ns はフックのコールバックの
+    先頭で取った perf_counter_ns の時刻（すべての購読者で共通）。
+    コールバックはフックのスレッドで呼ばれるので、重い処理はほかのスレッドに渡すこと。
+    """
+
+    def __init__(self, on_press=None, on_release=None, enabled=True):
+        self.on_press = on_press
+        self.on_release = on_release
+        self.enabled = enabled
+
+    def enable(self):
+        """受け取りを有効にする"""
+        self.enabled = True
+
+    def disable(self):
+        """受け取りを無効にする（フックは張ったまま）"""
+        self.enabled = False
+
+
+class KeyboardHook:
+    """共有キーボードフック"""
+
+    def __init__(self):
+        self.listener = None
+        self.lock = threading.Lock()
+        # フックのスレッドはロックを取らずに読むので、変更時は新しいタプルに置き換える
+        self.subscriptions = ()
+
+    def subscribe(self, on_press=None, on_release=None, enabled=True):
+        """
+        購読を追加
+
+        Args:
+            on_press: キー押下時に (key, input_ns) で呼ぶ関数
+            on_release: キー解放時に (key, input_ns) で呼ぶ関数
+            enabled: 最初から受け取るか（Falseの場合は enable() するまで呼ばれない）
+
+        Returns:
+            KeySubscription
+        """
+        subscription = KeySubscription(on_press, on_release, enabled)
+        with self.lock:
+            self.subscriptions = self.subscriptions + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """購読を削除"""
+        with self.lock:
+            self.subscriptions = tuple(s for s in self.subscriptions if s is not subscription)
+
+    def _dispatch(self, key, attr):
+        input_ns = now_ns()
+        for subscription in self.subscriptions:
+            if not subscription.enabled:
+                continue
+            callback = getattr(subscription, attr)
+            if callback is None:
+                continue
+            try:
+                callback(key, input_ns)
+            except Exception as e:
+                # 1つの購読者の例外でフック（ほかの購読者）を止めない
+                print(f"⚠ キーボードフック処理エラー: {e}")
+
+    def _on_press(self, key):
+        self._dispatch(key, "on_press")
+
+    def _on_release(self, key):
+        self._dispatch(key, "on_release")
+
+    def start(self):
+        """フックを設置（設置済みなら何もしない）"""
+        with self.lock:
+            if self.listener is None:
+                self.listener = keyboard.Listener(
+                    on_press=self._on_press,
+                    on_release=self._on_release
+                )
+                self.listener.start()
+
+    def stop(self):
+        """フックを外す"""
+        with self.lock:
+            listener, self.listener = self.listener, None
+        if listener:
+            listener.stop()
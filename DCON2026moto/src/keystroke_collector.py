@@ -4,37 +4,214 @@
 """
 
 from pynput import keyboard
+import math
+import threading
 import time
 import numpy as np
-from collections import deque
+from streaming_stats import RunningStats, MonotonicMinMax
+from keyboard_hook import KeyboardHook
+from event_bus import KeyEvent
+
+
+# イベント種別フラグ（キーの内容は保持しない）
+FLAG_PRESS = 0x01
+FLAG_RELEASE = 0x02
+FLAG_BACKSPACE = 0x04
+FLAG_MODIFIER = 0x08
+
+BACKSPACE_KEYS = (keyboard.Key.backspace, keyboard.Key.delete)
+MODIFIER_KEYS = (keyboard.Key.ctrl, keyboard.Key.shift,
+                 keyboard.Key.alt, keyboard.Key.cmd,
+                 keyboard.Key.ctrl_l, keyboard.Key.ctrl_r,
+                 keyboard.Key.shift_l, keyboard.Key.shift_r)
+
+
+class KeyEventRing:
+    """
+    キーイベントの配列ベース・リングバッファ
+
+    容量はイベント数ではなく保持したい時間幅から決める。
+    想定以上の連打で満杯になった場合は、古いデータを捨てずに容量を倍に拡張する。
+    """
+
+    def __init__(self, horizon_sec=60, max_events_per_sec=40):
+        capacity = max(64, int(horizon_sec * max_events_per_sec))
+        self.horizon_sec = horizon_sec
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.intervals = np.full(capacity, np.nan, dtype=np.float64)
+        self.durations = np.full(capacity, np.nan, dtype=np.float64)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.head = 0  # 次に書き込むシーケンス番号
+        self.tail = 0  # 保持している最古のシーケンス番号
+
+    @property
+    def capacity(self):
+        return len(self.timestamps)
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def append(self, timestamp, interval_ms, duration_ms, flags):
+        """イベントを追加してシーケンス番号を返す"""
+        if self.head - self.tail >= self.capacity:
+            self._grow()
+        i = self.head % self.capacity
+        self.timestamps[i] = timestamp
+        self.intervals[i] = interval_ms
+        self.durations[i] = duration_ms
+        self.flags[i] = flags
+        seq = self.head
+        self.head += 1
+        return seq
+
+    def get(self, seq):
+        """シーケンス番号のイベントを (timestamp, interval, duration, flags) で返す"""
+        i = seq % self.capacity
+        return (float(self.timestamps[i]), float(self.intervals[i]),
+                float(self.durations[i]), int(self.flags[i]))
+
+    def _grow(self):
+        """容量を倍に拡張（有効なイベントはシーケンス番号を保ったまま移す）"""
+        old_cap = self.capacity
+        new_cap = old_cap * 2
+        seqs = np.arange(self.tail, self.head)
+        old_idx = seqs % old_cap
+        new_idx = seqs % new_cap
+        for name in ("timestamps", "intervals", "durations", "flags"):
+            old = getattr(self, name)
+            new = np.empty(new_cap, dtype=old.dtype)
+            new[new_idx] = old[old_idx]
+            setattr(self, name, new)
+
+
+class KeystrokeWindow:
+    """リングバッファ上のスライディングウィンドウ統計（イベントごとにO(1)更新）"""
+
+    def __init__(self, ring, window_sec):
+        self.ring = ring
+        self.window_sec = window_sec
+        self.cursor = ring.head  # ウィンドウ内の最古のシーケンス番号
+        self.press_count = 0
+        self.mistype_count = 0
+        self.intervals = RunningStats()
+        self.interval_range = MonotonicMinMax()
+        self.durations = RunningStats()
+
+    def add(self, seq, interval_ms, duration_ms, flags):
+        """新しいイベントをウィンドウに加える"""
+        if flags & FLAG_PRESS:
+            self.press_count += 1
+            if flags & FLAG_BACKSPACE:
+                self.mistype_count += 1
+            if not math.isnan(interval_ms):
+                self.intervals.add(interval_ms)
+                self.interval_range.add(seq, interval_ms)
+        elif not math.isnan(duration_ms):
+            self.durations.add(duration_ms)
+
+    def expire(self, now):
+        """ウィンドウ外に出た古いイベントを取り除く"""
+        limit = now - self.window_sec
+        ring = self.ring
+        while self.cursor < ring.head:
+            timestamp, interval_ms, duration_ms, flags = ring.get(self.cursor)
+            if timestamp >= limit:
+                break
+            if flags & FLAG_PRESS:
+                self.press_count -= 1
+                if flags & FLAG_BACKSPACE:
+                    self.mistype_count -= 1
+                if not math.isnan(interval_ms):
+                    self.intervals.remove(interval_ms)
+            elif not math.isnan(duration_ms):
+                self.durations.remove(duration_ms)
+            self.cursor += 1
+        self.interval_range.evict(self.cursor - 1)
+
+    def stats(self, now):
+        """ウィンドウ統計を辞書で返す"""
+        has_intervals = self.intervals.n > 0
+        # 打鍵速度は1分あたりに換算（60秒ウィンドウでは打鍵数そのもの）
+        kpm = self.press_count * 60 / self.window_sec
+        return {
+            "typing_speed_kpm": int(kpm) if kpm.is_integer() else kpm,
+            "avg_key_interval_ms": self.intervals.mean if has_intervals else 0,
+            "std_key_interval_ms": self.intervals.std if has_intervals else 0,
+            "max_key_interval_ms": self.interval_range.max if has_intervals else 0,
+            "min_key_interval_ms": self.interval_range.min if has_intervals else 0,
+            "mistype_frequency": self.mistype_count,
+            "avg_key_press_duration_ms": self.durations.mean if self.durations.n > 0 else 0,
+            "timestamp": now
+        }
+
+    def counts(self, now):
+        """ウィンドウ長と打鍵数（stats() の打鍵速度は1分あたりに換算済み）"""
+        return {
+            "window_sec": self.window_sec,
+            "key_count": self.press_count,
+            "timestamp": now
+        }
+
+
+# 同時に維持するウィンドウ長（秒）: 要件定義書の5秒・1分・LSTM入力の10分
+DEFAULT_WINDOWS = (5, 60, 600)
 
 
 class KeystrokeCollector:
     """キーストローク・ダイナミクスを収集"""
 
-    def __init__(self):
+    def __init__(self, window_secs=DEFAULT_WINDOWS, max_events_per_sec=40, hook=None, bus=None):
+        """
+        Args:
+            window_secs: 同時に統計を維持する時間幅（秒）のリスト
+            max_events_per_sec: 想定する最大イベント頻度（バッファ容量の見積もり用）
+            hook: 共有するKeyboardHook（Noneの場合は自前で作成し、PVTテストなどにも
+                  self.hook として共有する）
+            bus: キーイベント（KeyEvent）を発行するEventBus
+        """
         self.last_key_time = None
         self.last_key_press_time = {}
-        self.key_events = deque(maxlen=1000)  # 最新1000イベントを保持
-        self.listener = None
+        # リングバッファは最長ウィンドウ分だけ保持し、全ウィンドウで共有する
+        self.key_events = KeyEventRing(horizon_sec=max(window_secs),
+                                       max_events_per_sec=max_events_per_sec)
+        self.windows = {sec: KeystrokeWindow(self.key_events, sec)
+                        for sec in sorted(window_secs)}
+        self.lock = threading.Lock()
+        self.owns_hook = hook is None
+        self.hook = hook if hook is not None else KeyboardHook()
+        self.subscription = None
+        self.bus = bus
+
+    def _expire(self, now):
+        """全ウィンドウの期限切れイベントを取り除き、バッファの末尾を進める"""
+        for window in self.windows.values():
+            window.expire(now)
+        self.key_events.tail = min(w.cursor for w in self.windows.values())
+
+    def _append_event(self, timestamp, interval_ms, duration_ms, flags):
+        """リングバッファと全ウィンドウ統計を同時に更新"""
+        with self.lock:
+            seq = self.key_events.append(timestamp, interval_ms, duration_ms, flags)
+            for window in self.windows.values():
+                window.add(seq, interval_ms, duration_ms, flags)
+            self._expire(timestamp)
+        if self.bus is not None:
+            self.bus.publish(KeyEvent(timestamp, flags, interval_ms, duration_ms))
 
-    def on_press(self, key):
-        """キー押下イベント"""
+    def on_press(self, key, input_ns=None):
+        """キー押下イベント（input_nsはフックで取った時刻。ここでは使わない）"""
         current_time = time.time()
 
-        key_data = {
-            "timestamp": current_time,
-            "event_type": "press",
-            "is_backspace": key in [keyboard.Key.backspace, keyboard.Key.delete],
-            "is_modifier": key in [keyboard.Key.ctrl, keyboard.Key.shift,
-                                  keyboard.Key.alt, keyboard.Key.cmd,
-                                  keyboard.Key.ctrl_l, keyboard.Key.ctrl_r,
-                                  keyboard.Key.shift_l, keyboard.Key.shift_r]
-        }
+        flags = FLAG_PRESS
+        if key in BACKSPACE_KEYS:
+            flags |= FLAG_BACKSPACE
+        if key in MODIFIER_KEYS:
+            flags |= FLAG_MODIFIER
 
         # 打鍵間隔の計算
+        interval_ms = math.nan
         if self.last_key_time is not None:
-            key_data["key_interval_ms"] = (current_time - self.last_key_time) * 1000
+            interval_ms = (current_time - self.last_key_time) * 1000
 
         # キー押下開始時刻を記録
         try:
@@ -43,10 +220,10 @@ class KeystrokeCollector:
         except:
             pass
 
-        self.key_events.append(key_data)
+        self._append_event(current_time, interval_ms, math.nan, flags)
         self.last_key_time = current_time
 
-    def on_release(self, key):
+    def on_release(self, key, input_ns=None):
         """キー解放イベント"""
         current_time = time.time()
 
@@ -57,12 +234,7 @@ class KeystrokeCollector:
                 press_duration = (current_time - self.last_key_press_time[key_id]) * 1000
 
                 # 押下時間を記録
-                key_data = {
-                    "timestamp": current_time,
-                    "event_type": "release",
-                    "key_press_duration_ms": press_duration
-                }
-                self.key_events.append(key_data)
+                self._append_event(current_time, math.nan, press_duration, FLAG_RELEASE)
 
                 # クリーンアップ
                 del self.last_key_press_time[key_id]
@@ -71,60 +243,61 @@ class KeystrokeCollector:
 
     def start(self):
         """キーストローク収集を開始"""
-        if self.listener is None:
-            self.listener = keyboard.Listener(
-                on_press=self.on_press,
-                on_release=self.on_release
-            )
-            self.listener.start()
+        if self.subscription is None:
+            self.subscription = self.hook.subscribe(on_press=self.on_press,
+                                                    on_release=self.on_release)
+            self.hook.start()
             print("✓ キーストローク収集を開始しました")
 
     def stop(self):
         """キーストローク収集を停止"""
-        if self.listener:
-            self.listener.stop()
-            self.listener = None
+        if self.subscription:
+            self.hook.unsubscribe(self.subscription)
+            self.subscription = None
+            # 共有しているフックは持ち主が外す
+            if self.owns_hook:
+                self.hook.stop()
             print("キーストローク収集を停止しました")
 
+    def calculate_window_stats(self, window_sec):
+        """指定した時間幅のキーストローク統計を計算（逐次集計済みの値を参照するだけ）"""
+        current_time = time.time()
+        with self.lock:
+            self._expire(current_time)
+            return self.windows[window_sec].stats(current_time)
+
+    def calculate_multi_window_stats(self):
+        """全ウィンドウの統計を {秒数: 統計} の辞書でまとめて返す"""
+        current_time = time.time()
+        with self.lock:
+            self._expire(current_time)
+            return {sec: window.stats(current_time)
+                    for sec, window in self.windows.items()}
+
+    def get_window_counts(self, window_sec):
+        """指定した時間幅の打鍵数（換算前）をウィンドウ長とともに返す"""
+        current_time = time.time()
+        with self.lock:
+            self._expire(current_time)
+            return self.windows[window_sec].counts(current_time)
+
     def calculate_1min_stats(self):
         """1分間のキーストローク統計を計算"""
-        current_time = time.time()
-        recent_events = [e for e in self.key_events
-                        if current_time - e["timestamp"] <= 60]
-
-        if len(recent_events) == 0:
-            return {
-                "typing_speed_kpm": 0,
-                "avg_key_interval_ms": 0,
-                "std_key_interval_ms": 0,
-                "max_key_interval_ms": 0,
-                "min_key_interval_ms": 0,
-                "mistype_frequency": 0,
-                "avg_key_press_duration_ms": 0,
-                "timestamp": current_time
-            }
-
-        # 打鍵間隔の統計
-        intervals = [e["key_interval_ms"] for e in recent_events
-                    if "key_interval_ms" in e]
-
-        # 押下時間の統計
-        press_durations = [e["key_press_duration_ms"] for e in recent_events
-                          if "key_press_duration_ms" in e]
-
-        # ミスタッチ頻度
-        mistype_count = sum(1 for e in recent_events
-                           if e.get("is_backspace", False))
+        return self.calculate_window_stats(60)
 
+    def get_5s_features(self):
+        """要件定義書の5秒単位の特徴量（Δt_key, σ_key, f_miss, D_key）"""
+        current_time = time.time()
+        with self.lock:
+            self._expire(current_time)
+            stats = self.windows[5].stats(current_time)
+            counts = self.windows[5].counts(current_time)
         return {
-            "typing_speed_kpm": len([e for e in recent_events if e["event_type"] == "press"]),
-            "avg_key_interval_ms": np.mean(intervals) if intervals else 0,
-            "std_key_interval_ms": np.std(intervals) if intervals else 0,
-            "max_key_interval_ms": max(intervals) if intervals else 0,
-            "min_key_interval_ms": min(intervals) if intervals else 0,
-            "mistype_frequency": mistype_count,
-            "avg_key_press_duration_ms": np.mean(press_durations) if press_durations else 0,
-            "timestamp": current_time
+            "delta_t_key_avg": stats["avg_key_interval_ms"],
+            "sigma_key": stats["std_key_interval_ms"],
+            "f_miss": stats["mistype_frequency"],
+            "d_key": counts["key_count"],
+            "timestamp": stats["timestamp"]
         }
 
 
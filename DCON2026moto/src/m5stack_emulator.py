@@ -0,0 +1,127 @@
+"""
+M5Stackエミュレータ（テスト用）
+疑似端末(pty)上でENV III Unitの送信を模擬し、実機なしでEnvironmentCollectorを動かす
+
+使い方:
+    python m5stack_emulator.py            # 表示されたポートを --m5stack に指定
+    python m5stack_emulator.py --json     # バイナリ形式に対応しない旧ファームウェアを模擬
+"""
+
+import os
+import pty
+import random
+import select
+import threading
+import time
+import tty
+import json
+from sensor_protocol import encode_frame, MODE_REQUEST, MODE_ACK
+
+
+class M5StackEmulator:
+    """ptyの反対側でM5Stackとして振る舞う"""
+
+    def __init__(self, interval_sec=0.1, supports_binary=True, with_noise=False):
+        """
+        Args:
+            interval_sec: サンプルの送信間隔（秒）
+            supports_binary: バイナリ形式の要求に応答するか
+            with_noise: 騒音レベルチャンネルも送信するか（バイナリ形式のみ）
+        """
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        self.interval_sec = interval_sec
+        self.supports_binary = supports_binary
+        self.with_noise = with_noise
+        self.mode = "json"
+        self.seq = 0
+        self.sent = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def make_sample(self):
+        """それらしいセンサー値を作る"""
+        return (24.0 + random.uniform(-0.5, 0.5),
+                50.0 + random.uniform(-2, 2),
+                1013.0 + random.uniform(-1, 1))
+
+    def encode_sample(self):
+        """現在の通信形式で1サンプル分のバイト列を作る"""
+        temperature, humidity, pressure = self.make_sample()
+        if self.mode == "binary":
+            noise = 40.0 + random.uniform(-5, 5) if self.with_noise else float("nan")
+            data = encode_frame(self.seq, temperature, humidity, pressure, noise)
+        else:
+            data = (json.dumps({"temp": temperature, "humidity": humidity,
+                                "pressure": pressure}) + "\n").encode()
+        self.seq += 1
+        return data
+
+    def inject(self, data):
+        """任意のバイト列を送信（不完全な行・ノイズの試験用）"""
+        os.write(self.master_fd, data)
+
+    def _handle_command(self, data):
+        """ホストからのコマンドを処理"""
+        if MODE_REQUEST in data and self.supports_binary:
+            os.write(self.master_fd, MODE_ACK + b"\n")
+            self.mode = "binary"
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self.stop_event.is_set():
+            timeout = max(0.0, next_time - time.monotonic())
+            readable, _, _ = select.select([self.master_fd], [], [], timeout)
+            if readable:
+                try:
+                    self._handle_command(os.read(self.master_fd, 1024))
+                except OSError:
+                    break
+                continue
+            try:
+                os.write(self.master_fd, self.encode_sample())
+            except OSError:
+                break
+            self.sent += 1
+            next_time += self.interval_sec
+
+    def start(self):
+        """送信を開始"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self.port
+
+    def stop(self):
+        """送信を停止してptyを閉じる"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+        for fd in (self.master_fd, self.slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+# テスト実行
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="M5Stackエミュレータ")
+    parser.add_argument("--json", action="store_true", help="JSON形式のみ対応（旧ファームウェア）")
+    parser.add_argument("--interval", type=float, default=1.0, help="送信間隔（秒）")
+    args = parser.parse_args()
+
+    emulator = M5StackEmulator(interval_sec=args.interval, supports_binary=not args.json)
+    port = emulator.start()
+    print(f"✓ M5Stackエミュレータ起動: {port}")
+    print(f"  python main.py --m5stack {port}")
+    print("（Ctrl+Cで終了）")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
@@ -5,23 +5,47 @@ Zone Key - データ収集プログラム
 
 import time
 import random
-import threading
 import tkinter as tk
-from datetime import datetime
+from datetime import datetime, timedelta
 from data_aggregator import DataAggregator
 from data_storage import DataStorage
+from event_bus import EventBus, RawEventLogger
 from pvt_test import PVTTest
+from retention import RETENTION_PRESETS, CompactionJob
+from scheduler import DeadlineScheduler
+from sequence_store import SequenceStore
+from tk_dispatch import TkDispatcher
+
+
+# 日別アーカイブを実行する時刻（0時の何秒後か。日付が変わった直後の書き込みを避ける）
+ARCHIVE_AFTER_MIDNIGHT_SEC = 5 * 60
+
+
+def seconds_until_midnight(now=None):
+    """次のローカル時刻0時までの秒数"""
+    now = now or datetime.now()
+    midnight = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    return (midnight - now).total_seconds()
 
 
 class ZoneKeyDataCollector:
     """Zone Key データ収集メインシステム"""
 
-    def __init__(self, m5stack_port=None):
+    def __init__(self, m5stack_port=None, mouse_batch_mode=False, category_rules_path=None,
+                 archive_dir=None, sequence_dir=None, user_id="default", retention=None,
+                 raw_log_path=None):
         """
         データ収集システムの初期化
 
         Args:
             m5stack_port: M5Stackのシリアルポート（Noneの場合はモックデータ）
+            mouse_batch_mode: マウス移動をバッチ集計する（高ポーリングレートのマウス向け）
+            category_rules_path: 追加の作業カテゴリルール(JSON)のパス
+            archive_dir: 終わった日のデータを移す日別アーカイブの保存先（Noneの場合はアーカイブしない）
+            sequence_dir: 1秒ごとの特徴量フレームを保存するディレクトリ（Noneの場合は保存しない）
+            user_id: 特徴量フレームを保存するユーザーID
+            retention: データ保持期間 "30d" / "90d" / "1y"（Noneの場合はすべて保持）
+            raw_log_path: 生イベントをJSON Linesで記録するファイル（Noneの場合は記録しない）
         """
         print("\n" + "=" * 60)
         print("          Zone Key データ収集システム v2.0")
@@ -30,55 +54,87 @@ class ZoneKeyDataCollector:
         # メインのTkインスタンスを作成（非表示）
         self.root = tk.Tk()
         self.root.withdraw()  # メインウィンドウは非表示
+        # 収集スレッドからメインスレッド（GUI）への処理の受け渡し
+        self.dispatcher = TkDispatcher(self.root)
         
-        # モジュールの初期化
-        self.aggregator = DataAggregator(m5stack_port=m5stack_port)
-        self.storage = DataStorage()
-        self.pvt = PVTTest(root=self.root)
-        self.running = False
-
-        # 次のPVTテスト実行時刻（5分後）
-        first_test_delay = 5 * 60  # 5分
-        self.next_pvt_time = time.time() + first_test_delay
-
-        # PVTテスト実行フラグ（メインスレッドで実行するため）
-        self.should_run_pvt = False
-
-        print(f"📅 初回PVTテスト予定: {time.strftime('%H:%M:%S', time.localtime(self.next_pvt_time))}")
-        print(f"   （{first_test_delay/60:.1f}分後）\n")
-
-    def collect_loop(self):
-        """1分ごとにデータ収集"""
-        print("📊 データ収集ループを開始します...\n")
-
-        while self.running:
-            try:
-                # 通常のデータ収集
-                data = self.aggregator.collect_1min_data()
-                success = self.storage.save_data(data)
+        # 周期処理（1秒サンプリング・1分収集・PVT・データ保持）はすべて
+        # time.monotonic() の期限で動くスケジューラに登録する
+        self.scheduler = DeadlineScheduler()
+        self.scheduler.start()
 
-                if success:
-                    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    print(f"✓ [{current_time}] データ保存完了")
-                else:
-                    print(f"⚠ データ保存に失敗しました")
-
-                # PVTテストの実行判定
-                current_time_sec = time.time()
-                if current_time_sec >= self.next_pvt_time:
-                    # メインスレッドで実行するためにフラグを立てる
-                    self.should_run_pvt = True
+        # 収集モジュール・PVTの生イベントを購読者（記録・推論など）に配るバス
+        self.bus = EventBus()
+        self.raw_logger = RawEventLogger(self.bus, raw_log_path) if raw_log_path else None
 
-                    # 次のテスト時刻を設定（5分後）
-                    next_delay = 5 * 60  # 5分
-                    self.next_pvt_time = time.time() + next_delay
-                    next_test_time = time.strftime('%H:%M:%S', time.localtime(self.next_pvt_time))
-                    print(f"\n📅 次回PVTテスト予定: {next_test_time} ({next_delay/60:.1f}分後)\n")
+        # モジュールの初期化
+        sequence_sink = None
+        if sequence_dir:
+            sequence_sink = SequenceStore(sequence_dir).open_writer(user_id)
+            print(f"✓ 特徴量フレームの保存先: {sequence_sink.path}")
+        self.aggregator = DataAggregator(m5stack_port=m5stack_port,
+                                         mouse_batch_mode=mouse_batch_mode,
+                                         category_rules_path=category_rules_path,
+                                         sequence_sink=sequence_sink,
+                                         scheduler=self.scheduler,
+                                         bus=self.bus)
+        self.storage = DataStorage(archive_dir=archive_dir)
+        # 前日までのデータはアーカイブに移してデータベースを小さく保つ（起動時と毎日0時過ぎ）
+        self.storage.archive_closed_days()
+        if archive_dir:
+            self.scheduler.add("archive", 24 * 3600, self.archive_closed_days,
+                               first_delay_sec=seconds_until_midnight() + ARCHIVE_AFTER_MIDNIGHT_SEC,
+                               run_in_thread=True)
+        # 保持期間を過ぎたデータの削除とインクリメンタルVACUUM（1時間ごと）
+        self.compaction = None
+        if retention:
+            self.compaction = CompactionJob(self.storage, RETENTION_PRESETS[retention])
+            self.compaction.start(scheduler=self.scheduler)
+        # PVTの実行間隔はスケジューラが管理する
+        # キー入力はキーストローク収集と同じフックから受け取る（フックはプロセスで1つ）
+        self.pvt = PVTTest(root=self.root, storage=self.storage, external_schedule=True,
+                           dispatcher=self.dispatcher,
+                           keyboard_hook=self.aggregator.keystroke_collector.hook,
+                           bus=self.bus)
+        self.running = False
 
-            except Exception as e:
-                print(f"⚠ エラー: {e}")
+        # PVTテストの間隔（5分、毎回同じ時刻にならないよう±30秒ずらす）
+        self.pvt_interval_sec = 5 * 60
+        self.pvt_jitter_sec = 30
 
-            time.sleep(60)  # 1分待機
+    def collect_data(self):
+        """1分ごとのデータ収集（スケジューラのスレッドで実行）"""
+        try:
+            data = self.aggregator.collect_1min_data()
+            success = self.storage.save_data(data)
+
+            if success:
+                current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                print(f"✓ [{current_time}] データ保存完了")
+            else:
+                print(f"⚠ データ保存に失敗しました")
+        except Exception as e:
+            print(f"⚠ エラー: {e}")
+
+    def archive_closed_days(self):
+        """終わった日のデータをアーカイブに移す（スケジューラの別スレッドで実行）"""
+        try:
+            self.storage.archive_closed_days()
+        finally:
+            # 実行ごとに新しいスレッドなので読み取り接続を残さない
+            self.storage.release_read_connection()
+
+    def request_pvt_test(self):
+        """PVTテストを実行して次回の予定を表示（メインスレッドで実行）"""
+        self.run_pvt_test()
+        self.print_next_pvt_time("次回")
+
+    def print_next_pvt_time(self, label):
+        """次のPVTテストの予定時刻を表示"""
+        delay = self.scheduler.next_run_in("pvt")
+        if delay is None:
+            return
+        next_test_time = time.strftime('%H:%M:%S', time.localtime(time.time() + delay))
+        print(f"\n📅 {label}PVTテスト予定: {next_test_time} ({delay/60:.1f}分後)\n")
 
     def run_pvt_test(self):
         """PVTテストを実行"""
@@ -121,6 +177,9 @@ class ZoneKeyDataCollector:
 
                 print(f"✓ 全体的な覚醒度: {level}")
 
+        # 周期処理の遅延・欠落、イベントの破棄
+        self.scheduler.print_stats()
+        self.bus.print_stats()
         print("\n" + "=" * 60 + "\n")
 
     def start(self):
@@ -134,37 +193,30 @@ class ZoneKeyDataCollector:
         print("  - PVTテスト実行中は作業を中断し、テストに集中してください")
         print("  - テストは5分ごとに実行されます")
         print("  - ESCキーでテストをスキップできます")
-        print(f"\n📅 次回PVTテスト: {time.strftime('%H:%M:%S', time.localtime(self.next_pvt_time))}")
         print("\n" + "=" * 60 + "\n")
 
-        # バックグラウンドスレッドで収集ループを実行
-        thread = threading.Thread(target=self.collect_loop, daemon=True)
-        thread.start()
-
-        try:
-            # メインスレッドでPVTテストを実行（GUIはメインスレッドでのみ動作）
-            while True:
-                if self.should_run_pvt:
-                    self.should_run_pvt = False
-                    self.run_pvt_test()
-                
-                # Tkinterのイベントを処理（重要！）
-                try:
-                    self.root.update()
-                except:
-                    pass
-                
-                time.sleep(0.01)  # 10msごとにチェック
-
-        except KeyboardInterrupt:
-            print("\n\n" + "=" * 60)
-            print("データ収集を停止します...")
-            print("=" * 60)
-            self.stop()
+        # 1分ごとのデータ収集と5分ごとのPVTテストをスケジューラに登録
+        print("📊 データ収集ループを開始します...\n")
+        self.scheduler.add("collection", 60, self.collect_data, run_in_thread=True)
+        # GUIはメインスレッドでのみ動作するので、dispatcher経由でメインスレッドに渡す
+        self.scheduler.add("pvt", self.pvt_interval_sec, self.request_pvt_test,
+                           jitter_sec=self.pvt_jitter_sec, dispatch=self.dispatcher.post)
+        self.print_next_pvt_time("初回")
+
+        # メインスレッドはTkのmainloopが占有し、イベントがあるときだけ起きる
+        # （PVTテストはスケジューラからdispatcher経由で実行される）
+        self.dispatcher.run()
+
+        print("\n\n" + "=" * 60)
+        print("データ収集を停止します...")
+        print("=" * 60)
+        self.stop()
 
     def stop(self):
         """データ収集停止"""
         self.running = False
+        # 新しい周期処理を止めてから後片付けする
+        self.scheduler.stop()
 
         print("\nAI学習用データセットを生成しています...")
         self.storage.export_pvt_dataset()
@@ -174,8 +226,13 @@ class ZoneKeyDataCollector:
 
         # クリーンアップ
         self.aggregator.stop()
+        if self.raw_logger is not None:
+            self.raw_logger.close()
+        self.bus.close()
+        if self.compaction is not None:
+            self.compaction.stop()
+        self.pvt.close()
         self.storage.close()
-        self.pvt.close_db()
         
         # Tkinterのクリーンアップ
         try:
@@ -201,6 +258,47 @@ def main():
         default=None,
         help="M5Stackのシリアルポート (例: /dev/tty.usbserial-xxxxx, COM3)"
     )
+    parser.add_argument(
+        "--mouse-batch",
+        action="store_true",
+        help="マウス移動イベントをバッチ集計する（1000Hzのゲーミングマウスなど向け）"
+    )
+    parser.add_argument(
+        "--category-rules",
+        type=str,
+        default=None,
+        help="追加の作業カテゴリルール(JSON: {\"カテゴリ\": [\"キーワード\", ...]})"
+    )
+    parser.add_argument(
+        "--archive-dir",
+        type=str,
+        default=None,
+        help="前日までのデータを日別ファイル(Parquet/npz)に移すディレクトリ（例: archive）"
+    )
+    parser.add_argument(
+        "--sequence-dir",
+        type=str,
+        default=None,
+        help="1秒ごとの特徴量フレーム(LSTM学習用)を保存するディレクトリ（例: sequences）"
+    )
+    parser.add_argument(
+        "--user-id",
+        type=str,
+        default="default",
+        help="特徴量フレームを保存するユーザーID"
+    )
+    parser.add_argument(
+        "--retention",
+        choices=sorted(RETENTION_PRESETS),
+        default=None,
+        help="データ保持期間（古い生データはロールアップのみ残し、期間を過ぎたデータは削除）"
+    )
+    parser.add_argument(
+        "--raw-log",
+        type=str,
+        default=None,
+        help="キー・マウス・ウィンドウ・環境・PVTの生イベントをJSON Linesで記録するファイル（キーの内容は含まない）"
+    )
     parser.add_argument(
         "--test-pvt",
         action="store_true",
@@ -215,12 +313,19 @@ def main():
         print("PVTテスト単体実行モード")
         print("=" * 60 + "\n")
         pvt = PVTTest()
-        pvt.show_test()
-        pvt.close_db()
+        pvt.run_once()
+        pvt.close()
         return
 
     # 通常のデータ収集モード
-    collector = ZoneKeyDataCollector(m5stack_port=args.m5stack)
+    collector = ZoneKeyDataCollector(m5stack_port=args.m5stack,
+                                     mouse_batch_mode=args.mouse_batch,
+                                     category_rules_path=args.category_rules,
+                                     archive_dir=args.archive_dir,
+                                     sequence_dir=args.sequence_dir,
+                                     user_id=args.user_id,
+                                     retention=args.retention,
+                                     raw_log_path=args.raw_log)
     collector.start()
 
 
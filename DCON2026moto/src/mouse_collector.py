@@ -4,24 +4,246 @@
 """
 
 from pynput import mouse
+import threading
 import time
 import math
+from collections import deque
+import numpy as np
+from streaming_stats import RunningStats
+from event_bus import ClickEvent, MoveEvent
+
+
+class KinematicsWindow:
+    """1つの時間解像度（タンブリングウィンドウ）分の運動学集計"""
+
+    def __init__(self, resolution_sec, start_time):
+        self.resolution_sec = resolution_sec
+        self.reset(start_time)
+
+    def reset(self, start_time):
+        """集計をリセットして新しいウィンドウを開始"""
+        self.start_time = start_time
+        self.distance = 0.0
+        self.speed = RunningStats()
+        self.speed_max = 0.0
+        self.accel = RunningStats()
+        self.idle_sec = 0.0
+
+
+class MouseKinematics:
+    """
+    ストリーミング運動学エンジン（メモリ使用量は一定）
+
+    - 速度: 連続する移動イベント間の区間ごとの速度 (px/秒)
+    - 加速度: 隣接する区間の速度変化の大きさ (px/秒^2)
+    - 静止時間: 最後の移動から still_threshold_sec を超えて動かなかった時間
+      （しきい値の1秒は静止に含めない。ウィンドウ境界で分割されるため二重計上しない）
+
+    移動の判定は累積移動距離が move_threshold_px を超えるごととする
+    （ポーリングレートが高く1イベントの移動量が小さいマウスでも同じ判定になる）。
+    """
+
+    def __init__(self, resolutions=(1, 60), move_threshold_px=5,
+                 still_threshold_sec=1.0, start_time=None):
+        """
+        Args:
+            resolutions: 同時に集計する時間解像度（秒）のリスト
+            move_threshold_px: 移動とみなす累積移動距離
+            still_threshold_sec: これを超えて移動がなければ静止とみなす
+            start_time: 集計開始時刻（Noneの場合は現在時刻）
+        """
+        now = time.time() if start_time is None else start_time
+        self.move_threshold_px = move_threshold_px
+        self.still_threshold_sec = still_threshold_sec
+        self.windows = {res: KinematicsWindow(res, now) for res in resolutions}
+        self.lock = threading.Lock()
+
+        self.last_t = None
+        self.last_x = 0.0
+        self.last_y = 0.0
+        self.prev_speed = None   # 直前区間の速度（静止を挟んだらNone）
+        self.prev_dt = None
+        self.path_since_move = 0.0
+        self.last_move_time = now
+
+    def update(self, t, x, y):
+        """移動イベントを1件追加"""
+        with self.lock:
+            if self.last_t is None:
+                self.last_t, self.last_x, self.last_y = t, x, y
+                return
+            dt = t - self.last_t
+            d = math.hypot(x - self.last_x, y - self.last_y)
+            self.last_t, self.last_x, self.last_y = t, x, y
+
+            for w in self.windows.values():
+                w.distance += d
+
+            if dt > self.still_threshold_sec:
+                # 静止を挟んだ区間は速度に含めない
+                self.prev_speed = None
+            elif dt > 0:
+                v = d / dt
+                a = None
+                if self.prev_speed is not None:
+                    a = abs(v - self.prev_speed) / ((dt + self.prev_dt) / 2)
+                for w in self.windows.values():
+                    w.speed.add(v)
+                    if v > w.speed_max:
+                        w.speed_max = v
+                    if a is not None:
+                        w.accel.add(a)
+                self.prev_speed, self.prev_dt = v, dt
+
+            # 静止時間の判定
+            self.path_since_move += d
+            if self.path_since_move >= self.move_threshold_px:
+                self.path_since_move %= self.move_threshold_px
+                idle_from = self.last_move_time + self.still_threshold_sec
+                for w in self.windows.values():
+                    start = max(idle_from, w.start_time)
+                    if t > start:
+                        w.idle_sec += t - start
+                self.last_move_time = t
+
+    def update_batch(self, t, x, y):
+        """移動イベントの配列をまとめて追加（updateを順に呼んだのと同じ結果）"""
+        with self.lock:
+            if self.last_t is None:
+                if len(t) == 0:
+                    return
+                self.last_t, self.last_x, self.last_y = float(t[0]), float(x[0]), float(y[0])
+                t, x, y = t[1:], x[1:], y[1:]
+            if len(t) == 0:
+                return
+
+            dt = np.diff(np.concatenate(([self.last_t], t)))
+            d = np.hypot(np.diff(np.concatenate(([self.last_x], x))),
+                         np.diff(np.concatenate(([self.last_y], y))))
+            self.last_t, self.last_x, self.last_y = float(t[-1]), float(x[-1]), float(y[-1])
+
+            total = float(d.sum())
+            for w in self.windows.values():
+                w.distance += total
+
+            # 速度: 経過時間が0以下の区間は除外し、静止を挟んだ区間は連続性を切る
+            positive = dt > 0
+            seg_dt = dt[positive]
+            seg_v = d[positive] / seg_dt
+            active = seg_dt <= self.still_threshold_sec
+            speeds = seg_v[active]
+
+            # 加速度: 前回バッチの最終区間から繋げ、連続する有効区間のペアで計算
+            if self.prev_speed is not None:
+                chain_v = np.concatenate(([self.prev_speed], seg_v))
+                chain_dt = np.concatenate(([self.prev_dt], seg_dt))
+                chain_active = np.concatenate(([True], active))
+            else:
+                chain_v, chain_dt, chain_active = seg_v, seg_dt, active
+            pairs = chain_active[1:] & chain_active[:-1]
+            accels = (np.abs(np.diff(chain_v)) / ((chain_dt[1:] + chain_dt[:-1]) / 2))[pairs]
+
+            for w in self.windows.values():
+                w.speed.add_batch(speeds)
+                if speeds.size:
+                    w.speed_max = max(w.speed_max, float(speeds.max()))
+                w.accel.add_batch(accels)
+
+            if seg_dt.size:
+                if active[-1]:
+                    self.prev_speed, self.prev_dt = float(seg_v[-1]), float(seg_dt[-1])
+                else:
+                    self.prev_speed = None
+
+            # 静止時間: 累積移動距離がしきい値の倍数を跨いだ時刻を移動とみなす
+            cum = self.path_since_move + np.cumsum(d)
+            steps = np.floor(cum / self.move_threshold_px)
+            moved = steps > np.concatenate(([0.0], steps[:-1]))
+            self.path_since_move = float(cum[-1] - steps[-1] * self.move_threshold_px)
+            if moved.any():
+                self._add_idle(t[moved])
+
+    def _add_idle(self, move_times):
+        """移動時刻の直前の静止時間を各ウィンドウに加算（lock取得済みで呼ぶ）"""
+        prev = np.concatenate(([self.last_move_time], move_times[:-1]))
+        idle_from = prev + self.still_threshold_sec
+        for w in self.windows.values():
+            start = np.maximum(idle_from, w.start_time)
+            w.idle_sec += float(np.clip(move_times - start, 0, None).sum())
+        self.last_move_time = float(move_times[-1])
+
+    def snapshot(self, resolution, now=None):
+        """指定解像度のウィンドウ統計を返して次のウィンドウを開始"""
+        with self.lock:
+            now = time.time() if now is None else now
+            w = self.windows[resolution]
+
+            # 現在進行中の静止時間のうち、このウィンドウ内の分を加算
+            idle = w.idle_sec
+            idle_from = max(self.last_move_time + self.still_threshold_sec, w.start_time)
+            if now > idle_from:
+                idle += now - idle_from
+
+            elapsed = now - w.start_time
+            has_speed = w.speed.n > 0
+            has_accel = w.accel.n > 0
+            stats = {
+                "distance_px": w.distance,
+                "speed_mean_px_per_sec": w.speed.mean if has_speed else 0,
+                "speed_std_px_per_sec": w.speed.std if has_speed else 0,
+                "speed_max_px_per_sec": w.speed_max,
+                "acceleration_mean_px_per_sec2": w.accel.mean if has_accel else 0,
+                "acceleration_std_px_per_sec2": w.accel.std if has_accel else 0,
+                "idle_time_sec": idle,
+                "still_time_ratio": min(1.0, idle / elapsed) if elapsed > 0 else 0,
+                "elapsed_sec": elapsed,
+                "timestamp": now
+            }
+            w.reset(now)
+            return stats
 
 
 class MouseCollector:
     """マウス動作データを収集"""
 
-    def __init__(self):
+    def __init__(self, batch_mode=False, chunk_size=4096, bus=None):
+        """
+        Args:
+            batch_mode: Trueの場合、移動イベントは配列に追記するだけにして
+                        距離・静止時間はチャンク単位でまとめて計算する（高ポーリングレート向け）
+            chunk_size: バッチモードで一度に溜める移動イベント数
+            bus: 移動・クリック（MoveEvent, ClickEvent）を発行するEventBus
+        """
         self.last_position = None
         self.total_distance = 0
         self.click_count = {"left": 0, "right": 0, "double": 0}
-        self.last_move_time = time.time()
-        self.still_time = 0
+        self.total_clicks = 0  # リセットしない累積クリック数（毎秒の差分計算用）
         self.listener = None
+        self.bus = bus
+
+        # 速度・加速度・静止時間（1秒と1分の解像度）
+        self.kinematics = MouseKinematics(resolutions=(1, 60))
 
         # 1分間のリセット用
         self.last_reset_time = time.time()
 
+        # バッチモード用の事前確保バッファ (t, x, y)
+        # 満杯になったチャンクはフックのスレッドでは計算せず、集計スレッドに渡す
+        self.batch_mode = batch_mode
+        self.lock = threading.Lock()
+        # 集計結果（total_distance・kinematics）の更新と、1分ごとの読み出し・リセットを排他にする
+        # （get_kinematics -> flush_moves の中でも取るので再入可能にする）
+        self.process_lock = threading.RLock()
+        if batch_mode:
+            self.chunk_size = chunk_size
+            self.move_chunk = np.empty((chunk_size, 3), dtype=np.float64)
+            self.chunk_len = 0
+            self.full_chunks = deque()     # (バッファ, 行数) 古い順
+            self.free_chunks = []          # 使い回すバッファ
+            self.chunk_event = threading.Event()
+            self.chunk_thread = None
+            self.stopping = False
+
     def on_move(self, x, y):
         """マウス移動イベント"""
         current_time = time.time()
@@ -34,18 +256,87 @@ class MouseCollector:
             )
             self.total_distance += distance
 
-            # 静止時間の更新（移動があった場合はリセット）
-            if distance > 5:  # 5px以上の移動
-                time_diff = current_time - self.last_move_time
-                if time_diff > 1.0:  # 1秒以上静止していた
-                    self.still_time += time_diff
-                self.last_move_time = current_time
-
         self.last_position = (x, y)
+        self.kinematics.update(current_time, x, y)
+        if self.bus is not None:
+            self.bus.publish(MoveEvent(current_time, x, y))
+
+    def on_move_batched(self, x, y):
+        """マウス移動イベント（バッチモード: 配列に追記するだけ）"""
+        current_time = time.time()
+        with self.lock:
+            i = self.chunk_len
+            self.move_chunk[i] = (current_time, x, y)
+            self.chunk_len = i + 1
+            full = self.chunk_len == len(self.move_chunk)
+            if full:
+                self._swap_chunk()
+        if full:
+            self.chunk_event.set()
+        if self.bus is not None:
+            self.bus.publish(MoveEvent(current_time, x, y))
+
+    def _swap_chunk(self):
+        """書き込み中のチャンクを集計待ちに回し、空のバッファに切り替える（lock取得済みで呼ぶ）"""
+        if self.chunk_len == 0:
+            return
+        self.full_chunks.append((self.move_chunk, self.chunk_len))
+        if self.free_chunks:
+            self.move_chunk = self.free_chunks.pop()
+        else:
+            self.move_chunk = np.empty((self.chunk_size, 3), dtype=np.float64)
+        self.chunk_len = 0
+
+    def flush_moves(self):
+        """溜まっている移動イベントをまとめて集計（呼び出し元のスレッドで実行）"""
+        if not self.batch_mode:
+            return
+        with self.lock:
+            self._swap_chunk()
+        self._process_pending()
+
+    def _process_pending(self):
+        """集計待ちのチャンクを古い順にすべて集計"""
+        with self.process_lock:
+            while True:
+                with self.lock:
+                    if not self.full_chunks:
+                        return
+                    chunk, n = self.full_chunks.popleft()
+                self._process_moves(chunk[:n])
+                with self.lock:
+                    if len(self.free_chunks) < 2:
+                        self.free_chunks.append(chunk)
+
+    def _chunk_loop(self):
+        """満杯になったチャンクを集計するバックグラウンドループ"""
+        while True:
+            self.chunk_event.wait()
+            self.chunk_event.clear()
+            if self.stopping:
+                return
+            self._process_pending()
+
+    def _process_moves(self, chunk):
+        """移動距離・運動学をベクトル演算で計算（process_lock取得済みで呼ぶ）"""
+        t, xs, ys = chunk[:, 0], chunk[:, 1], chunk[:, 2]
+        self.kinematics.update_batch(t, xs, ys)
+
+        # 前回チャンクの最終位置から繋げて差分を取る
+        if self.last_position is not None:
+            xs = np.concatenate(([self.last_position[0]], xs))
+            ys = np.concatenate(([self.last_position[1]], ys))
+        distances = np.hypot(np.diff(xs), np.diff(ys))
+        self.total_distance += float(distances.sum())
+
+        self.last_position = (float(xs[-1]), float(ys[-1]))
 
     def on_click(self, x, y, button, pressed):
         """マウスクリックイベント"""
+        if self.bus is not None:
+            self.bus.publish(ClickEvent(time.time(), x, y, getattr(button, "name", str(button)), pressed))
         if pressed:
+            self.total_clicks += 1
             if button == mouse.Button.left:
                 self.click_count["left"] += 1
             elif button == mouse.Button.right:
@@ -59,11 +350,15 @@ class MouseCollector:
         """マウス動作収集を開始"""
         if self.listener is None:
             self.listener = mouse.Listener(
-                on_move=self.on_move,
+                on_move=self.on_move_batched if self.batch_mode else self.on_move,
                 on_click=self.on_click,
                 on_scroll=self.on_scroll
             )
             self.listener.start()
+            if self.batch_mode:
+                self.stopping = False
+                self.chunk_thread = threading.Thread(target=self._chunk_loop, daemon=True)
+                self.chunk_thread.start()
             print("✓ マウス動作収集を開始しました")
 
     def stop(self):
@@ -71,37 +366,51 @@ class MouseCollector:
         if self.listener:
             self.listener.stop()
             self.listener = None
+            if self.chunk_thread:
+                self.stopping = True
+                self.chunk_event.set()
+                self.chunk_thread.join(timeout=2)
+                self.chunk_thread = None
             print("マウス動作収集を停止しました")
 
+    def get_kinematics(self, resolution):
+        """指定解像度（1秒 or 60秒）の速度・加速度・静止時間の統計を取得"""
+        self.flush_moves()
+        return self.kinematics.snapshot(resolution)
+
     def calculate_1min_stats(self):
         """1分間のマウス動作統計を計算"""
-        current_time = time.time()
+        # 集計スレッドのチャンクがflushとリセットの間に入ると、その距離がどの1分にも入らない
+        with self.process_lock:
+            kinematics = self.get_kinematics(60)
+            total_distance = self.total_distance
+            self.total_distance = 0
+        current_time = kinematics["timestamp"]
         elapsed_time = current_time - self.last_reset_time
 
-        # 静止時間の最終更新
-        if current_time - self.last_move_time > 1.0:
-            self.still_time += current_time - self.last_move_time - 1.0
-
         # 静止時間の割合（0.0-1.0）
-        still_ratio = min(1.0, self.still_time / elapsed_time) if elapsed_time > 0 else 0
+        still_ratio = kinematics["still_time_ratio"]
 
         # 移動速度（ピクセル/秒）
-        movement_speed = self.total_distance / elapsed_time if elapsed_time > 0 else 0
+        movement_speed = total_distance / elapsed_time if elapsed_time > 0 else 0
 
         stats = {
-            "movement_distance_px": self.total_distance,
+            "movement_distance_px": total_distance,
             "movement_speed_px_per_sec": movement_speed,
             "click_frequency": sum(self.click_count.values()),
             "left_click_count": self.click_count["left"],
             "right_click_count": self.click_count["right"],
             "still_time_ratio": still_ratio,
+            "speed_mean_px_per_sec": kinematics["speed_mean_px_per_sec"],
+            "speed_std_px_per_sec": kinematics["speed_std_px_per_sec"],
+            "speed_max_px_per_sec": kinematics["speed_max_px_per_sec"],
+            "acceleration_mean_px_per_sec2": kinematics["acceleration_mean_px_per_sec2"],
+            "acceleration_std_px_per_sec2": kinematics["acceleration_std_px_per_sec2"],
             "timestamp": current_time
         }
 
         # カウンタリセット
-        self.total_distance = 0
         self.click_count = {"left": 0, "right": 0, "double": 0}
-        self.still_time = 0
         self.last_reset_time = current_time
 
         return stats
@@ -1,14 +1,17 @@
 import tkinter as tk
 import time
 import random
-import sqlite3
 import sys
 import statistics
 import platform
 import signal  # Ctrl+C用
-import queue   # スレッドセーフ用
 from ctypes import windll
 from pynput import keyboard
+from data_storage import DataStorage
+from event_bus import PvtEvent
+from keyboard_hook import KeyboardHook
+from pvt_timing import ReactionTimer
+from tk_dispatch import TkDispatcher
 
 class PVTTest:
     """
@@ -19,7 +22,18 @@ class PVTTest:
     - ★修正：判定基準を厳格化（非常に高い=0.4秒）
     """
 
-    def __init__(self, db_path="zone_key_data.db", root=None):
+    def __init__(self, db_path="zone_key_data.db", root=None, storage=None,
+                 external_schedule=False, dispatcher=None, keyboard_hook=None, bus=None):
+        """
+        Args:
+            db_path: storageを渡さない場合に使うデータベースのパス
+            root: 共有するTkインスタンス（Noneの場合は自前で作成）
+            storage: 共有するDataStorage（書き込みは必ずこれを経由する）
+            external_schedule: 実行間隔を呼び出し側（DeadlineScheduler）が管理する場合はTrue
+            dispatcher: rootと共有するTkDispatcher（キーフックのスレッドからGUIへの受け渡し用）
+            keyboard_hook: 共有するKeyboardHook（KeystrokeCollector.hook。Noneの場合は自前で1つ張る）
+            bus: 各試行の反応（PvtEvent）を発行するEventBus
+        """
         if platform.system() == "Windows":
             try:
                 windll.shcore.SetProcessDpiAwareness(1)
@@ -39,7 +53,7 @@ class PVTTest:
         # ==========================================
 
         self.db_path = db_path
-        self.setup_database()
+        self.setup_database(storage)
 
         if root is None:
             self.root = tk.Tk()
@@ -49,8 +63,8 @@ class PVTTest:
             self.root = root
             self.standalone = False
 
-        self.ui_queue = queue.Queue()
-        self.root.after(100, self._process_queue)
+        # キーフックのスレッドからメインスレッドへの受け渡し（ポーリングしない）
+        self.dispatcher = dispatcher if dispatcher is not None else TkDispatcher(self.root)
 
         # 状態管理
         self.window = None
@@ -58,34 +72,32 @@ class PVTTest:
         self.indicator = None
         self.current_trial = 0
         self.reaction_times = []
-        self.stimulus_start_time = 0
+        self.timer = ReactionTimer()
+        self.bus = bus
         self.is_active = False
-        self.listener = None
         self.running = True
         
+        # キー入力は常設のフックから受け取り、セッション中だけ有効にする
+        # （セッションごとにフックを張り直さない）
+        self.owns_hook = keyboard_hook is None
+        self.keyboard_hook = keyboard_hook if keyboard_hook is not None else KeyboardHook()
+        self.key_subscription = self.keyboard_hook.subscribe(on_press=self.on_key_press,
+                                                             enabled=False)
+        self.keyboard_hook.start()
+
         # 重複防止用
         self.scheduled_job = None
         self.is_session_running = False
+        self.external_schedule = external_schedule
 
-    def setup_database(self):
+    def setup_database(self, storage=None):
+        """書き込み先を設定（同じDBに2つ目の書き込み接続を開かない）"""
+        self.owns_storage = storage is None
         try:
-            self.conn = sqlite3.connect(self.db_path)
-            self.cursor = self.conn.cursor()
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS pvt_results (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp REAL NOT NULL,
-                    stimulus_time REAL NOT NULL,
-                    reaction_time_ms REAL,
-                    focus_score REAL,
-                    alertness_level TEXT,
-                    is_lapse BOOLEAN,
-                    false_start BOOLEAN
-                )
-            """)
-            self.conn.commit()
+            self.storage = storage if storage is not None else DataStorage(self.db_path)
         except Exception as e:
             print(f"⚠ DB接続エラー: {e}")
+            self.storage = None
 
     # ==========================================================
     #  制御メソッド
@@ -102,9 +114,24 @@ class PVTTest:
             self.scheduled_job = None
         self.start_session()
 
+    def run_once(self, poll_ms=200):
+        """テストを1回だけ実行し、終わるまでmainloopを回す（--test-pvt 用。次回は予約しない）"""
+        self.external_schedule = True
+        self.show_test()
+        self.root.after(poll_ms, self._quit_when_finished, poll_ms)
+        self.dispatcher.run()
+
+    def _quit_when_finished(self, poll_ms):
+        if self.window is None:
+            self.root.quit()
+        else:
+            self.root.after(poll_ms, self._quit_when_finished, poll_ms)
+
     def schedule_next_session(self):
         """次回のテストを予約（重複防止）"""
         if not self.running: return
+        # 外部のスケジューラが管理している場合は自分では予約しない（二重実行の防止）
+        if self.external_schedule: return
 
         if self.scheduled_job:
             self.root.after_cancel(self.scheduled_job)
@@ -149,11 +176,11 @@ class PVTTest:
         pad = 2
         self.indicator = self.canvas.create_oval(pad, pad, w-pad, h-pad, fill="#cccccc", outline="#999999", width=2)
         
-        self.listener = keyboard.Listener(on_press=self.on_key_press)
-        self.listener.start()
+        self.key_subscription.enable()
         
         self.current_trial = 0
         self.reaction_times = []
+        self.timer.reset()
         
         self.run_next_trial()
 
@@ -185,45 +212,39 @@ class PVTTest:
     def show_stimulus(self):
         if not self.window: return
         self.canvas.itemconfig(self.indicator, fill="#ff0000", outline="#cc0000")
-        self.stimulus_start_time = time.time()
+        # 描画を反映させてから刺激の時刻を取る
+        self.timer.mark_stimulus(self.canvas)
         self.is_active = True
 
     # ==========================================================
     #  入力検知
     # ==========================================================
 
-    def on_key_press(self, key):
+    def on_key_press(self, key, input_ns):
+        # input_ns: フックのコールバックの先頭で取った入力の時刻
         if not self.is_active: return
         try:
             if key == keyboard.Key.shift_r or key == keyboard.Key.space:
-                self.record_reaction()
+                self.record_reaction(input_ns)
         except AttributeError:
             pass
 
-    def record_reaction(self):
-        rt_sec = time.time() - self.stimulus_start_time
-        rt_ms = rt_sec * 1000
+    def record_reaction(self, input_ns):
+        """キーフックのスレッドで呼ばれる。判定だけしてメインスレッドに渡す"""
+        rt_ms = self.timer.reaction_ms(input_ns)
         
-        if rt_ms < 100: return 
+        if rt_ms is None or rt_ms < 100: return 
         
-        self.reaction_times.append(rt_ms)
         self.is_active = False
-        self.ui_queue.put("reaction_ok")
+        self.dispatcher.post(self._handle_reaction, input_ns)
 
-    def _process_queue(self):
-        try:
-            while True:
-                msg = self.ui_queue.get_nowait()
-                if msg == "reaction_ok":
-                    self._handle_ui_update()
-        except queue.Empty:
-            pass
-        
-        if self.running:
-            self.root.after(50, self._process_queue)
-
-    def _handle_ui_update(self):
+    def _handle_reaction(self, input_ns):
+        """メインスレッドで反応を記録（受け渡しの遅れは反応時間に含めない）"""
         if not self.window or not self.canvas: return
+        rt_ms, latency_ms = self.timer.record(input_ns)
+        self.reaction_times.append(rt_ms)
+        if self.bus is not None:
+            self.bus.publish(PvtEvent(time.time(), rt_ms, latency_ms))
         self.canvas.itemconfig(self.indicator, fill="#00ff00", outline="#00cc00")
         self.root.update()
         self.root.after(500, self.run_next_trial)
@@ -236,9 +257,7 @@ class PVTTest:
         if self.window:
             self.window.destroy()
             self.window = None
-        if self.listener:
-            self.listener.stop()
-            self.listener = None
+        self.key_subscription.disable()
         
         self.is_session_running = False
 
@@ -253,21 +272,18 @@ class PVTTest:
         alertness = self.get_alertness_level(avg_rt)
         is_lapse = avg_rt > 2000
         
+        latency = self.timer.mean_latency_ms()
+        
         print(f"✅ PVT測定完了: 平均 {avg_rt:.1f}ms -> {alertness} (Score: {score:.2f})")
+        print(f"   入力遅延: 平均 {latency:.2f}ms / 最大 {self.timer.max_latency_ms():.2f}ms（反応時間には含めない）")
 
-        self.save_data(avg_rt, score, alertness, is_lapse)
+        self.save_data(avg_rt, score, alertness, is_lapse, latency)
         self.schedule_next_session()
 
-    def save_data(self, rt, score, level, lapse):
+    def save_data(self, rt, score, level, lapse, latency=None):
         ts = time.time()
         try:
-            self.cursor.execute("""
-                INSERT INTO pvt_results (
-                    timestamp, stimulus_time, reaction_time_ms,
-                    focus_score, alertness_level, is_lapse, false_start
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (ts, ts, rt, score, level, lapse, False))
-            self.conn.commit()
+            self.storage.save_pvt_result(ts, ts, rt, score, level, lapse, False, latency)
         except Exception as e:
             print(f"⚠ DB保存失敗: {e}")
 
@@ -291,9 +307,20 @@ class PVTTest:
         if rt_ms < 2000: return "低い"       # 〜2.0s
         return "非常に低い"                  # 2.0s〜
 
+    def close(self):
+        """キーボードフックの購読をやめてDBを閉じる"""
+        self.running = False
+        self.keyboard_hook.unsubscribe(self.key_subscription)
+        if self.owns_hook:
+            self.keyboard_hook.stop()
+        self.close_db()
+
     def close_db(self):
+        # 共有しているstorageは持ち主（main）が閉じる
+        if not self.owns_storage or self.storage is None:
+            return
         try:
-            self.conn.close()
+            self.storage.close()
         except:
             pass
 
@@ -309,7 +336,6 @@ if __name__ == "__main__":
     print("--- 起動確認: 5秒後に最初のテストを行います ---")
     pvt.root.after(5000, pvt.start_session)
     
-    def check_loop():
-        root.after(100, check_loop)
-    root.after(100, check_loop)
-    root.mainloop()
\ No newline at end of file
+    # mainloopでイベントを待つ（Ctrl+Cで終了）
+    pvt.dispatcher.run()
+    pvt.close()
\ No newline at end of file
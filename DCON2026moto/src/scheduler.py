@@ -0,0 +1,199 @@
+"""
+スケジューラモジュール
+time.monotonic() の期限で周期ジョブを実行する（処理時間や時計の変更でずれない）
+"""
+
+import heapq
+import random
+import threading
+import time
+
+
+class ScheduledJob:
+    """周期ジョブと実行統計"""
+
+    def __init__(self, name, interval_sec, func, jitter_sec=0.0, dispatch=None,
+                 run_in_thread=False, late_after_sec=None):
+        self.name = name
+        self.interval_sec = interval_sec
+        self.func = func
+        self.jitter_sec = jitter_sec
+        self.dispatch = dispatch
+        self.run_in_thread = run_in_thread
+        self.late_after_sec = late_after_sec if late_after_sec is not None \
+            else min(0.1 * interval_sec, 1.0)
+
+        self.nominal = 0.0      # ジッタを含まない本来の期限（この刻みで次の期限を決める）
+        self.deadline = 0.0     # ジッタを加えた実際の期限
+        self.cancelled = False
+        self.worker = None
+
+        # 統計
+        self.runs = 0
+        self.missed = 0         # 前の実行が終わらない・大きく遅れたために飛ばした回数
+        self.late = 0           # late_after_sec 以上遅れて実行した回数
+        self.max_lateness_sec = 0.0
+        self.total_lateness_sec = 0.0
+        self.errors = 0
+
+    def stats(self):
+        return {
+            "interval_sec": self.interval_sec,
+            "runs": self.runs,
+            "missed": self.missed,
+            "late": self.late,
+            "avg_lateness_ms": self.total_lateness_sec / self.runs * 1000 if self.runs else 0.0,
+            "max_lateness_ms": self.max_lateness_sec * 1000,
+            "errors": self.errors,
+        }
+
+
+class DeadlineScheduler:
+    """
+    期限ベースの周期スケジューラ
+
+    次の期限は「前回の期限 + 間隔」で決めるので、処理時間が積み重なってずれることはない。
+    大きく遅れた場合は溜まった回数をまとめて実行せず、飛ばした回数を missed に数える。
+    ジョブは通常スケジューラのスレッドで実行する。GUIなどほかのスレッドで実行する
+    必要がある場合は dispatch（例: TkDispatcher.post）を、時間のかかる処理は
+    run_in_thread=True を指定する。
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.jobs = {}
+        self.heap = []
+        self.seq = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def add(self, name, interval_sec, func, first_delay_sec=None, jitter_sec=0.0,
+            dispatch=None, run_in_thread=False, late_after_sec=None):
+        """
+        周期ジョブを登録
+
+        Args:
+            name: ジョブ名（統計の表示用。同じ名前は置き換える）
+            interval_sec: 実行間隔（秒）
+            func: 実行する関数（引数なし）
+            first_delay_sec: 初回までの時間（Noneの場合はinterval_sec）
+            jitter_sec: 各回の期限を ±jitter_sec の範囲でランダムにずらす
+            dispatch: funcを渡して実行させる関数（例: TkDispatcher.post）
+            run_in_thread: 別スレッドで実行する（前回が終わっていなければその回は飛ばす）
+            late_after_sec: これ以上遅れたら late に数える（Noneの場合は間隔の10%、最大1秒）
+        """
+        job = ScheduledJob(name, interval_sec, func, jitter_sec, dispatch,
+                           run_in_thread, late_after_sec)
+        with self.condition:
+            if name in self.jobs:
+                self.jobs[name].cancelled = True
+            job.nominal = self.clock() + (interval_sec if first_delay_sec is None else first_delay_sec)
+            job.deadline = self._jittered(job)
+            self.jobs[name] = job
+            self._push(job)
+            self.condition.notify()
+        return job
+
+    def remove(self, name):
+        """ジョブを削除"""
+        with self.condition:
+            job = self.jobs.pop(name, None)
+            if job:
+                job.cancelled = True
+
+    def next_run_in(self, name):
+        """次の実行までの秒数（ジョブがなければNone）"""
+        job = self.jobs.get(name)
+        return None if job is None else max(0.0, job.deadline - self.clock())
+
+    def _jittered(self, job):
+        if job.jitter_sec <= 0:
+            return job.nominal
+        return job.nominal + random.uniform(-job.jitter_sec, job.jitter_sec)
+
+    def _push(self, job):
+        self.seq += 1
+        heapq.heappush(self.heap, (job.deadline, self.seq, job))
+
+    def _advance(self, job, now):
+        """次の期限を決める（過ぎてしまった刻みは飛ばして missed に数える）"""
+        job.nominal += job.interval_sec
+        if job.nominal <= now:
+            skipped = int((now - job.nominal) // job.interval_sec) + 1
+            job.missed += skipped
+            job.nominal += skipped * job.interval_sec
+        job.deadline = self._jittered(job)
+        self._push(job)
+
+    def _execute(self, job, deadline, now):
+        lateness = max(0.0, now - deadline)
+        job.runs += 1
+        job.total_lateness_sec += lateness
+        job.max_lateness_sec = max(job.max_lateness_sec, lateness)
+        if lateness >= job.late_after_sec:
+            job.late += 1
+
+        if job.dispatch is not None:
+            job.dispatch(job.func)
+        elif job.run_in_thread:
+            job.worker = threading.Thread(target=self._call, args=(job,), daemon=True)
+            job.worker.start()
+        else:
+            self._call(job)
+
+    def _call(self, job):
+        try:
+            job.func()
+        except Exception as e:
+            job.errors += 1
+            print(f"⚠ スケジュール実行エラー ({job.name}): {e}")
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.heap or self.heap[0][0] > self.clock()):
+                    timeout = None if not self.heap else self.heap[0][0] - self.clock()
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                deadline, _, job = heapq.heappop(self.heap)
+                if job.cancelled:
+                    continue
+                now = self.clock()
+                busy = job.run_in_thread and job.worker is not None and job.worker.is_alive()
+                self._advance(job, now)
+            if busy:
+                # 前回の実行がまだ終わっていない
+                job.missed += 1
+                continue
+            self._execute(job, deadline, now)
+
+    def start(self):
+        """スケジューラを開始"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """スケジューラを停止（実行中のジョブの終了は待たない）"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+
+    def stats(self):
+        """ジョブごとの実行統計"""
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+    def print_stats(self):
+        """実行統計を表示"""
+        print("\n【スケジュール実行統計】")
+        for name, s in self.stats().items():
+            print(f"  {name}: 実行 {s['runs']}回 / 遅延 {s['late']}回 / 欠落 {s['missed']}回 "
+                  f"(平均遅れ {s['avg_lateness_ms']:.1f}ms, 最大 {s['max_lateness_ms']:.1f}ms)")
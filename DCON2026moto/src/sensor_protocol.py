@@ -0,0 +1,91 @@
+"""
+センサー通信プロトコルモジュール
+M5Stackとの固定長バイナリフレーム（同期バイト + struct + CRC）の符号化・復号
+
+フレーム構成（リトルエンディアン, 21バイト）:
+    [0]      同期バイト 0xA5
+    [1:19]   ペイロード: seq(uint16), 温度, 湿度, 気圧, 騒音レベル(float32, 未搭載はNaN)
+    [19:21]  ペイロードのCRC-16/CCITT (uint16)
+
+接続時にホストが MODE_REQUEST を送り、デバイスが MODE_ACK を返せばバイナリ、
+応答がなければ従来のJSON行で通信する。
+"""
+
+import binascii
+import math
+import struct
+
+
+SYNC_BYTE = 0xA5
+PAYLOAD_STRUCT = struct.Struct("<Hffff")
+CRC_STRUCT = struct.Struct("<H")
+FRAME_SIZE = 1 + PAYLOAD_STRUCT.size + CRC_STRUCT.size
+
+MODE_REQUEST = b"MODE BIN\n"
+MODE_ACK = b"ACK BIN"
+
+
+def crc16(data):
+    """CRC-16/CCITT（初期値0xFFFF）"""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(seq, temperature, humidity, pressure, noise_level=math.nan):
+    """1サンプルをバイナリフレームに変換（デバイス側の実装・エミュレータ用）"""
+    payload = PAYLOAD_STRUCT.pack(seq & 0xFFFF, temperature, humidity, pressure, noise_level)
+    return bytes([SYNC_BYTE]) + payload + CRC_STRUCT.pack(crc16(payload))
+
+
+class FrameDecoder:
+    """
+    バイト列からフレームを取り出す復号器
+
+    途中から受信した場合やノイズが混入した場合は、CRCが一致するまで
+    1バイトずつずらして同期バイトを探し直す（再同期）。
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.resyncs = 0
+
+    def feed(self, data):
+        """受信したバイト列を追加し、復号できたサンプルのリストを返す"""
+        self.buffer += data
+        samples = []
+        buf = self.buffer
+        while True:
+            start = buf.find(SYNC_BYTE)
+            if start < 0:
+                if buf:
+                    self.resyncs += 1
+                buf.clear()
+                break
+            if start > 0:
+                # 同期バイトより前のゴミを捨てる
+                self.resyncs += 1
+                del buf[:start]
+            if len(buf) < FRAME_SIZE:
+                break
+
+            payload = bytes(buf[1:1 + PAYLOAD_STRUCT.size])
+            (crc,) = CRC_STRUCT.unpack_from(buf, 1 + PAYLOAD_STRUCT.size)
+            if crc != crc16(payload):
+                # 偽の同期バイト: 1バイト進めて探し直す
+                self.resyncs += 1
+                del buf[:1]
+                continue
+
+            seq, temperature, humidity, pressure, noise_level = PAYLOAD_STRUCT.unpack(payload)
+            sample = {
+                "seq": seq,
+                "temp": temperature,
+                "humidity": humidity,
+                "pressure": pressure
+            }
+            if not math.isnan(noise_level):
+                sample["noise"] = noise_level
+            samples.append(sample)
+            self.frames += 1
+            del buf[:FRAME_SIZE]
+        return samples
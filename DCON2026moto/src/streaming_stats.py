@@ -0,0 +1,108 @@
+"""
+逐次統計モジュール
+イベントごとに O(1) で更新できる平均・分散・最小・最大の集計器
+"""
+
+import math
+from collections import deque
+import numpy as np
+
+
+class RunningStats:
+    """Welford法による平均・分散（追加と取り除きの両方に対応）"""
+
+    __slots__ = ("n", "mean", "m2")
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        """値を追加"""
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def remove(self, x):
+        """追加済みの値を取り除く（スライディングウィンドウ用）"""
+        if self.n <= 1:
+            self.reset()
+            return
+        self.n -= 1
+        delta = x - self.mean
+        self.mean -= delta / self.n
+        self.m2 -= delta * (x - self.mean)
+        # 浮動小数点誤差で負にならないようにする
+        if self.m2 < 0:
+            self.m2 = 0.0
+
+    def add_batch(self, values):
+        """配列をまとめて追加（Chanの並列アルゴリズムで統合）"""
+        n_b = len(values)
+        if n_b == 0:
+            return
+        mean_b = float(np.mean(values))
+        m2_b = float(np.sum((values - mean_b) ** 2))
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * self.n * n_b / n
+        self.n = n
+
+    def reset(self):
+        """集計をリセット"""
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    @property
+    def variance(self):
+        """母分散（np.varと同じ定義）"""
+        return self.m2 / self.n if self.n > 0 else 0.0
+
+    @property
+    def std(self):
+        """母標準偏差（np.stdと同じ定義）"""
+        return math.sqrt(self.variance)
+
+
+class MonotonicMinMax:
+    """単調デックによるスライディングウィンドウの最小値・最大値"""
+
+    __slots__ = ("_min", "_max")
+
+    def __init__(self):
+        # (シーケンス番号, 値) を保持
+        self._min = deque()
+        self._max = deque()
+
+    def add(self, seq, x):
+        """値を追加（seqは単調増加であること）"""
+        while self._min and self._min[-1][1] >= x:
+            self._min.pop()
+        self._min.append((seq, x))
+        while self._max and self._max[-1][1] <= x:
+            self._max.pop()
+        self._max.append((seq, x))
+
+    def evict(self, seq):
+        """シーケンス番号seq以前の値をウィンドウから外す"""
+        while self._min and self._min[0][0] <= seq:
+            self._min.popleft()
+        while self._max and self._max[0][0] <= seq:
+            self._max.popleft()
+
+    def reset(self):
+        """集計をリセット"""
+        self._min.clear()
+        self._max.clear()
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._min else 0
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else 0
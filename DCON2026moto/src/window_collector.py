@@ -4,8 +4,14 @@
 """
 
 import hashlib
+import json
+import re
+import threading
 import time
 import platform
+from collections import OrderedDict
+from streaming_stats import RunningStats
+from event_bus import FocusEvent
 
 # プラットフォームに応じたウィンドウ取得ライブラリ
 system = platform.system()
@@ -42,14 +48,128 @@ CATEGORY_RULES = {
 }
 
 
+class CategoryClassifier:
+    """
+    作業カテゴリ分類器
+
+    分類ルールを1つの正規表現にまとめて1回だけコンパイルし、
+    結果はウィンドウハッシュごとにLRUキャッシュする。
+    判定結果は従来どおり「キーワードが含まれるカテゴリのうちルールの先頭に近いもの」。
+    """
+
+    def __init__(self, rules=None, cache_size=256):
+        """
+        Args:
+            rules: {カテゴリ: [キーワード, ...]}（Noneの場合はCATEGORY_RULES）
+            cache_size: キャッシュするウィンドウ数の上限
+        """
+        self.rules = {category: list(keywords)
+                      for category, keywords in (rules or CATEGORY_RULES).items()}
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.compile()
+
+    def compile(self):
+        """ルールを1つの正規表現にコンパイル"""
+        self.categories = [c for c, keywords in self.rules.items()
+                           if c != "other" and keywords]
+
+        # キーワード(小文字) -> カテゴリの優先順位
+        self.keyword_priority = {}
+        ordered = []
+        for i, category in enumerate(self.categories):
+            for keyword in sorted(self.rules[category], key=len, reverse=True):
+                keyword = keyword.lower()
+                if keyword not in self.keyword_priority:
+                    self.keyword_priority[keyword] = i
+                    ordered.append(re.escape(keyword))
+
+        # 優先度順に並べた先読みパターン: 各位置で最も優先度の高いキーワードを拾い、
+        # 重なり合うキーワードも取りこぼさない（IGNORECASEは遅いため小文字化して照合）
+        self.pattern = re.compile(f"(?=({'|'.join(ordered)}))") if ordered else None
+        self.cache.clear()
+
+    def load_rules_file(self, path, merge=True):
+        """
+        ユーザー定義のルールファイル(JSON)を読み込む
+
+        形式: {"カテゴリ名": ["キーワード", ...], ...}
+        merge=Trueの場合は既存ルールにキーワードを追加し、新しいカテゴリは末尾に加える。
+        """
+        with open(path, encoding="utf-8") as f:
+            user_rules = json.load(f)
+
+        if not merge:
+            self.rules = {"other": []}
+        for category, keywords in user_rules.items():
+            existing = self.rules.setdefault(category, [])
+            existing.extend(k for k in keywords if k not in existing)
+
+        # "other"は常に最後（デフォルト）
+        self.rules["other"] = self.rules.pop("other", [])
+        self.compile()
+        print(f"✓ カテゴリルールを読み込みました: {path}")
+
+    def classify(self, window_title, key=None):
+        """ウィンドウタイトルを分類（keyを渡すとその値で結果をキャッシュ）"""
+        if key is not None:
+            category = self.cache.get(key)
+            if category is not None:
+                self.cache.move_to_end(key)
+                return category
+
+        category = "other"
+        if self.pattern is not None:
+            matches = self.pattern.findall(window_title.lower())
+            if matches:
+                priority = self.keyword_priority
+                category = self.categories[min(priority[m] for m in matches)]
+
+        if key is not None:
+            self.cache[key] = category
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return category
+
+
 class WindowCollector:
     """ウィンドウ情報を収集"""
 
-    def __init__(self):
+    def __init__(self, track_interval_sec=5.0, category_rules_path=None, bus=None):
+        """
+        Args:
+            track_interval_sec: バックグラウンド追跡でのフォーカス確認間隔（秒）
+            category_rules_path: 追加の作業カテゴリルール(JSON)のパス
+            bus: ウィンドウの切り替え（FocusEvent）を発行するEventBus
+        """
+        self.classifier = CategoryClassifier()
+        if category_rules_path:
+            self.classifier.load_rules_file(category_rules_path)
+
         self.window_switches = 0
+        self.total_switches = 0  # リセットしない累積切り替え回数（毎秒の差分計算用）
+        self.bus = bus
         self.last_window = None
         self.last_check_time = time.time()
 
+        # 現在のウィンドウ（タイトルが変わらなければハッシュ・分類を再計算しない）
+        self.last_title = None
+        self.current_hash = None
+        self.current_category = "other"
+
+        # 1分間の集計
+        self.category_time = {}           # カテゴリ別の滞在時間（秒）
+        self.dwell_stats = RunningStats()  # ウィンドウごとの滞在時間（秒）
+        self.window_start_time = None
+        self.last_sample_time = None
+
+        # バックグラウンド追跡
+        self.track_interval_sec = track_interval_sec
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.scheduler = None
+
     def get_active_window_macos(self):
         """macOSでアクティブウィンドウを取得"""
         if not MACOS_AVAILABLE:
@@ -78,68 +198,148 @@ class WindowCollector:
             print(f"Windowsウィンドウ取得エラー: {e}")
             return None
 
-    def get_active_window(self):
-        """プラットフォームに応じてアクティブウィンドウを取得"""
+    def get_active_window_title(self):
+        """プラットフォームに応じてアクティブウィンドウのタイトルを取得"""
         system = platform.system()
 
         if system == "Darwin":  # macOS
-            window_title = self.get_active_window_macos()
+            return self.get_active_window_macos()
         elif system == "Windows":  # Windows
-            window_title = self.get_active_window_windows()
-        else:
-            window_title = None
+            return self.get_active_window_windows()
+        return None
 
-        if not window_title:
-            return None
+    def get_active_window(self):
+        """プラットフォームに応じてアクティブウィンドウを取得"""
+        window_title = self.get_active_window_title()
+        current_time = time.time()
+
+        with self.lock:
+            if not window_title:
+                self.last_sample_time = None
+                return None
+
+            self._update_focus(window_title, current_time)
+
+            return {
+                "window_hash": self.current_hash,
+                "work_category": self.current_category,
+                "timestamp": current_time
+            }
+
+    def _accumulate_category_time(self, current_time):
+        """前回の確認から現在までの時間を現在のカテゴリに計上（lock取得済みで呼ぶ）"""
+        if self.last_sample_time is not None and self.current_hash is not None:
+            elapsed = current_time - self.last_sample_time
+            self.category_time[self.current_category] = \
+                self.category_time.get(self.current_category, 0.0) + elapsed
+        self.last_sample_time = current_time
+
+    def _update_focus(self, window_title, current_time):
+        """フォーカス中のウィンドウを更新し、切り替え・滞在時間を集計（lock取得済みで呼ぶ）"""
+        self._accumulate_category_time(current_time)
+
+        # タイトルが変わっていなければハッシュ化・分類は省略
+        if window_title == self.last_title:
+            return
+        self.last_title = window_title
 
         # プライバシー保護: ウィンドウタイトルをハッシュ化
         window_hash = hashlib.sha256(window_title.encode()).hexdigest()[:16]
 
-        # カテゴリ分類
-        category = self.classify_category(window_title)
+        # カテゴリ分類（ウィンドウハッシュ単位でキャッシュ）
+        category = self.classifier.classify(window_title, key=window_hash)
 
         # ウィンドウ切り替え検出
         if self.last_window != window_hash:
+            if self.window_start_time is not None:
+                self.dwell_stats.add(current_time - self.window_start_time)
             self.window_switches += 1
+            self.total_switches += 1
             self.last_window = window_hash
+            self.window_start_time = current_time
+            if self.bus is not None:
+                self.bus.publish(FocusEvent(current_time, window_hash, category))
 
-        return {
-            "window_hash": window_hash,
-            "work_category": category,
-            "timestamp": time.time()
-        }
+        self.current_hash = window_hash
+        self.current_category = category
 
-    def classify_category(self, window_title):
-        """ウィンドウタイトルから作業カテゴリを分類"""
-        window_title_lower = window_title.lower()
+    def _track_loop(self):
+        """一定間隔でフォーカスを確認するバックグラウンドループ"""
+        while not self.stop_event.wait(self.track_interval_sec):
+            self._track()
 
-        for category, keywords in CATEGORY_RULES.items():
-            if category == "other":
-                continue
-            if any(keyword.lower() in window_title_lower for keyword in keywords):
-                return category
+    def _track(self):
+        try:
+            self.get_active_window()
+        except Exception as e:
+            print(f"⚠ ウィンドウ追跡エラー: {e}")
+
+    def start_tracking(self, scheduler=None):
+        """
+        バックグラウンドでのフォーカス追跡を開始
+
+        Args:
+            scheduler: DeadlineScheduler（指定するとその周期ジョブとして実行し、専用スレッドは作らない）
+        """
+        if self.thread is None and self.scheduler is None:
+            self.get_active_window()
+            if scheduler is not None:
+                self.scheduler = scheduler
+                scheduler.add("window_tracking", self.track_interval_sec, self._track)
+            else:
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self._track_loop, daemon=True)
+                self.thread.start()
+            print(f"✓ ウィンドウ追跡を開始しました（{self.track_interval_sec:.0f}秒ごと）")
+
+    def stop_tracking(self):
+        """バックグラウンドでのフォーカス追跡を停止"""
+        if self.scheduler is not None:
+            self.scheduler.remove("window_tracking")
+            self.scheduler = None
+        if self.thread:
+            self.stop_event.set()
+            self.thread.join(timeout=2)
+            self.thread = None
 
-        return "other"
+    def classify_category(self, window_title):
+        """ウィンドウタイトルから作業カテゴリを分類"""
+        return self.classifier.classify(window_title)
 
     def get_1min_stats(self):
         """1分間のウィンドウ統計"""
-        current_window = self.get_active_window()
-
-        stats = {
-            "window_switch_count": self.window_switches,
-            "timestamp": time.time()
-        }
-
-        # 現在のウィンドウ情報を追加
-        if current_window:
-            stats["window_hash"] = current_window["window_hash"]
-            stats["work_category"] = current_window["work_category"]
+        if self.thread is None and self.scheduler is None:
+            # 追跡していない場合はここで1回だけ確認する
+            current_window = self.get_active_window()
         else:
-            stats["window_hash"] = "unknown"
-            stats["work_category"] = "other"
+            current_window = self.current_hash
+
+        current_time = time.time()
+        with self.lock:
+            self._accumulate_category_time(current_time)
+
+            stats = {
+                "window_switch_count": self.window_switches,
+                "category_time_sec": self.category_time,
+                "avg_dwell_time_sec": self.dwell_stats.mean if self.dwell_stats.n > 0 else 0,
+                "timestamp": current_time
+            }
+
+            # 現在のウィンドウ情報を追加（作業カテゴリは1分間で最も長く滞在したもの）
+            if current_window:
+                stats["window_hash"] = self.current_hash
+                if self.category_time:
+                    stats["work_category"] = max(self.category_time, key=self.category_time.get)
+                else:
+                    stats["work_category"] = self.current_category
+            else:
+                stats["window_hash"] = "unknown"
+                stats["work_category"] = "other"
 
-        # カウンタリセット
-        self.window_switches = 0
+            # カウンタリセット
+            self.window_switches = 0
+            self.category_time = {}
+            self.dwell_stats.reset()
 
         return stats
 
@@ -0,0 +1,144 @@
+"""
+DataStorageのテスト
+"""
+
+import os
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from data_storage import (  # noqa: E402
+    DataStorage, PVT_INSERT_SQL, TRAINING_COLUMNS, TRAINING_INSERT_SQL
+)
+
+
+def training_row(timestamp):
+    row = {c: 0.0 for c in TRAINING_COLUMNS}
+    row.update(timestamp=timestamp, window_hash="abc", work_category="coding")
+    return tuple(row[c] for c in TRAINING_COLUMNS)
+
+
+def test_export_pvt_dataset_from_empty_database(tmp_path):
+    """PVT結果も学習データもない新しいデータベースでもヘッダだけのファイルを書き出す"""
+    storage = DataStorage(str(tmp_path / "empty.db"))
+    output = tmp_path / "dataset.csv"
+    try:
+        assert storage.export_pvt_dataset(str(output), verbose=False)
+    finally:
+        storage.close()
+    df = pd.read_csv(output)
+    assert len(df) == 0
+    assert "pvt_rt" in df.columns
+
+
+def test_export_pvt_dataset_without_pvt_results(tmp_path):
+    """PVT結果がない場合はラベルの付く行がないので、ヘッダだけのファイルを書き出す"""
+    storage = DataStorage(str(tmp_path / "no_pvt.db"))
+    output = tmp_path / "dataset.csv"
+    now = time.time()
+    try:
+        for i in range(3):
+            storage.submit(TRAINING_INSERT_SQL, training_row(now - 60 * (3 - i)))
+        storage.flush()
+        assert storage.export_pvt_dataset(str(output), verbose=False)
+    finally:
+        storage.close()
+    df = pd.read_csv(output)
+    assert len(df) == 0
+    assert "target_focus_score" in df.columns
+
+
+def test_export_pvt_dataset_keeps_column_types_across_chunks(tmp_path):
+    """ラベルのない行を含むチャンクでも、整数の列を 0.0 のように書き出さない"""
+    storage = DataStorage(str(tmp_path / "chunks.db"))
+    output = tmp_path / "dataset.csv"
+    now = time.time()
+    try:
+        # 2行ずつのチャンク: 1つ目は全行にラベルが付き、2つ目は1行目がPVTから離れている
+        for offset in (-4000, -3990, -2000, -10):
+            storage.submit(TRAINING_INSERT_SQL, training_row(now + offset))
+        storage.flush()
+        storage.save_pvt_result(now - 3995, now - 3996, 300.0, 0.8, "high", False)
+        storage.save_pvt_result(now - 5, now - 6, 2500.0, 0.1, "low", True)
+        storage.flush()
+        assert storage.export_pvt_dataset(str(output), chunk_size=2, verbose=False)
+    finally:
+        storage.close()
+    df = pd.read_csv(output, dtype=str)
+    assert list(df["pvt_lapse"]) == ["0", "0", "1"]
+    assert list(df["click_frequency"]) == ["0", "0", "0"]
+
+
+
+def test_incremental_export_keeps_rows_sharing_a_chunk_boundary_timestamp(tmp_path):
+    """チャンクの最後の行と同じ時刻の行も、チャンクの続きからの書き出しで取りこぼさない"""
+    storage = DataStorage(str(tmp_path / "ties.db"))
+    incremental = tmp_path / "incremental.csv"
+    full = tmp_path / "full.csv"
+    now = time.time()
+    options = dict(tolerance_sec=15, chunk_size=2, verbose=False)
+    try:
+        # 2行ずつのチャンク: 2行目と3行目が同じ時刻（チャンクの境目をまたぐ）
+        for offset in (-60, -50, -50, -10, -10):
+            storage.submit(TRAINING_INSERT_SQL, training_row(now + offset))
+        storage.save_pvt_result(now - 55, now - 56, 300.0, 0.8, "high", False)
+        storage.flush()
+        assert storage.export_pvt_dataset(str(incremental), **options)
+        # 新しいPVTで、境目（時刻 -50）のチャンクから書き直しになる
+        storage.save_pvt_result(now - 5, now - 6, 2500.0, 0.1, "low", True)
+        storage.flush()
+        assert storage.export_pvt_dataset(str(incremental), **options)
+        assert storage.export_pvt_dataset(str(full), incremental=False, **options)
+    finally:
+        storage.close()
+    assert len(pd.read_csv(full)) == 5
+    assert incremental.read_text() == full.read_text()
+
+
+def test_commit_drops_only_the_bad_row(tmp_path):
+    """制約違反の行があっても、同じバッチのほかの行は書き込む"""
+    storage = DataStorage(str(tmp_path / "bad_row.db"))
+    now = time.time()
+    try:
+        for ts in (now - 2, None, now):  # timestamp は NOT NULL
+            storage.submit(PVT_INSERT_SQL, (ts, now, 300.0, 0.8, "high", False, False, None))
+        storage.flush()
+        count = storage.read_connection().execute("SELECT COUNT(*) FROM pvt_results").fetchone()[0]
+    finally:
+        storage.close()
+    assert count == 2
+    assert storage.rows_dropped == 1
+
+
+def test_submit_after_close_raises(tmp_path):
+    storage = DataStorage(str(tmp_path / "closed.db"))
+    storage.close()
+    with pytest.raises(RuntimeError):
+        storage.submit(TRAINING_INSERT_SQL, training_row(time.time()))
+
+
+def test_existing_database_is_vacuumed_only_on_request(tmp_path):
+    """既存のDBは開いただけではVACUUMせず、enable_incremental_vacuum() で切り替える"""
+    path = str(tmp_path / "existing.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE legacy (x)")
+    conn.commit()
+    conn.close()
+    storage = DataStorage(path)
+    try:
+        assert storage._auto_vacuum_mode() == 0
+        assert storage.enable_incremental_vacuum()
+        assert storage._auto_vacuum_mode() == 2
+    finally:
+        storage.close()
+
+    new_storage = DataStorage(str(tmp_path / "new.db"))
+    try:
+        assert new_storage._auto_vacuum_mode() == 2
+    finally:
+        new_storage.close()
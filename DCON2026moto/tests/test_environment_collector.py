@@ -0,0 +1,79 @@
+"""
+EnvironmentCollectorのテスト（pyserialの loop:// で実機なしに受信を確認する）
+"""
+
+import json
+import os
+import sys
+import time
+
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from environment_collector import EnvironmentCollector  # noqa: E402
+
+
+def json_line(temperature, humidity=50.0, pressure=1013.0):
+    return (json.dumps({"temp": temperature, "humidity": humidity,
+                        "pressure": pressure}) + "\n").encode()
+
+
+def wait_until(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_reader_keeps_only_max_samples():
+    """受信スレッドは上限付きのdequeに新しいサンプルだけを残す"""
+    collector = EnvironmentCollector(port="loop://", max_samples=5, protocol="json")
+    try:
+        assert collector.reader_thread is not None
+        collector.serial.write(b"".join(json_line(float(i)) for i in range(20)))
+        assert wait_until(lambda: collector.last_data["temperature"] == 19.0)
+        assert len(collector.samples) == 5
+        assert [s[1] for s in collector.samples] == [15.0, 16.0, 17.0, 18.0, 19.0]
+    finally:
+        collector.close()
+
+
+def test_latest_data_does_not_wait_for_the_port():
+    """受信スレッドがreadlineで待っている間も、最新のサンプルはすぐに返る"""
+    collector = EnvironmentCollector(port="loop://", protocol="json")
+    try:
+        collector.serial.write(json_line(23.5, 40.0, 1005.0))
+        assert wait_until(lambda: len(collector.samples) == 1)
+        start = time.monotonic()
+        data = collector.get_latest_data()
+        elapsed = time.monotonic() - start
+    finally:
+        collector.close()
+    # ポートのタイムアウト（1秒）を待たない
+    assert elapsed < 0.1
+    assert data["temperature"] == 23.5
+    assert data["humidity"] == 40.0
+    assert data["sample_count"] == 1
+    assert "mock" not in data
+
+
+def test_falls_back_to_json_without_ack():
+    """ACK BIN が返ってこなければJSON行で通信し、待っている間の行も取り込む"""
+    collector = EnvironmentCollector(protocol="auto")
+    collector.serial = serial.serial_for_url("loop://", timeout=1)
+    try:
+        # loop:// は MODE BIN をそのまま返すだけで、ACKは返さない
+        collector.serial.write(json_line(22.0))
+        start = time.monotonic()
+        mode = collector.negotiate_protocol(timeout=0.3)
+        elapsed = time.monotonic() - start
+    finally:
+        collector.serial.close()
+    assert mode == "json"
+    assert 0.3 <= elapsed < 1.0
+    assert collector.last_data["temperature"] == 22.0
+    # 折り返された MODE BIN の行はJSONではないので解析エラーとして数える
+    assert collector.parse_errors == 1
@@ -0,0 +1,98 @@
+"""
+バイナリフレームの復号（FrameDecoder）とM5Stackエミュレータのテスト
+"""
+
+import math
+import os
+import struct
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from sensor_protocol import (  # noqa: E402
+    FRAME_SIZE, SYNC_BYTE, FrameDecoder, crc16, encode_frame
+)
+
+
+def test_frame_layout_maps_to_sensor_fields():
+    """21バイト = 同期バイト + (seq, 温度, 湿度, 気圧, 騒音) + CRC"""
+    frame = encode_frame(7, 21.5, 40.25, 1000.5, 33.0)
+    assert FRAME_SIZE == 21
+    assert len(frame) == FRAME_SIZE
+    assert frame[0] == SYNC_BYTE
+    assert struct.unpack("<Hffff", frame[1:19]) == (7, 21.5, 40.25, 1000.5, 33.0)
+    assert struct.unpack("<H", frame[19:21])[0] == crc16(frame[1:19])
+
+    assert FrameDecoder().feed(frame) == [
+        {"seq": 7, "temp": 21.5, "humidity": 40.25, "pressure": 1000.5, "noise": 33.0}
+    ]
+
+
+def test_missing_noise_channel_is_omitted():
+    (sample,) = FrameDecoder().feed(encode_frame(1, 20.0, 50.0, 1013.0))
+    assert "noise" not in sample
+
+
+def test_corrupt_crc_is_rejected_and_next_frame_decoded():
+    decoder = FrameDecoder()
+    bad = bytearray(encode_frame(1, 20.0, 50.0, 1013.0))
+    bad[5] ^= 0xFF
+    samples = decoder.feed(bytes(bad) + encode_frame(2, 21.0, 51.0, 1012.0))
+    assert [s["seq"] for s in samples] == [2]
+    assert decoder.frames == 1
+    assert decoder.resyncs > 0
+
+
+def test_resyncs_after_garbage_containing_sync_bytes():
+    """ゴミの中の同期バイトや、ペイロード内の 0xA5 で同期を誤らない"""
+    decoder = FrameDecoder()
+    # seq = 0xA5A5 はペイロードの中に同期バイトを含む
+    frame = encode_frame(0xA5A5, 22.0, 45.0, 1010.0)
+    assert frame[1:].count(SYNC_BYTE) >= 2
+    samples = decoder.feed(b"\x00\xa5\x13\xa5" + frame + frame)
+    assert [s["seq"] for s in samples] == [0xA5A5, 0xA5A5]
+    assert samples[0]["temp"] == 22.0
+
+
+def test_frame_split_across_reads():
+    decoder = FrameDecoder()
+    frame = encode_frame(3, 23.0, 47.0, 1011.0)
+    for i in range(FRAME_SIZE - 1):
+        assert decoder.feed(frame[i:i + 1]) == []
+    (sample,) = decoder.feed(frame[-1:])
+    assert sample["seq"] == 3
+    # 2つのフレームの境目をまたいで分割された場合
+    data = encode_frame(4, 23.0, 47.0, 1011.0) + encode_frame(5, 23.0, 47.0, 1011.0)
+    assert [s["seq"] for s in decoder.feed(data[:30])] == [4]
+    assert [s["seq"] for s in decoder.feed(data[30:])] == [5]
+    assert decoder.resyncs == 0
+
+
+def test_collector_reads_binary_frames_from_emulator():
+    """エミュレータ（pty）相手にバイナリ形式を取り決めて受信する"""
+    pytest.importorskip("pty")
+    from environment_collector import EnvironmentCollector
+    from m5stack_emulator import M5StackEmulator
+
+    emulator = M5StackEmulator(interval_sec=0.02, with_noise=True)
+    port = emulator.start()
+    collector = EnvironmentCollector(port=port, protocol="auto")
+    try:
+        assert collector.mode == "binary"
+        deadline = time.monotonic() + 3.0
+        while collector.decoder.frames < 10 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        stats = collector.get_window_stats()
+    finally:
+        collector.close()
+        emulator.stop()
+    assert collector.decoder.frames >= 10
+    assert stats["protocol"] == "binary"
+    assert 23.5 <= stats["temperature"] <= 24.5
+    assert 48.0 <= stats["humidity"] <= 52.0
+    assert 1012.0 <= stats["pressure"] <= 1014.0
+    assert not math.isnan(stats["noise_level"])
+    assert "mock" not in stats